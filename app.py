@@ -3,6 +3,7 @@ import subprocess
 import os
 import uuid
 import time # Importa time
+import asyncio
 
 # --- Verificação de Ambiente e Instalação de Dependências --- 
 def check_and_install_dependencies():
@@ -48,33 +49,83 @@ if not check_and_install_dependencies():
 # --- Imports e Lógica Principal do App --- 
 # Só importa Gradio e outros DEPOIS de garantir a instalação
 import gradio as gr
-from src.ollama_integration.client import chat_completion, get_available_models
-from src.database.history import save_chat_message, update_feedback
-from typing import List, Tuple, Dict, Any, Generator
+from src.ollama_integration.catalog import get_model_catalog
+from src.ollama_integration.client import resolve_model
+from src.ollama_integration.async_client import achat_completion
+from src.ollama_integration.cancellation import CancelToken
+from src.ollama_integration.residency import ModelResidencyManager
+from src.ollama_integration.scheduler import Priority
+from src.database.history import get_history_writer
+from src.database.retention import HISTORY_RETENTION_DAYS, HistoryRetention
+from src.database.perf_rollup import PerfRollup, message_metrics
+from typing import List, Tuple, Dict, Any, AsyncGenerator
 from src.core.processing import preprocess_user_input # Importa a função
-
-# Busca a lista de modelos ANTES de definir a interface
-available_models = get_available_models()
-# Obtém o modelo padrão do .env para pré-selecionar no dropdown
-default_model = os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
-# Garante que o default_model esteja na lista, caso contrário usa o primeiro da lista
-if default_model not in available_models and available_models:
-    default_model_selected = available_models[0]
-    print(f"AVISO: Modelo padrão '{default_model}' não encontrado. Usando '{default_model_selected}' como padrão na UI.")
-elif not available_models:
-     # Caso extremo: nenhum modelo encontrado, define um fallback
-     default_model_selected = "[Nenhum modelo encontrado]"
-     available_models = [default_model_selected]
-else:
-    default_model_selected = default_model
+from src.core.context_window import ContextWindowManager
+from src.core.answer_reuse import get_answer_index
+
+# Lista de modelos em cache, atualizada em segundo plano: a inicialização não espera pelo Ollama.
+# Até a primeira resposta de /api/tags, o catálogo devolve só o modelo padrão do .env.
+model_catalog = get_model_catalog().start()
+available_models = model_catalog.models()
+default_model_selected = resolve_model(None)
+# A cada quantos segundos a página confere se o catálogo mudou (versão nova -> atualiza o dropdown)
+MODEL_CATALOG_POLL_SECONDS = float(os.getenv("MODEL_CATALOG_POLL_SECONDS", "5"))
+
+# Pré-carrega o modelo padrão em segundo plano: o primeiro turno não paga a carga do modelo
+residency_manager = ModelResidencyManager(pinned=[default_model_selected])
+residency_manager.start()
+
+# Gravação do histórico em segundo plano: a resposta não espera pelo disco
+history_writer = get_history_writer().start()
+# Arquiva conversas antigas e compacta o banco periodicamente (HISTORY_RETENTION_DAYS > 0)
+history_retention = HistoryRetention().start() if HISTORY_RETENTION_DAYS > 0 else None
+# Respostas com 👍 servidas de novo para perguntas parecidas, sem chamar o LLM (ANSWER_REUSE=0 desativa)
+answer_index = get_answer_index().start()
+# Agregados por hora e modelo (latência, TTFT, tokens, erros) das métricas gravadas com cada mensagem
+perf_rollup = PerfRollup().start()
+
+def warm_selected_model(selected_model: str) -> None:
+    """Ao trocar o modelo no dropdown, já começa a carregá-lo (sem esperar a carga)."""
+    if selected_model and selected_model != "[Nenhum modelo encontrado]":
+        residency_manager.warm(selected_model)
+
+def refresh_model_choices(selected_model: str, shown_version: int):
+    """Atualiza as opções do dropdown quando o catálogo de modelos mudar (versão diferente da exibida)."""
+    if model_catalog.version == shown_version:
+        return gr.skip(), shown_version
+    version = model_catalog.version
+    models = model_catalog.models() or [default_model_selected]
+    if selected_model not in models:
+        # O modelo escolhido sumiu do Ollama: volta ao padrão (ou ao primeiro disponível)
+        selected_model = default_model_selected if default_model_selected in models else models[0]
+        print(f"AVISO: Modelo selecionado não está mais disponível. Usando '{selected_model}'.")
+    return gr.update(choices=models, value=selected_model), version
+
+# Limita o histórico enviado a cada turno (CONTEXT_TOKEN_BUDGET / CONTEXT_TOKEN_BUDGETS no .env)
+context_manager = ContextWindowManager()
+# Instruções fixas no início de todo prompt (opcional); ficam no prefixo reaproveitado pelo cache KV
+CHAT_SYSTEM_PROMPT = os.getenv("CHAT_SYSTEM_PROMPT") or None
+
+# Geração em andamento por aba do navegador: uma nova mensagem ou o fechamento da aba a cancela
+active_generations: Dict[str, CancelToken] = {}
+
+def cancel_session_generation(request: gr.Request) -> None:
+    """Chamado quando a aba é fechada: interrompe a geração que ninguém mais vai ler."""
+    token = active_generations.pop(request.session_hash, None) if request else None
+    if token is not None:
+        token.cancel("aba fechada")
+
+# Máximo de respostas geradas em paralelo (streams assíncronos compartilham o mesmo event loop)
+RESPOND_CONCURRENCY_LIMIT = int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "200"))
 
 # Função principal que processa a entrada e gera a resposta
-def respond(
+async def respond(
     message: str,
     chat_history: List[Tuple[str | None, str | None]],
     selected_model: str,
-    session_state: Dict[str, Any]
-) -> Generator[Tuple[List[Tuple[str | None, str | None]], Dict[str, Any], str], None, None]:
+    session_state: Dict[str, Any],
+    request: gr.Request = None
+) -> AsyncGenerator[Tuple[List[Tuple[str | None, str | None]], Dict[str, Any], str], None]:
     """Processa a mensagem do usuário (com pré-processamento), chama o LLM, atualiza o histórico e mostra o tempo.
 
     Args:
@@ -82,6 +133,7 @@ def respond(
         chat_history: Histórico atual do componente Chatbot.
         selected_model: Modelo Ollama selecionado.
         session_state: Dicionário de estado da sessão.
+        request: Requisição do Gradio (injetada); identifica a aba para cancelar a geração anterior.
 
     Yields:
         Tupla com (histórico atualizado, estado atualizado, string de tempo).
@@ -103,18 +155,18 @@ def respond(
         session_state["last_db_message_id"] = None # Inicializa ID
     session_id = session_state["session_id"]
 
-    # Formata mensagens para a API
-    messages = []
-    for user_msg, assistant_msg in chat_history:
-        if user_msg:
-             messages.append({"role": "user", "content": user_msg})
-        if assistant_msg:
-             messages.append({"role": "assistant", "content": assistant_msg})
-    # Adiciona a mensagem PROCESSADA à lista para a API
-    messages.append({"role": "user", "content": processed_message})
+    # Formata mensagens para a API dentro do orçamento de tokens do modelo:
+    # partes fixas primeiro (prefixo estável), resumo dos turnos antigos, janela recente e a mensagem
+    messages = context_manager.build(session_id, chat_history, processed_message, model=selected_model,
+                                     system_prompt=CHAT_SYSTEM_PROMPT)
 
     # Zera o ID da última mensagem antes de gerar nova resposta
     session_state["last_db_message_id"] = None
+    session_state["last_exchange"] = None
+    session_state["last_reused_from"] = None
+
+    # Só o primeiro turno pode reaproveitar (ou ser reaproveitado): os outros dependem da conversa
+    first_turn = not chat_history
 
     # Adiciona a mensagem PROCESSADA ao histórico da UI
     # (Mostra ao usuário a mensagem como ele verá após a limpeza)
@@ -122,30 +174,89 @@ def respond(
     yield chat_history, session_state, time_str
 
     # Chama o LLM com a mensagem processada (implícito, pois está em `messages`)
-    response_generator = chat_completion(messages=messages, model=selected_model, stream=True)
+    # O stream é assíncrono: a espera por tokens não prende uma thread de worker do Gradio
     full_response = ""
+    timings = [] # Recebe o ChatTiming da chamada (TTFT, carga, prompt, geração)
+    first_chunk_time = None # TTFT visto pelo usuário (inclui montagem do contexto e fila)
+
+    # Uma nova mensagem na mesma aba cancela a resposta anterior (o Ollama para de gerá-la)
+    generation_key = request.session_hash if request else session_id
+    previous = active_generations.get(generation_key)
+    if previous is not None:
+        previous.cancel("nova mensagem na mesma sessão")
+
+    # Pergunta de abertura já respondida com 👍 por este modelo: serve a resposta guardada
+    # (o 👎 nela a tira do índice)
+    reused = await asyncio.to_thread(answer_index.lookup, processed_message, selected_model) if first_turn else None
+    if reused is not None:
+        full_response = reused["answer"]
+        chat_history[-1] = (processed_message, full_response)
+        duration = time.time() - start_time
+        time_str = (f"Resposta reaproveitada de uma pergunta parecida em {duration:.2f}s "
+                    f"(similaridade {reused['score']:.2f}). Use 👎 se não servir.")
+        print(time_str)
+        # O ID vem do INSERT feito pela thread de gravação (espera só o commit do lote)
+        session_state["last_db_message_id"] = await asyncio.wrap_future(history_writer.save_chat_message(
+            user_message=processed_message, assistant_message=full_response, session_id=session_id,
+            metrics=message_metrics(selected_model, "reused", duration, ttft_s=duration)))
+        session_state["last_reused_from"] = reused["message_id"]
+        yield chat_history, session_state, time_str
+        return
+
+    cancel = active_generations[generation_key] = CancelToken()
+    stream = achat_completion(messages=messages, model=selected_model, priority=Priority.INTERACTIVE,
+                              on_timing=timings.append, cancel=cancel)
+    finished = False
 
     try:
-        if response_generator:
-            for chunk in response_generator:
-                full_response += chunk
-                # Atualiza a última mensagem usando a processed_message como chave
-                chat_history[-1] = (processed_message, full_response)
-                yield chat_history, session_state, time_str
-        else:
+        async for chunk in stream:
+            if first_chunk_time is None:
+                first_chunk_time = time.time()
+            full_response += chunk
+            # Atualiza a última mensagem usando a processed_message como chave
+            chat_history[-1] = (processed_message, full_response)
+            yield chat_history, session_state, time_str
+        finished = True
+        if not full_response and not cancel.cancelled:
+            # Nenhum chunk recebido: o cliente já logou o erro de conexão/HTTP
             full_response = "Desculpe, ocorreu um erro ao contatar o modelo."
             chat_history[-1] = (processed_message, full_response)
             yield chat_history, session_state, time_str
     finally:
+        if not finished:
+            # Gradio fechou este gerador (aba fechada/evento cancelado): derruba a conexão já
+            cancel.cancel("resposta abandonada")
+        await stream.aclose()
+        if active_generations.get(generation_key) is cancel:
+            del active_generations[generation_key]
         end_time = time.time()
         duration = end_time - start_time
         time_str = f"Tempo de resposta: {duration:.2f}s"
+        if timings:
+            time_str += f" ({timings[0].summary()})"
         print(time_str)
 
-        # Salva no banco de dados e guarda o ID
+        # Salva no banco de dados e guarda o ID; respostas com erro ou canceladas também viram uma linha
+        # (resposta vazia, status 'error'/'cancelled') só pelas métricas de desempenho
         saved_id = None
-        if full_response and full_response != "Desculpe, ocorreu um erro ao contatar o modelo.":
-             saved_id = save_chat_message(user_message=processed_message, assistant_message=full_response, session_id=session_id)
+        if cancel.cancelled:
+            status = "cancelled"
+        elif full_response and full_response != "Desculpe, ocorreu um erro ao contatar o modelo.":
+            status = "ok"
+        else:
+            status = "error"
+        metrics = message_metrics(selected_model, status, duration,
+                                  ttft_s=first_chunk_time - start_time if first_chunk_time else None,
+                                  timing=timings[0] if timings else None)
+        if status == "ok":
+             # O INSERT é gravado em lote por outra thread; o ID chega pelo Future depois do commit
+             saved_id = await asyncio.wrap_future(history_writer.save_chat_message(user_message=processed_message, assistant_message=full_response, session_id=session_id, metrics=metrics))
+             if first_turn:
+                 session_state["last_exchange"] = (processed_message, full_response, selected_model)
+             answer_index.record_generation(duration) # Base do tempo economizado pelos reaproveitamentos
+        else:
+             # Sem resposta: a linha (resposta vazia) fica só pelas métricas; não recebe feedback nem vai para o fine-tuning
+             history_writer.save_chat_message(user_message=processed_message, assistant_message="", session_id=session_id, metrics=metrics)
         
         # Armazena o ID da mensagem salva no estado da sessão
         session_state["last_db_message_id"] = saved_id
@@ -160,7 +271,18 @@ def handle_feedback(feedback_type: str, session_state: Dict[str, Any]) -> None:
 
     if last_message_id is not None and feedback_value != 0:
         print(f"Registrando feedback {feedback_type} para a mensagem ID: {last_message_id}")
-        update_feedback(message_id=last_message_id, feedback_value=feedback_value)
+        history_writer.update_feedback(message_id=last_message_id, feedback_value=feedback_value)
+        reused_from = session_state.get("last_reused_from")
+        if reused_from is not None:
+            # Resposta reaproveitada: o 👎 vale para a original (sai do índice e, no banco, não volta
+            # na próxima carga); o 👍 fica só na cópia, que a carga do índice ignora
+            if feedback_value < 0:
+                history_writer.update_feedback(message_id=reused_from, feedback_value=feedback_value)
+                answer_index.record_feedback(reused_from, feedback_value)
+        else:
+            # Sem last_exchange (turno seguinte da conversa), o 👍 fica só no banco
+            question, answer, model = session_state.get("last_exchange") or (None, None, None)
+            answer_index.record_feedback(last_message_id, feedback_value, question, answer, model)
         # Poderia adicionar um gr.Info ou gr.Warning aqui para confirmar ao usuário
         # Ex: gr.Info(f"Feedback {feedback_type} registrado!") - mas requer retorno
     elif feedback_value == 0:
@@ -209,6 +331,17 @@ with gr.Blocks(theme=gr.themes.Default(primary_hue="blue", secondary_hue="neutra
         )
         send_button = gr.Button("Enviar", scale=1)
 
+    # Versão do catálogo exibida nesta página; o timer só mexe no dropdown quando ela muda
+    catalog_version = gr.State(model_catalog.version)
+    catalog_timer = gr.Timer(MODEL_CATALOG_POLL_SECONDS)
+    catalog_timer.tick(refresh_model_choices, inputs=[model_selector, catalog_version],
+                       outputs=[model_selector, catalog_version], queue=False)
+    demo.load(refresh_model_choices, inputs=[model_selector, catalog_version],
+              outputs=[model_selector, catalog_version], queue=False)
+
+    # Aquece o modelo escolhido assim que a seleção muda
+    model_selector.change(warm_selected_model, inputs=[model_selector], outputs=None, queue=False)
+
     # Ações de Limpeza (Opcional)
     # clear_button = gr.ClearButton([msg_input, chatbot])
 
@@ -224,7 +357,8 @@ with gr.Blocks(theme=gr.themes.Default(primary_hue="blue", secondary_hue="neutra
         [msg_input, chatbot, model_selector, session_state], # Inputs da função
         # Adiciona time_output aos outputs
         [chatbot, session_state, time_output], # Outputs da função (atualiza o chatbot e o state)
-        queue=True # Permite processamento em fila
+        queue=True, # Permite processamento em fila
+        concurrency_limit=RESPOND_CONCURRENCY_LIMIT
     # Limpa APENAS msg_input após a resposta
     ).then(clear_message_input_only, [], [msg_input])
 
@@ -233,10 +367,14 @@ with gr.Blocks(theme=gr.themes.Default(primary_hue="blue", secondary_hue="neutra
         respond,
         [msg_input, chatbot, model_selector, session_state],
         [chatbot, session_state, time_output],
-        queue=True
+        queue=True,
+        concurrency_limit=RESPOND_CONCURRENCY_LIMIT
     # Limpa APENAS msg_input após a resposta
     ).then(clear_message_input_only, [], [msg_input])
 
+    # Fechar a aba interrompe a resposta em andamento
+    demo.unload(cancel_session_generation)
+
     # Conecta botões de feedback à função handle_feedback
     thumb_up_btn.click(
         handle_feedback,
@@ -251,4 +389,8 @@ with gr.Blocks(theme=gr.themes.Default(primary_hue="blue", secondary_hue="neutra
 
 # Lança a aplicação web
 if __name__ == "__main__":
-    demo.launch(share=False) 
\ No newline at end of file
+    demo.launch(share=False)
+    history_writer.stop() # Grava o histórico que ainda estiver na fila
+    answer_index.stop()
+    perf_rollup.stop()
+    print(f"Reaproveitamento de respostas: {answer_index.status()}") 
\ No newline at end of file
@@ -0,0 +1,70 @@
+# benchmarks/bench_connection_pool.py
+# Compara a latência por requisição com e sem pool de conexões keep-alive,
+# usando um servidor local que imita o Ollama (sem depender de GPU/modelo).
+#
+# Uso: python benchmarks/bench_connection_pool.py [--requests 500]
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+# Adiciona o diretório raiz ao path para encontrar src/ e tests/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.ollama_integration.client import OllamaClient
+from tests.fake_ollama import FakeOllamaServer
+
+MESSAGES = [{"role": "user", "content": "Descreva a tabela CLIENTES."}]
+
+def summarize(label: str, latencies: list[float]) -> None:
+    latencies_ms = sorted(x * 1000 for x in latencies)
+    p95 = latencies_ms[int(len(latencies_ms) * 0.95) - 1]
+    print(f"{label:<22} média={statistics.mean(latencies_ms):7.3f} ms  "
+          f"p50={statistics.median(latencies_ms):7.3f} ms  p95={p95:7.3f} ms")
+
+def bench_without_pool(url: str, n: int) -> list[float]:
+    """Uma conexão nova por requisição (comportamento antigo: requests.post direto)."""
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        response = requests.post(url, json={"model": "llama3", "messages": MESSAGES, "stream": False})
+        response.json()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def bench_with_pool(url: str, n: int) -> list[float]:
+    """Sessão compartilhada do OllamaClient (conexão keep-alive reutilizada)."""
+    latencies = []
+    with OllamaClient(api_url=url) as client:
+        for _ in range(n):
+            start = time.perf_counter()
+            client.chat_completion(MESSAGES, model="llama3", stream=False)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de pool de conexões do cliente Ollama.")
+    parser.add_argument("--requests", type=int, default=500, help="Número de requisições por cenário.")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING) # O cliente loga em DEBUG por padrão
+
+    with FakeOllamaServer() as server:
+        bench_with_pool(server.chat_url, 10) # Aquecimento
+        connections_before = server.connections
+        no_pool = bench_without_pool(server.chat_url, args.requests)
+        connections_no_pool = server.connections - connections_before
+
+        connections_before = server.connections
+        pooled = bench_with_pool(server.chat_url, args.requests)
+        connections_pooled = server.connections - connections_before
+
+    print(f"--- {args.requests} requisições /api/chat (stream=False) contra servidor local ---")
+    summarize(f"sem pool ({connections_no_pool} conexões)", no_pool)
+    summarize(f"com pool ({connections_pooled} conexões)", pooled)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# benchmarks/bench_history_queries.py
+# Latência das consultas do histórico num banco sintético grande (padrão: 10 milhões de
+# linhas), antes (schema v1: só a chave primária) e depois das migrações com índices,
+# chat_sessions e FTS5: listagem paginada de sessões, recarga de uma sessão, contagem por
+# período e busca por termos (LIKE antes, FTS5 depois).
+#
+# Uso: python benchmarks/bench_history_queries.py [--rows 10000000] [--db caminho.db] [--repeat 20]
+#   Sem --db o banco é criado num diretório temporário e apagado no fim.
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Adiciona o diretório raiz ao path para encontrar src/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.database import history
+from src.database.history import ConnectionManager
+
+TURNS_PER_SESSION = 8
+CONCURRENT_SESSIONS = 8 # Sessões intercaladas, como usuários simultâneos
+START = datetime(2024, 1, 1)
+TABLES = [f"TAB_{n:04d}" for n in range(997)] # Cada tabela aparece em ~1/997 das perguntas
+
+def session_of(i: int) -> str:
+    block, offset = divmod(i, TURNS_PER_SESSION * CONCURRENT_SESSIONS)
+    return f"sessao-{block * CONCURRENT_SESSIONS + offset % CONCURRENT_SESSIONS:08d}"
+
+def synthetic_rows(rows: int, seconds_per_row: float):
+    for i in range(rows):
+        timestamp = (START + timedelta(seconds=i * seconds_per_row)).strftime("%Y-%m-%d %H:%M:%S")
+        table = TABLES[i % len(TABLES)]
+        feedback = 1 if i % 10 == 0 else -1 if i % 37 == 0 else None
+        yield (session_of(i), timestamp, f"Pergunta {i} sobre a tabela {table}",
+               f"Resposta {i}: a coluna {table}_VALOR guarda o total.", feedback)
+
+def build_v1(path: str, rows: int) -> None:
+    """Cria o banco no schema v1 (só a chave primária) e o preenche em massa."""
+    conn = ConnectionManager(path=path, auto_migrate=False).connection()
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("BEGIN")
+    history.MIGRATIONS[0](conn)
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    started = time.perf_counter()
+    conn.executemany("INSERT INTO chat_history(session_id, timestamp, user_message, assistant_message, feedback) "
+                     "VALUES(?,?,?,?,?)", synthetic_rows(rows, 365 * 86400 / rows))
+    conn.commit()
+    conn.close()
+    print(f"Banco sintético: {rows} linhas em {time.perf_counter() - started:.1f}s ({os.path.getsize(path) / 2**20:.0f} MiB)")
+
+def timed(label: str, fn, repeat: int) -> None:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    print(f"  {label:<38} p50={statistics.median(latencies):10.3f} ms  máx={max(latencies):10.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de consultas do histórico de chat.")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--db", help="Arquivo do banco sintético (reutilizado se já existir no schema v1)")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetições de cada consulta indexada")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    tmp = None
+    path = args.db
+    if path is None:
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, "history_bench.db")
+    if not os.path.exists(path):
+        build_v1(path, args.rows)
+
+    manager = history._default_manager = ConnectionManager(path=path, auto_migrate=False) # Migra abaixo, medindo
+    conn = manager.connection()
+    rows = conn.execute("SELECT MAX(id) FROM chat_history").fetchone()[0]
+    rng = random.Random(42)
+    sessions = [session_of(rng.randrange(rows)) for _ in range(args.repeat)]
+    day = (START + timedelta(days=180)).strftime("%Y-%m-%d")
+    day_range = (f"{day} 00:00:00", f"{day} 23:59:59")
+
+    def load_random_session():
+        return history.load_session(sessions[rng.randrange(len(sessions))])
+
+    def count_day():
+        return conn.execute("SELECT COUNT(*) FROM chat_history WHERE timestamp BETWEEN ? AND ?", day_range).fetchone()
+
+    if conn.execute("PRAGMA user_version").fetchone()[0] == 1:
+        print("Antes (schema v1, só a chave primária; 1 repetição):")
+        timed("sessões recentes (GROUP BY)", lambda: conn.execute(
+            "SELECT session_id, COUNT(*), MAX(id) AS last_id FROM chat_history "
+            "GROUP BY session_id ORDER BY last_id DESC LIMIT 50").fetchall(), 1)
+        timed("recarregar uma sessão", load_random_session, 1)
+        timed("contagem de um dia", count_day, 1)
+        like = "SELECT id FROM chat_history WHERE user_message LIKE ? OR assistant_message LIKE ? ORDER BY id DESC LIMIT 20"
+        timed("busca LIKE (termo raro)", lambda: conn.execute(like, (f"%Pergunta {rows // 3} %",) * 2).fetchall(), 1)
+        timed("busca LIKE (uma tabela, 20 resultados)", lambda: conn.execute(like, ("%TAB_0123%",) * 2).fetchall(), 1)
+
+        started = time.perf_counter()
+        version = history.migrate(conn)
+        print(f"Migração para v{version}: {time.perf_counter() - started:.1f}s")
+
+    print(f"Depois (schema v{history.SCHEMA_VERSION}; {args.repeat} repetições):")
+    timed("sessões recentes (1ª página)", lambda: history.list_sessions(limit=50), args.repeat)
+    deep = conn.execute("SELECT last_id FROM chat_sessions ORDER BY last_id DESC LIMIT 1 OFFSET ?",
+                        (rows // TURNS_PER_SESSION // 2,)).fetchone()[0]
+    timed("sessões (página no meio da lista)", lambda: history.list_sessions(limit=50, before=deep), args.repeat)
+    timed("recarregar uma sessão", load_random_session, args.repeat)
+    timed("contagem de um dia", count_day, args.repeat)
+    timed("busca FTS5 (termo raro)", lambda: history.search_history(str(rows // 3)), args.repeat)
+    timed("busca FTS5 (raro + termo em toda linha)", lambda: history.search_history(f"Pergunta {rows // 3}"), args.repeat)
+    timed("busca FTS5 (uma tabela, 20 resultados)", lambda: history.search_history("TAB_0123"), args.repeat)
+    timed("busca FTS5 (uma tabela, mais recentes)", lambda: history.search_history("TAB_0123", order="recent"), args.repeat)
+    timed("busca FTS5 (tabela + 👍 + período)", lambda: history.search_history(
+        "TAB_0123", feedback=1, since=START + timedelta(days=90), until=START + timedelta(days=180)), args.repeat)
+
+    manager.close_all()
+    if tmp is not None:
+        tmp.cleanup()
+
+if __name__ == "__main__":
+    main()
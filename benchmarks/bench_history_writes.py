@@ -0,0 +1,93 @@
+# benchmarks/bench_history_writes.py
+# Latência de gravação no histórico de chat com 1, 8 e 32 threads escritoras:
+# conexão nova por gravação em journal de rollback (comportamento antigo) contra a
+# conexão persistente por thread em WAL (ConnectionManager).
+#
+# Uso: python benchmarks/bench_history_writes.py [--writes 2000] [--threads 1,8,32]
+import argparse
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Adiciona o diretório raiz ao path para encontrar src/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.database import history
+from src.database.history import ConnectionManager
+
+USER_MESSAGE = "Quais colunas da tabela PEDIDOS guardam o valor total?"
+ASSISTANT_MESSAGE = "A coluna PED_VALOR guarda o valor total do pedido. " * 8
+
+def write_per_connection(path: str) -> None:
+    """Comportamento antigo: abre, grava, faz commit e fecha a cada mensagem."""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("INSERT INTO chat_history(user_message, assistant_message, session_id) VALUES(?,?,?)",
+                     (USER_MESSAGE, ASSISTANT_MESSAGE, "bench"))
+        conn.commit()
+    finally:
+        conn.close()
+
+def run(threads: int, writes: int, write) -> tuple[list[float], float, int]:
+    """Divide `writes` gravações entre `threads` threads; retorna latências, duração total e erros."""
+    latencies, errors, lock = [], [0], threading.Lock()
+    per_thread = max(1, writes // threads)
+
+    def worker():
+        local = []
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            try:
+                write()
+            except sqlite3.Error:
+                with lock:
+                    errors[0] += 1
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return latencies, time.perf_counter() - started, errors[0]
+
+def report(label: str, latencies: list[float], elapsed: float, errors: int) -> None:
+    latencies_ms = sorted(x * 1000 for x in latencies)
+    p95 = latencies_ms[max(0, int(len(latencies_ms) * 0.95) - 1)]
+    print(f"  {label:<28} média={statistics.mean(latencies_ms):8.3f} ms  p50={statistics.median(latencies_ms):8.3f} ms  "
+          f"p95={p95:8.3f} ms  {len(latencies) / elapsed:8.0f} gravações/s  erros={errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de gravação no histórico de chat.")
+    parser.add_argument("--writes", type=int, default=2000, help="Gravações por cenário.")
+    parser.add_argument("--threads", default="1,8,32", help="Números de threads escritoras.")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING) # history loga cada gravação em INFO
+
+    for threads in (int(n) for n in args.threads.split(",")):
+        print(f"{threads} thread(s), {args.writes} gravações:")
+        with tempfile.TemporaryDirectory() as tmp:
+            old_path = os.path.join(tmp, "rollback.db")
+            history._default_manager = ConnectionManager(path=old_path)
+            history.init_db() # Cria a tabela...
+            history._default_manager.close_all()
+            with sqlite3.connect(old_path) as conn: # ...e volta ao journal de rollback antigo
+                conn.execute("PRAGMA journal_mode=DELETE")
+            report("conexão por gravação", *run(threads, args.writes, lambda: write_per_connection(old_path)))
+
+            history._default_manager = ConnectionManager(path=os.path.join(tmp, "wal.db"))
+            history.init_db()
+            report("conexão persistente + WAL", *run(threads, args.writes,
+                                                     lambda: history.save_chat_message(USER_MESSAGE, ASSISTANT_MESSAGE, "bench")))
+            history._default_manager.close_all()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# benchmarks/bench_prefix_reuse.py
+# Compara o custo de avaliação do prompt em sessões multi-turno longas:
+# janela deslizante (o início anda a cada turno, como antes) contra a montagem com
+# prefixo estável (janela que salta + partes fixas primeiro), que deixa o Ollama /
+# llama.cpp reaproveitar o cache KV do prefixo.
+#
+# Uso:
+#   python benchmarks/bench_prefix_reuse.py [--sessions 5] [--turns 30] [--budget 1500]
+#       Simulação offline: tokens de prompt a avaliar (estimados) por turno.
+#   python benchmarks/bench_prefix_reuse.py --url http://localhost:11434/api/chat --model llama3 --turns 15
+#       Contra um Ollama real: soma o prompt_eval_count reportado (tokens realmente avaliados).
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+
+# Adiciona o diretório raiz ao path para encontrar src/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.core.context_window import ContextWindowManager
+
+SYSTEM_PROMPT = "Você é um assistente que responde dúvidas sobre o banco de dados Firebird da empresa."
+SCHEMA_CONTEXT = {
+    "CLIENTES": ["CLI_CODIGO", "CLI_NOME", "CLI_CIDADE", "CLI_UF"],
+    "PEDIDOS": ["PED_CODIGO", "PED_CLIENTE", "PED_DATA", "PED_VALOR"],
+    "ITENS_PEDIDO": ["ITP_PEDIDO", "ITP_PRODUTO", "ITP_QTDE", "ITP_VALOR"],
+    "PRODUTOS": ["PRO_CODIGO", "PRO_DESCRICAO", "PRO_PRECO"],
+}
+WORDS = ["tabela", "cliente", "pedido", "valor", "data", "produto", "coluna", "chave", "filtro", "total"]
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def run(manager: ContextWindowManager, sessions: int, turns: int, seed: int, chat=None) -> list[int]:
+    """Roda as sessões; retorna os tokens de prompt a avaliar (estimados ou reportados) por turno."""
+    rng = random.Random(seed)
+    evaluated = []
+    for s in range(sessions):
+        history = []
+        for t in range(turns):
+            message = f"Pergunta {t}: " + synthetic_text(rng, 30)
+            reused_before = manager.tracker.reused_tokens
+            messages = manager.build(f"sessao-{s}", history, message, model="bench",
+                                     system_prompt=SYSTEM_PROMPT, schema_context=SCHEMA_CONTEXT)
+            if chat is None:
+                # Só o que não repete o prompt anterior precisa ser avaliado
+                evaluated.append(manager.count(messages) - (manager.tracker.reused_tokens - reused_before))
+                reply = synthetic_text(rng, 60)
+            else:
+                reply, prompt_eval = chat(messages)
+                evaluated.append(prompt_eval)
+            history.append((message, reply))
+    return evaluated
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--budget", type=int, default=1500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="URL /api/chat de um Ollama real (omita para simular)")
+    parser.add_argument("--model", default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    chat = None
+    if args.url:
+        from src.ollama_integration.client import OllamaClient
+        from src.ollama_integration.telemetry import MetricsSink
+        client = OllamaClient(api_url=args.url, metrics=MetricsSink(), coalesce=False)
+
+        def chat(messages):
+            timings = []
+            reply = client.chat_completion(messages, model=args.model, options={"num_predict": 64},
+                                           on_timing=timings.append) or ""
+            return reply, (timings[0].prompt_eval_count or 0) if timings else 0
+
+    print(f"{args.sessions} sessões x {args.turns} turnos, orçamento {args.budget} tokens"
+          f" ({'Ollama: prompt_eval_count' if chat else 'tokens estimados'})")
+    results = {}
+    for label, refill in (("janela deslizante", 1.0), ("prefixo estável", None)):
+        manager = ContextWindowManager(budget=args.budget, summarizer=None, refill_ratio=refill)
+        evaluated = run(manager, args.sessions, args.turns, args.seed, chat)
+        results[label] = evaluated
+        late = evaluated[len(evaluated) // 2:] # Segunda metade: janela já cheia
+        stats = manager.prefix_stats()
+        print(f"{label:<18} avaliados={sum(evaluated):>8}  média/turno={statistics.mean(evaluated):7.1f}  "
+              f"média/turno (2ª metade)={statistics.mean(late):7.1f}  reaproveitamento={stats['prefix_reuse_rate']:.1%}")
+
+    before, after = sum(results["janela deslizante"]), sum(results["prefixo estável"])
+    if before:
+        print(f"Economia na avaliação do prompt: {1 - after / before:.1%}")
+
+if __name__ == "__main__":
+    main()
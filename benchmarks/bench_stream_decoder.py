@@ -0,0 +1,116 @@
+# benchmarks/bench_stream_decoder.py
+# Mede a vazão (chunks/s) da decodificação do stream NDJSON do /api/chat:
+# o laço antigo do chat_completion (f-strings de DEBUG por linha, decode + json.loads,
+# `+=` na resposta) contra o decodificador `iter_chat_chunks`.
+#
+# Uso:
+#   python benchmarks/bench_stream_decoder.py [--tokens 10000] [--rounds 5]
+#   python benchmarks/bench_stream_decoder.py --record stream.ndjson   # grava o stream sintético
+#   python benchmarks/bench_stream_decoder.py --input stream.ndjson    # usa um stream gravado do Ollama
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+# Adiciona o diretório raiz ao path para encontrar src/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.ollama_integration.ndjson import StreamState, iter_chat_chunks
+
+WORDS = ["tabela", "cliente", "código", "pedido", "valor", "data", "emissão", "nota", "fiscal",
+         "produto", "estoque", "vendedor", "chave", "estrangeira", "referência", "status"]
+
+def synthetic_stream(tokens: int, seed: int = 42) -> list[bytes]:
+    """Gera linhas no formato do Ollama (/api/chat, stream=True), uma por token."""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(tokens):
+        lines.append(json.dumps({
+            "model": "llama3",
+            "created_at": "2024-05-01T12:00:00.000000Z",
+            "message": {"role": "assistant", "content": rng.choice(WORDS) + " "},
+            "done": False,
+        }, ensure_ascii=False).encode("utf-8"))
+    lines.append(json.dumps({
+        "model": "llama3", "created_at": "2024-05-01T12:00:05.000000Z",
+        "message": {"role": "assistant", "content": ""}, "done": True,
+        "total_duration": 5_000_000_000, "eval_count": tokens, "eval_duration": 4_500_000_000,
+    }).encode("utf-8"))
+    return lines
+
+def legacy_decode(lines: list[bytes]) -> str:
+    """Cópia do laço antigo do stream_generator (antes do iter_chat_chunks)."""
+    full_response_content = ""
+    line_count = 0
+    for line in lines:
+        line_count += 1
+        logging.debug(f"Stream linha {line_count} RAW: {line}")
+        if line:
+            decoded_line = line.decode('utf-8')
+            logging.debug(f"Stream linha {line_count} DECODED: {decoded_line}")
+            json_line = json.loads(decoded_line)
+            logging.debug(f"Stream linha {line_count} JSON: {json_line}")
+            chunk = json_line.get("message", {}).get("content", "")
+            done = json_line.get("done", False)
+            logging.debug(f"Stream linha {line_count} CHUNK: '{chunk}', DONE: {done}")
+            if chunk:
+                full_response_content += chunk
+            if done:
+                break
+    return full_response_content
+
+def new_decode(lines: list[bytes]) -> str:
+    state = StreamState()
+    for _ in iter_chat_chunks(lines, state):
+        pass
+    return state.text
+
+def measure(label: str, decode, lines: list[bytes], rounds: int) -> str:
+    best = float("inf")
+    result = ""
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = decode(lines)
+        best = min(best, time.perf_counter() - start)
+    chunks = len(lines) - 1
+    print(f"{label:<32} {chunks / best:12,.0f} chunks/s  ({best * 1000:8.2f} ms por stream)")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do decodificador NDJSON do stream do Ollama.")
+    parser.add_argument("--tokens", type=int, default=10_000, help="Tokens do stream sintético.")
+    parser.add_argument("--rounds", type=int, default=5, help="Repetições por cenário (vale a melhor).")
+    parser.add_argument("--record", metavar="ARQUIVO", help="Grava o stream sintético em ARQUIVO e sai.")
+    parser.add_argument("--input", metavar="ARQUIVO", help="Usa um stream NDJSON gravado em vez do sintético.")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, "rb") as f:
+            lines = [line.rstrip(b"\r\n") for line in f if line.strip()]
+    else:
+        lines = synthetic_stream(args.tokens)
+    if args.record:
+        with open(args.record, "wb") as f:
+            f.writelines(line + b"\n" for line in lines)
+        print(f"Stream com {len(lines)} linhas gravado em {args.record}")
+        return
+
+    # Handler que descarta a saída: mede o custo de formatar, não o de escrever no terminal
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.NullHandler())
+
+    print(f"--- Stream de {len(lines) - 1} chunks, melhor de {args.rounds} ---")
+    results = []
+    for level in (logging.DEBUG, logging.INFO):
+        root.setLevel(level)
+        name = logging.getLevelName(level)
+        results.append(measure(f"antigo (LOG_LEVEL={name})", legacy_decode, lines, args.rounds))
+        results.append(measure(f"iter_chat_chunks (LOG_LEVEL={name})", new_decode, lines, args.rounds))
+    assert len(set(results)) == 1, "Os decodificadores produziram textos diferentes"
+
+if __name__ == "__main__":
+    main()
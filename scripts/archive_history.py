@@ -0,0 +1,30 @@
+# scripts/archive_history.py
+# Move conversas antigas do chat_history.db para o arquivo morto (jsonl.gz por mês) e
+# compacta o banco. Pode rodar pelo cron; app.py também roda periodicamente se
+# HISTORY_RETENTION_DAYS estiver definido.
+#
+# Uso: python scripts/archive_history.py --days 180 [--archive-dir data/history_archive]
+#      python scripts/archive_history.py --days 0   (só compacta)
+import argparse
+import json
+import logging
+import os
+import sys
+
+# Adiciona o diretório raiz ao path para encontrar src/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.database.retention import HISTORY_ARCHIVE_DIR, HISTORY_RETENTION_DAYS, HistoryRetention
+
+def main():
+    parser = argparse.ArgumentParser(description="Retenção do histórico de chat.")
+    parser.add_argument("--days", type=int, default=HISTORY_RETENTION_DAYS,
+                        help="Arquiva conversas sem mensagens há mais que isso (0: só compacta)")
+    parser.add_argument("--archive-dir", default=HISTORY_ARCHIVE_DIR)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    report = HistoryRetention(max_age_days=args.days, archive_dir=args.archive_dir).run_once()
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# scripts/bulk_generate_descriptions.py
+# Gera sugestões de descrição (heurística + IA) para todas as relações sem descrição,
+# gravando-as em uma fila de revisão. Pode ser interrompido e retomado a qualquer momento.
+#
+# Uso (em segundo plano):
+#   nohup python scripts/bulk_generate_descriptions.py --workers 3 > bulk_descriptions.log 2>&1 &
+import argparse
+import json
+import logging
+import os
+import sys
+
+# Adiciona o diretório raiz ao path para encontrar src/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.core.bulk_descriptions import BulkDescriptionJob
+from src.ollama_integration.cache import ResponseCache
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Constantes de Arquivo ---
+METADATA_FILE = 'etapas-sem-gpu/schema_metadata.json'
+TECHNICAL_SCHEMA_FILE = 'data/combined_schema_details.json'
+OVERVIEW_COUNTS_FILE = 'data/overview_counts.json'
+REVIEW_QUEUE_FILE = 'data/ai_description_review_queue.jsonl' # Sugestões aguardando revisão humana
+PROGRESS_FILE = 'data/bulk_descriptions_progress.jsonl' # Checkpoint (uma linha por tarefa concluída)
+AI_RESPONSE_CACHE_FILE = 'data/llm_response_cache.db' # Mesmo cache do Streamlit
+
+def load_json(file_path):
+    """Carrega um arquivo JSON (None se não existir ou for inválido)."""
+    if not os.path.exists(file_path):
+        logger.error(f"Arquivo não encontrado: '{file_path}'")
+        return None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        logger.error(f"Erro ao decodificar JSON de {file_path}: {e}")
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera sugestões de descrição em lote para o schema.")
+    parser.add_argument("--workers", type=int, default=3, help="Requisições simultâneas ao Ollama (paralelismo limitado).")
+    parser.add_argument("--model", default=None, help="Modelo Ollama (padrão: OLLAMA_DEFAULT_MODEL).")
+    parser.add_argument("--limit", type=int, default=None, help="Processa só as N primeiras relações (teste).")
+    parser.add_argument("--no-cache", action="store_true", help="Não reutiliza respostas do cache de IA.")
+    args = parser.parse_args()
+
+    technical_schema = load_json(TECHNICAL_SCHEMA_FILE)
+    metadata = load_json(METADATA_FILE)
+    overview_counts = load_json(OVERVIEW_COUNTS_FILE)
+    if technical_schema is None or metadata is None or overview_counts is None:
+        logger.error("Não foi possível carregar os arquivos de entrada. Abortando.")
+        sys.exit(1)
+
+    relation_names = list(overview_counts.keys())[:args.limit]
+    cache = None if args.no_cache else ResponseCache(path=AI_RESPONSE_CACHE_FILE)
+    job = BulkDescriptionJob(
+        technical_schema, metadata,
+        review_queue_path=REVIEW_QUEUE_FILE,
+        progress_path=PROGRESS_FILE,
+        max_workers=args.workers,
+        cache=cache,
+        model=args.model,
+    )
+    logger.info(f"Iniciando geração em lote para {len(relation_names)} relações com {args.workers} workers.")
+    try:
+        counts = job.run(relation_names)
+    except KeyboardInterrupt:
+        logger.warning("Execução interrompida. Rode o script novamente para continuar de onde parou.")
+        sys.exit(130)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    logger.info(f"Concluído: {counts['suggested']} sugestões na fila de revisão ({REVIEW_QUEUE_FILE}), "
+                f"{counts['empty']} sem resposta, {counts['failed']} falhas (serão refeitas na próxima execução).")
+    print(f"DONE:{counts['suggested']}:{counts['empty']}:{counts['failed']}", flush=True)
+
+if __name__ == "__main__":
+    main()
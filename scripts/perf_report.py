@@ -0,0 +1,70 @@
+# scripts/perf_report.py
+# Relatório de latência do chat por modelo, a partir dos agregados por hora (chat_perf_hourly),
+# sem ler as mensagens. Agrega antes as horas pendentes (o app.py também faz isso periodicamente).
+#
+# Uso:
+#   python scripts/perf_report.py --since "2025-06-01"                 # p50/p95/p99 por modelo
+#   python scripts/perf_report.py --split "2025-06-10 14:00" --window 168
+#       # o p95 piorou depois da troca de modelo? (7 dias de cada lado)
+import argparse
+import json
+import logging
+import os
+import sys
+
+# Adiciona o diretório raiz ao path para encontrar src/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.database.perf_rollup import PerfRollup, compare_periods, latency_report
+
+def _print_models(models):
+    print(f"{'modelo':<28} {'msgs':>7} {'erros':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'TTFT p95':>9}")
+    for row in models:
+        print(f"{row['model'] or '-':<28} {row['requests']:>7} {row['errors']:>6} {row['latency_p50_ms'] or '-':>8} "
+              f"{row['latency_p95_ms'] or '-':>8} {row['latency_p99_ms'] or '-':>8} {row['ttft_p95_ms'] or '-':>9}")
+
+def _report(args):
+    if args.split:
+        result = compare_periods(args.split, window_hours=args.window)
+        if result is None:
+            sys.exit("Erro ao ler as métricas (veja o log).")
+        if args.json:
+            print(json.dumps(result, indent=2))
+            return
+        for side in ("before", "after"):
+            print(f"\n{'Antes' if side == 'before' else 'Depois'} de {result['split_at']}:")
+            _print_models(result[side]["models"])
+        if result["p95_change"] is None:
+            print("\nSem dados suficientes dos dois lados para comparar o p95.")
+        else:
+            print(f"\np95 total: {result['before']['total']['latency_p95_ms']} ms -> "
+                  f"{result['after']['total']['latency_p95_ms']} ms ({result['p95_change']:+.1%}); "
+                  f"{'REGRESSÃO' if result['regressed'] else 'sem regressão'}.")
+        return
+
+    report = latency_report(args.since, args.until, model=args.model)
+    if report is None:
+        sys.exit("Erro ao ler as métricas (veja o log).")
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_models(report)
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência do chat por modelo (agregados por hora).")
+    parser.add_argument("--since", help="Início do período (UTC, 'AAAA-MM-DD[ HH:MM]')")
+    parser.add_argument("--until", help="Fim do período (exclusivo)")
+    parser.add_argument("--model")
+    parser.add_argument("--split", help="Compara antes/depois deste horário (ex.: troca do modelo padrão)")
+    parser.add_argument("--window", type=int, help="Com --split: horas consideradas de cada lado")
+    parser.add_argument("--json", action="store_true", help="Saída em JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    PerfRollup().run_once()
+    try:
+        return _report(args)
+    except ValueError as e:
+        sys.exit(f"Data/hora inválida ({e}); use 'AAAA-MM-DD[ HH:MM]'.")
+
+if __name__ == "__main__":
+    main()
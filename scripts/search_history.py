@@ -0,0 +1,43 @@
+# scripts/search_history.py
+# Busca respostas antigas no histórico de chat (índice FTS5 de chat_history.db).
+#
+# Uso:
+#   python scripts/search_history.py PED_VALOR
+#   python scripts/search_history.py "valor pedido" --feedback 1 --since 2025-01-01 --limit 10
+import argparse
+import logging
+import os
+import sys
+
+# Adiciona o diretório raiz ao path para encontrar src/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.database.history import search_history
+
+def main():
+    parser = argparse.ArgumentParser(description="Busca no histórico de chat.")
+    parser.add_argument("query", help="Palavras a procurar (todas precisam aparecer)")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--feedback", type=int, choices=[1, -1], help="Só mensagens com 👍 (1) ou 👎 (-1)")
+    parser.add_argument("--since", help="Data/hora inicial (UTC), ex.: 2025-01-01")
+    parser.add_argument("--until", help="Data/hora final (UTC), ex.: 2025-01-31 (o dia inteiro) ou 2025-01-31 12:00")
+    parser.add_argument("--recent", action="store_true", help="Mais recentes primeiro (em vez de mais relevantes)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    try:
+        results = search_history(args.query, limit=args.limit, feedback=args.feedback, since=args.since,
+                                 until=args.until, order="recent" if args.recent else "rank")
+    except ValueError as e:
+        sys.exit(f"Data/hora inválida ({e}); use 'AAAA-MM-DD[ HH:MM]'.")
+    if results is None:
+        sys.exit("Erro ao buscar no histórico (veja o log).")
+    if not results:
+        print("Nenhuma mensagem encontrada.")
+    for result in results:
+        feedback = {1: " 👍", -1: " 👎"}.get(result["feedback"], "")
+        print(f"#{result['id']}  {result['timestamp']}  sessão {result['session_id']}{feedback}")
+        print(f"  Usuário:    {result['user_snippet']}")
+        print(f"  Assistente: {result['assistant_snippet']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+# Reaproveitamento de respostas bem avaliadas (👍) para perguntas parecidas; "0" desativa
+ANSWER_REUSE = os.getenv("ANSWER_REUSE", "1") != "0"
+# Similaridade de cosseno mínima entre as perguntas para servir a resposta guardada
+ANSWER_REUSE_THRESHOLD = float(os.getenv("ANSWER_REUSE_THRESHOLD", "0.92"))
+# Perguntas com menos palavras que isso dependem do contexto da conversa ("e as colunas?"): não são buscadas
+ANSWER_REUSE_MIN_WORDS = int(os.getenv("ANSWER_REUSE_MIN_WORDS", "4"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Chave da busca exata: minúsculas, espaços colapsados, sem pontuação final."""
+    return _WHITESPACE.sub(" ", text or "").strip().lower().rstrip("?!. ")
+
+
+class AnswerIndex:
+    """Índice vetorial das perguntas cujas respostas receberam 👍, consultado antes do LLM.
+
+    - Vetores: embeddings das perguntas (OLLAMA_EMBED_MODEL), normalizados e guardados em
+      uma matriz float32 contígua; a busca é um produto escalar com todas as linhas
+      (milhares de respostas avaliadas cabem em poucos MB e levam menos de 1 ms).
+      Perguntas idênticas (após `normalize_question`) nem chegam a ser vetorizadas.
+    - Por modelo: cada resposta guarda o modelo que a gerou e só é servida para o mesmo
+      modelo (a busca mascara as linhas dos outros; sem nenhuma, nem vetoriza a pergunta).
+    - Só perguntas de abertura: uma resposta depende dos turnos anteriores da conversa, então
+      o índice guarda apenas primeiros turnos e o app só consulta no primeiro turno.
+    - Carga: `start()` lê as mensagens com feedback positivo do histórico
+      (`iter_positive_exchanges`) em segundo plano, com prioridade BATCH no Ollama.
+    - Atualização incremental: `record_feedback()` inclui a mensagem com 👍 e remove a
+      com 👎 (inclusive uma resposta reaproveitada que não serviu), sem recarregar nada;
+      a vetorização roda na mesma thread da carga, sem atrasar quem chamou.
+    - `lookup()` vetoriza a pergunta com prioridade INTERACTIVE e devolve a melhor resposta
+      com similaridade >= `threshold`, ou None.
+    - `status()`: consultas, acertos, taxa de acerto, latência da busca e tempo de geração
+      economizado (acertos x média móvel da duração das respostas geradas).
+    """
+
+    def __init__(self, threshold: float | None = None, min_words: int | None = None, model: str | None = None,
+                 embedder: Callable[..., Any] | None = None, enabled: bool | None = None):
+        self.threshold = threshold if threshold is not None else ANSWER_REUSE_THRESHOLD
+        self.min_words = min_words if min_words is not None else ANSWER_REUSE_MIN_WORDS
+        self.model = model
+        self.enabled = enabled if enabled is not None else ANSWER_REUSE
+        self._embedder = embedder
+
+        self._lock = threading.Lock()
+        self._vectors: np.ndarray | None = None # Linhas [0, _size) em uso; capacidade dobra ao encher
+        self._size = 0
+        self._codes: np.ndarray | None = None # Código do modelo de cada linha (mesma capacidade)
+        self._model_codes: Dict[str | None, int] = {} # Modelo -> código
+        self._ids: List[int] = [] # ID da mensagem em cada linha
+        self._rows: Dict[int, int] = {} # ID da mensagem -> linha
+        self._exchanges: Dict[int, Tuple[str, str, str | None]] = {} # ID -> (pergunta, resposta, modelo)
+        self._exact: Dict[Tuple[str | None, str], int] = {} # (modelo, pergunta normalizada) -> ID
+        self._rejected: set[int] = set() # 👎 que chegou antes da inclusão pendente
+
+        self._pending: "queue.Queue[Tuple[int, str, str, str | None] | None]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._loaded = threading.Event()
+        self._last_loaded_id = 0
+
+        self._stats_lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.exact_hits = 0
+        self._lookup_s = 0.0
+        self._generation_s: float | None = None # Média móvel da duração de uma resposta gerada
+
+    def _embed(self, texts: List[str], priority) -> np.ndarray | None:
+        """Vetores normalizados (uma linha por texto) ou None se o Ollama falhar."""
+        if self._embedder is None:
+            # Import tardio: o índice pode ser testado/usado sem a integração Ollama configurada
+            from src.ollama_integration.client import embed
+            self._embedder = embed
+        result = self._embedder(texts, model=self.model, priority=priority)
+        if result is None or not result.dim:
+            return None
+        vectors = np.frombuffer(result.data, dtype=np.float32).reshape(-1, result.dim)[np.asarray(result.index)]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    # --- Índice ---
+    def __len__(self) -> int:
+        return self._size
+
+    def _add(self, items: List[Tuple[int, str, str, str | None]], vectors: np.ndarray) -> None:
+        with self._lock:
+            if self._vectors is not None and self._vectors.shape[1] != vectors.shape[1]:
+                logging.warning("Dimensão dos embeddings mudou (modelo trocado?): reiniciando o índice de respostas.")
+                self._vectors, self._codes, self._size = None, None, 0
+                self._ids, self._rows, self._exchanges, self._exact = [], {}, {}, {}
+            for (message_id, question, answer, model), vector in zip(items, vectors):
+                if message_id in self._rows:
+                    continue
+                if self._vectors is None or self._size == len(self._vectors):
+                    capacity = max(64, 2 * self._size)
+                    grown = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+                    codes = np.empty(capacity, dtype=np.int32)
+                    if self._vectors is not None:
+                        grown[:self._size] = self._vectors[:self._size]
+                        codes[:self._size] = self._codes[:self._size]
+                    self._vectors, self._codes = grown, codes
+                self._vectors[self._size] = vector
+                self._codes[self._size] = self._model_codes.setdefault(model, len(self._model_codes))
+                self._rows[message_id] = self._size
+                self._ids.append(message_id)
+                self._size += 1
+                self._exchanges[message_id] = (question, answer, model)
+                self._exact[(model, normalize_question(question))] = message_id
+
+    def remove(self, message_id: int) -> bool:
+        """Tira a mensagem do índice (a última linha ocupa o lugar dela). Retorna True se estava lá."""
+        with self._lock:
+            row = self._rows.pop(message_id, None)
+            if row is None:
+                return False
+            last = self._size - 1
+            if row != last:
+                self._vectors[row] = self._vectors[last]
+                self._codes[row] = self._codes[last]
+                self._ids[row] = self._ids[last]
+                self._rows[self._ids[row]] = row
+            self._ids.pop()
+            self._size = last
+            question, _, model = self._exchanges.pop(message_id)
+            key = (model, normalize_question(question))
+            if self._exact.get(key) == message_id:
+                del self._exact[key]
+            return True
+
+    def add_exchanges(self, items: List[Tuple[int, str, str, str | None]], priority=None) -> int:
+        """Vetoriza e inclui (id, pergunta, resposta, modelo). Retorna quantas entraram (0 se o Ollama falhar)."""
+        from src.ollama_integration.scheduler import Priority
+
+        items = [item for item in items
+                 if item[0] not in self._rows and item[0] not in self._rejected and item[1] and item[2]]
+        if not items:
+            return 0
+        vectors = self._embed([item[1] for item in items], priority or Priority.BATCH)
+        if vectors is None:
+            logging.warning(f"Não foi possível vetorizar {len(items)} respostas bem avaliadas; ficam fora do índice.")
+            return 0
+        self._add(items, vectors)
+        return len(items)
+
+    # --- Consulta ---
+    def lookup(self, question: str, model: str | None = None) -> Dict[str, Any] | None:
+        """Melhor resposta gerada por `model` para `question` (similaridade >= threshold) ou None.
+
+        Deve ser chamada só no primeiro turno da conversa (o índice não conhece o contexto).
+        Retorna {"message_id", "question", "answer", "score", "exact"}.
+        """
+        if not self.enabled or self._size == 0 or len((question or "").split()) < self.min_words:
+            return None
+        code = self._model_codes.get(model)
+        if code is None:
+            return None # Nenhuma resposta deste modelo
+        from src.ollama_integration.scheduler import Priority
+
+        started = time.perf_counter()
+        match = None
+        message_id = self._exact.get((model, normalize_question(question)))
+        if message_id is not None:
+            match = self._match(message_id, 1.0, exact=True)
+        if match is None:
+            message_id = None
+            vectors = self._embed([question], Priority.INTERACTIVE)
+            if vectors is not None:
+                with self._lock:
+                    if self._size:
+                        scores = self._vectors[:self._size] @ vectors[0]
+                        scores[self._codes[:self._size] != code] = -np.inf # Respostas de outros modelos
+                        best = int(np.argmax(scores))
+                        if scores[best] >= self.threshold:
+                            message_id, score = self._ids[best], float(scores[best])
+                if message_id is not None:
+                    match = self._match(message_id, score)
+        with self._stats_lock:
+            self.lookups += 1
+            self._lookup_s += time.perf_counter() - started
+            if match is not None:
+                self.hits += 1
+                self.exact_hits += match["exact"]
+        return match
+
+    def _match(self, message_id: int, score: float, exact: bool = False) -> Dict[str, Any] | None:
+        exchange = self._exchanges.get(message_id) # Pode ter sido removida entre a busca e aqui
+        if exchange is None:
+            return None
+        return {"message_id": message_id, "question": exchange[0], "answer": exchange[1],
+                "score": round(score, 4), "exact": exact}
+
+    # --- Feedback e métricas ---
+    def record_feedback(self, message_id: int, feedback_value: int, question: str | None = None,
+                        answer: str | None = None, model: str | None = None) -> None:
+        """👍 (1) com pergunta e resposta de um primeiro turno: entra no índice (em segundo plano),
+        para o modelo `model`. 👎 (-1): sai na hora."""
+        if feedback_value < 0:
+            self._rejected.add(message_id)
+            if self.remove(message_id):
+                logging.info(f"Resposta {message_id} removida do reaproveitamento após 👎.")
+        elif feedback_value > 0 and question and answer and self.enabled:
+            self._rejected.discard(message_id)
+            self._pending.put((message_id, question, answer, model))
+            if self._thread is None:
+                # Sem start(): processa na hora (scripts e testes)
+                self._drain()
+
+    def record_generation(self, duration_s: float) -> None:
+        """Duração (s) de uma resposta gerada pelo LLM; base da estimativa de tempo economizado."""
+        with self._stats_lock:
+            if self._generation_s is None:
+                self._generation_s = duration_s
+            else:
+                self._generation_s = 0.9 * self._generation_s + 0.1 * duration_s
+
+    def status(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            avg_lookup_ms = 1000 * self._lookup_s / self.lookups if self.lookups else None
+            generation_s = self._generation_s
+            return {
+                "enabled": self.enabled, "size": self._size, "loaded": self._loaded.is_set(),
+                "threshold": self.threshold, "lookups": self.lookups, "hits": self.hits, "exact_hits": self.exact_hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else None,
+                "avg_lookup_ms": round(avg_lookup_ms, 2) if avg_lookup_ms is not None else None,
+                "avg_generation_s": round(generation_s, 3) if generation_s is not None else None,
+                # Cada acerto evita uma geração completa, mas paga a busca
+                "estimated_saved_s": round(self.hits * generation_s - self._lookup_s, 2) if generation_s is not None else None,
+            }
+
+    # --- Execução ---
+    def load(self, batch_size: int = 500) -> int:
+        """Inclui as mensagens com 👍 do histórico depois da última carga. Retorna quantas entraram."""
+        from src.database.history import iter_positive_exchanges
+
+        added = 0
+        batch: List[Tuple[int, str, str, str | None]] = []
+        for exchange in iter_positive_exchanges(after_id=self._last_loaded_id, batch_size=batch_size):
+            batch.append(exchange)
+            if len(batch) == batch_size:
+                added += self.add_exchanges(batch)
+                self._last_loaded_id = batch[-1][0]
+                batch = []
+        if batch:
+            added += self.add_exchanges(batch)
+            self._last_loaded_id = batch[-1][0]
+        self._loaded.set()
+        logging.info(f"Índice de respostas reaproveitáveis: {added} respostas carregadas ({self._size} no total).")
+        return added
+
+    def start(self) -> "AnswerIndex":
+        """Carrega o histórico e passa a processar o feedback novo, em segundo plano."""
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="answer-index", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        try:
+            self.load()
+        except Exception:
+            logging.exception("Erro ao carregar o índice de respostas reaproveitáveis")
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            self._drain([item])
+
+    def _drain(self, items: List[Tuple[int, str, str, str | None]] | None = None) -> None:
+        items = items or []
+        while True:
+            try:
+                item = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._pending.put(None) # Repassa o pedido de parada ao laço principal
+                break
+            items.append(item)
+        try:
+            self.add_exchanges(items)
+        except Exception:
+            logging.exception("Erro ao incluir respostas no índice de reaproveitamento")
+
+    def stop(self) -> None:
+        self._pending.put(None)
+
+
+_default_index: AnswerIndex | None = None
+_default_index_lock = threading.Lock()
+
+def get_answer_index() -> AnswerIndex:
+    """Índice compartilhado do processo (criado na primeira chamada, sem carregar; ver start())."""
+    global _default_index
+    if _default_index is None:
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = AnswerIndex()
+    return _default_index
@@ -0,0 +1,256 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List
+
+from src.core.schema_descriptions import build_column_prompt, build_object_prompt, find_existing_description, request_ai_description
+
+logger = logging.getLogger(__name__)
+
+STATUS_SUGGESTED = "suggested" # Sugestão (IA ou heurística) gravada na fila de revisão
+STATUS_EMPTY = "empty" # IA respondeu vazio; não será tentado de novo
+STATUS_FAILED = "failed" # Erro; será tentado de novo na próxima execução
+
+
+def _has_text(meta: Dict[str, Any] | None) -> bool:
+    return bool(meta and (meta.get("description") or "").strip())
+
+def _object_metadata(metadata: Dict[str, Any], object_name: str) -> Dict[str, Any] | None:
+    for obj_type_key in ("TABLES", "VIEWS", "DESCONHECIDOS"):
+        obj_meta = metadata.get(obj_type_key, {}).get(object_name)
+        if obj_meta is not None:
+            return obj_meta
+    return None
+
+def build_tasks(relation_names: Iterable[str], technical_schema: Dict[str, Any], metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Lista as descrições faltantes (objeto e colunas) das relações informadas.
+
+    Descrições já curadas em `metadata` nunca geram tarefa: o job só sugere o que está vazio.
+    """
+    tasks = []
+    for object_name in relation_names:
+        tech = technical_schema.get(object_name)
+        if not tech or tech.get("object_type") not in ("TABLE", "VIEW"):
+            continue
+        object_type = tech["object_type"]
+        obj_meta = _object_metadata(metadata, object_name) or {}
+        if not _has_text(obj_meta):
+            tasks.append({
+                "id": object_name,
+                "object": object_name,
+                "object_type": object_type,
+                "column": None,
+                "prompt": build_object_prompt(object_name, object_type),
+            })
+        columns_meta = obj_meta.get("COLUMNS", {})
+        for column in tech.get("columns", []):
+            column_name = column.get("name")
+            if not column_name or _has_text(columns_meta.get(column_name)):
+                continue
+            tasks.append({
+                "id": f"{object_name}.{column_name}",
+                "object": object_name,
+                "object_type": object_type,
+                "column": column_name,
+                "prompt": build_column_prompt(object_name, column_name, column.get("type", "N/A")),
+            })
+    return tasks
+
+def load_progress(progress_path: str) -> Dict[str, str]:
+    """Lê o log de progresso (JSONL) e retorna {task_id: último status}.
+
+    Uma última linha truncada (queda no meio da escrita) é ignorada.
+    """
+    progress = {}
+    if not os.path.exists(progress_path):
+        return progress
+    with open(progress_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                progress[entry["task"]] = entry["status"]
+            except (json.JSONDecodeError, KeyError):
+                logger.warning(f"Linha inválida ignorada no progresso: {line.strip()[:80]}")
+    return progress
+
+
+def repair_jsonl_tail(path: str) -> None:
+    """Remove uma última linha incompleta (sem '\\n') deixada por uma queda durante a escrita."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Procura o último '\n' de trás para frente, em blocos
+        position = size
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            block = f.read(step)
+            index = block.rfind(b"\n")
+            if index != -1:
+                f.truncate(position + index + 1)
+                return
+        f.truncate(0)
+
+
+class ProgressReporter:
+    """Calcula vazão (tarefas/min) e ETA e imprime linhas PROGRESS: para quem acompanha o stdout."""
+
+    def __init__(self, total: int, already_done: int = 0, report_every: float = 10.0):
+        self.total = total
+        self.done = already_done
+        self.processed_this_run = 0
+        self.started_at = time.monotonic()
+        self.report_every = report_every
+        self._last_report = 0.0
+
+    def throughput_per_min(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.processed_this_run / elapsed * 60 if elapsed > 0 else 0.0
+
+    def eta_seconds(self) -> float | None:
+        rate = self.throughput_per_min() / 60
+        return (self.total - self.done) / rate if rate > 0 else None
+
+    def advance(self, task_id: str) -> None:
+        self.done += 1
+        self.processed_this_run += 1
+        print(f"PROGRESS:{self.done}/{self.total}:{task_id}", flush=True)
+        now = time.monotonic()
+        if now - self._last_report >= self.report_every or self.done == self.total:
+            self._last_report = now
+            eta = self.eta_seconds()
+            eta_str = str(datetime.timedelta(seconds=int(eta))) if eta is not None else "?"
+            logger.info(f"Progresso: {self.done}/{self.total} | {self.throughput_per_min():.1f} tarefas/min | ETA {eta_str}")
+
+
+class BulkDescriptionJob:
+    """Gera sugestões de descrição para todo o schema, em paralelo limitado e retomável.
+
+    - Colunas: tenta primeiro a heurística (`find_existing_description`); só chama a IA
+      se nada for encontrado.
+    - Sugestões vão para `review_queue_path` (JSONL) e NUNCA sobrescrevem os metadados.
+    - Cada tarefa concluída é registrada em `progress_path` (JSONL, com fsync); ao reiniciar
+      depois de uma queda, as tarefas já concluídas são puladas e as com falha, refeitas.
+      Uma tarefa pode aparecer duas vezes na fila de revisão se a queda ocorrer entre as
+      duas gravações; nesse caso vale a última.
+    - As chamadas usam prioridade BATCH, então o chat interativo continua com folga.
+    """
+
+    def __init__(self, technical_schema: Dict[str, Any], metadata: Dict[str, Any], review_queue_path: str,
+                 progress_path: str, max_workers: int = 3, cache=None, model: str | None = None,
+                 ai_describe: Callable[..., str | None] | None = None):
+        self.technical_schema = technical_schema
+        self.metadata = metadata
+        self.review_queue_path = review_queue_path
+        self.progress_path = progress_path
+        self.max_workers = max_workers
+        self.cache = cache
+        self.model = model
+        self.ai_describe = ai_describe or request_ai_description
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        """Pede parada: não agenda novas tarefas, mas espera as que estão em andamento."""
+        self._stop.set()
+
+    def _describe(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """Executa uma tarefa (em thread do pool) e devolve o resultado a registrar."""
+        result = {"task": task["id"], "status": STATUS_FAILED}
+        try:
+            if task["column"]:
+                existing, source = find_existing_description(self.metadata, self.technical_schema, task["object"], task["column"])
+                if existing:
+                    result.update(status=STATUS_SUGGESTED, suggestion=existing, source=f"heuristica: {source}")
+                    return result
+            suggestion = self.ai_describe(task["prompt"], cache=self.cache, model=self.model)
+            if suggestion:
+                result.update(status=STATUS_SUGGESTED, suggestion=suggestion, source="ia")
+            elif suggestion is None:
+                result["error"] = "Sem resposta do Ollama (erro já registrado no log)"
+            else:
+                result["status"] = STATUS_EMPTY
+        except Exception as e:
+            logger.exception(f"Erro ao gerar descrição para {task['id']}")
+            result["error"] = str(e)
+        return result
+
+    @staticmethod
+    def _append_durably(f, entry: Dict[str, Any]) -> None:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    def run(self, relation_names: Iterable[str]) -> Dict[str, int]:
+        """Processa as relações informadas e retorna a contagem de resultados por status."""
+        tasks = build_tasks(relation_names, self.technical_schema, self.metadata)
+        progress = load_progress(self.progress_path)
+        finished = {task_id for task_id, status in progress.items() if status != STATUS_FAILED}
+        pending = [task for task in tasks if task["id"] not in finished]
+        logger.info(f"{len(tasks)} descrições faltantes; {len(tasks) - len(pending)} já processadas; {len(pending)} pendentes.")
+
+        reporter = ProgressReporter(total=len(tasks), already_done=len(tasks) - len(pending))
+        counts = {STATUS_SUGGESTED: 0, STATUS_EMPTY: 0, STATUS_FAILED: 0}
+        for path in (self.review_queue_path, self.progress_path):
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            repair_jsonl_tail(path)
+
+        pending_iter = iter(pending)
+        with open(self.review_queue_path, "a", encoding="utf-8") as review_file, \
+             open(self.progress_path, "a", encoding="utf-8") as progress_file, \
+             ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = {}
+
+            def submit_next() -> bool:
+                if self._stop.is_set():
+                    return False
+                task = next(pending_iter, None)
+                if task is None:
+                    return False
+                in_flight[executor.submit(self._describe, task)] = task
+                return True
+
+            # Janela limitada: nunca mais que 2x workers tarefas agendadas de uma vez
+            for _ in range(self.max_workers * 2):
+                if not submit_next():
+                    break
+            try:
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task = in_flight.pop(future)
+                        result = future.result()
+                        # Gravação só nesta thread: fila de revisão primeiro, progresso depois
+                        if result["status"] == STATUS_SUGGESTED:
+                            self._append_durably(review_file, {
+                                "id": task["id"],
+                                "object": task["object"],
+                                "object_type": task["object_type"],
+                                "column": task["column"],
+                                "suggestion": result["suggestion"],
+                                "source": result["source"],
+                                "model": self.model,
+                                "generated_at": datetime.datetime.now().isoformat(),
+                            })
+                        self._append_durably(progress_file, {"task": task["id"], "status": result["status"]})
+                        counts[result["status"]] += 1
+                        reporter.advance(task["id"])
+                        submit_next()
+            except KeyboardInterrupt:
+                logger.warning("Interrompido: aguardando tarefas em andamento antes de sair (o progresso está salvo).")
+                self.stop()
+                raise
+        return counts
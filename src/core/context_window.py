@@ -0,0 +1,230 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Tuple
+
+from src.core.prompt_assembly import PrefixReuseTracker, assemble_prompt, count_tokens, message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Orçamento de tokens do prompt (histórico + mensagem atual), já descontada a resposta.
+# CONTEXT_TOKEN_BUDGETS permite valores por modelo: "llama3=6000,phi3=2500".
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_TOKEN_BUDGETS = {
+    name.strip(): int(value)
+    for name, _, value in (item.partition("=") for item in os.getenv("CONTEXT_TOKEN_BUDGETS", "").split(","))
+    if name.strip() and value.strip()
+}
+# Turnos que saíram da janela acumulados antes de atualizar o resumo (evita resumir a cada turno)
+CONTEXT_SUMMARY_EVERY = int(os.getenv("CONTEXT_SUMMARY_EVERY", "4"))
+
+# Ao estourar o orçamento, a janela recomeça ocupando só esta fração dele: o início da
+# janela (e o prefixo do prompt) fica fixo por vários turnos em vez de andar a cada turno
+CONTEXT_REFILL_RATIO = float(os.getenv("CONTEXT_REFILL_RATIO", "0.6"))
+
+_WORD_RE = re.compile(r"\w{4,}")
+
+Turn = Tuple[str | None, str | None] # (mensagem do usuário, resposta do assistente), como no gr.Chatbot
+
+
+def turn_messages(turn: Turn) -> List[Dict[str, str]]:
+    user_msg, assistant_msg = turn
+    messages = []
+    if user_msg:
+        messages.append({"role": "user", "content": user_msg})
+    if assistant_msg:
+        messages.append({"role": "assistant", "content": assistant_msg})
+    return messages
+
+@lru_cache(maxsize=8192)
+def _keywords(text: str) -> frozenset:
+    return frozenset(word.lower() for word in _WORD_RE.findall(text))
+
+def relevance(turn: Turn, query: str) -> float:
+    """Sobreposição de palavras (Jaccard) entre um turno e a mensagem atual."""
+    query_words = _keywords(query)
+    turn_words = _keywords(" ".join(part for part in turn if part))
+    if not query_words or not turn_words:
+        return 0.0
+    return len(query_words & turn_words) / len(query_words | turn_words)
+
+
+def summarize_with_ollama(previous_summary: str, turns: Sequence[Turn], model: str | None = None) -> str | None:
+    """Resumidor padrão: pede ao Ollama (prioridade BATCH) um resumo atualizado da conversa."""
+    from src.ollama_integration.client import chat_completion
+    from src.ollama_integration.scheduler import Priority
+
+    transcript = "\n".join(f"{'Usuário' if m['role'] == 'user' else 'Assistente'}: {m['content']}"
+                           for turn in turns for m in turn_messages(turn))
+    prompt = ("Atualize o resumo da conversa abaixo em no máximo 8 frases, mantendo nomes de tabelas, "
+              "colunas, valores e decisões mencionados. Responda apenas com o resumo.\n\n"
+              f"Resumo atual:\n{previous_summary or '(vazio)'}\n\nNovos trechos:\n{transcript}")
+    summary = chat_completion([{"role": "user", "content": prompt}], model=model, stream=False, priority=Priority.BATCH)
+    return summary.strip() if summary else None
+
+
+class _SessionSummary:
+    __slots__ = ("start", "covered", "text", "pending")
+
+    def __init__(self):
+        self.start = 0 # Primeiro turno da janela atual
+        self.covered = 0 # Quantos turnos (do início) o resumo já cobre
+        self.text = ""
+        self.pending: Future | None = None
+
+
+class ContextWindowManager:
+    """Monta as mensagens de cada turno dentro de um orçamento de tokens por modelo.
+
+    - Contagem: cada mensagem é estimada uma vez (`count_tokens` em cache).
+    - Janela: turnos recentes, em ordem cronológica, dentro do orçamento
+      (`budget_for(model)`); pelo menos o último turno entra. O início da janela só
+      avança quando o orçamento estoura e, nesse caso, salta para ocupar `refill_ratio`
+      do orçamento: entre um salto e outro o prefixo do prompt é idêntico e o backend
+      reaproveita o cache KV (ver `src.core.prompt_assembly`).
+    - Relevância: com orçamento sobrando, turnos antigos que compartilham palavras com a
+      mensagem atual voltam como um trecho no fim do prompt (antes da mensagem atual),
+      sem mexer no prefixo.
+    - Resumo: os turnos que saíram da janela são resumidos em segundo plano
+      (`summarizer`, por padrão o próprio Ollama com prioridade BATCH), a cada
+      `summary_every` turnos novos fora da janela. O resumo em cache entra logo após as
+      instruções e o contexto do schema; o turno nunca espera pelo resumo.
+    - Métricas: `tracker` (`PrefixReuseTracker`) mede quanto de cada prompt repete o anterior.
+
+    Assim o tamanho do prompt (e o tempo de avaliação do prompt) fica limitado pelo
+    orçamento, em vez de crescer com a conversa.
+    """
+
+    def __init__(self, budget: int | None = None, budgets: Dict[str, int] | None = None,
+                 summarizer: Callable[[str, Sequence[Turn], str | None], str | None] | None = summarize_with_ollama,
+                 summary_every: int | None = None, min_relevance: float = 0.15, max_sessions: int = 1000,
+                 refill_ratio: float | None = None, tracker: PrefixReuseTracker | None = None):
+        self.budget = budget or CONTEXT_TOKEN_BUDGET
+        self.budgets = dict(CONTEXT_TOKEN_BUDGETS if budgets is None else budgets)
+        self.summarizer = summarizer
+        self.summary_every = summary_every or CONTEXT_SUMMARY_EVERY
+        self.min_relevance = min_relevance
+        self.max_sessions = max_sessions
+        self.refill_ratio = refill_ratio if refill_ratio is not None else CONTEXT_REFILL_RATIO
+        self.tracker = tracker or PrefixReuseTracker(max_sessions=max_sessions)
+        self._lock = threading.Lock()
+        self._summaries: OrderedDict[str, _SessionSummary] = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+
+    def budget_for(self, model: str | None) -> int:
+        if model:
+            if model in self.budgets:
+                return self.budgets[model]
+            base = model.split(":")[0] # "llama3:8b" usa o orçamento de "llama3"
+            if base in self.budgets:
+                return self.budgets[base]
+        return self.budget
+
+    def _summary_for(self, session_id: str) -> _SessionSummary:
+        summary = self._summaries.get(session_id)
+        if summary is None:
+            summary = self._summaries[session_id] = _SessionSummary()
+            if len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+        else:
+            self._summaries.move_to_end(session_id)
+        return summary
+
+    def _window_start(self, costs: List[int], start: int, available: int) -> int:
+        """Mantém o início da janela enquanto couber; senão, salta para ocupar `refill_ratio` do orçamento."""
+        if start <= len(costs) and sum(costs[start:]) <= available:
+            return start
+        target = available * self.refill_ratio
+        start, used = len(costs), 0
+        while start > 0 and (used + costs[start - 1] <= target or start == len(costs)):
+            start -= 1
+            used += costs[start]
+        return start
+
+    def build(self, session_id: str, history: Sequence[Turn], user_message: str, model: str | None = None,
+              system_prompt: str | None = None, schema_context: str | Mapping[str, Any] | None = None) -> List[Dict[str, str]]:
+        """Mensagens para a API: [sistema], [schema], [resumo], janela de turnos, [trechos relembrados], mensagem atual."""
+        with self._lock:
+            summary = self._summary_for(session_id)
+            if len(history) < summary.start or len(history) < summary.covered:
+                # Histórico menor que o visto (conversa limpa/reiniciada): recomeça a sessão
+                summary.start, summary.covered, summary.text = 0, 0, ""
+            summary_text, covered, start = summary.text, summary.covered, summary.start
+
+        fixed = assemble_prompt(user_message, system_prompt=system_prompt, schema_context=schema_context, summary=summary_text)
+        available = self.budget_for(model) - self.count(fixed)
+        costs = [sum(map(message_tokens, turn_messages(turn))) for turn in history]
+        start = self._window_start(costs, start, available)
+        available -= sum(costs[start:])
+
+        # Com orçamento sobrando, traz de volta turnos antigos relacionados à mensagem atual
+        ranked = sorted(((relevance(history[i], user_message), i) for i in range(start)), reverse=True)
+        recalled_turns = []
+        for score, i in ranked:
+            if score < self.min_relevance:
+                break
+            cost = sum(map(message_tokens, turn_messages(history[i])))
+            if cost <= available:
+                recalled_turns.append(i)
+                available -= cost
+
+        with self._lock:
+            summary.start = start
+        self._maybe_summarize(session_id, history, start, covered, model)
+
+        window = [m for turn in history[start:] for m in turn_messages(turn)]
+        recalled = [m for i in sorted(recalled_turns) for m in turn_messages(history[i])]
+        messages = assemble_prompt(user_message, window, system_prompt=system_prompt, schema_context=schema_context,
+                                   summary=summary_text, recalled=recalled)
+        reuse = self.tracker.observe(f"{session_id}:{model or ''}", messages)
+        logger.debug(f"Contexto: {len(history) - start}+{len(recalled_turns)}/{len(history)} turnos, "
+                     f"~{reuse['total_tokens']} tokens (orçamento {self.budget_for(model)}), "
+                     f"prefixo reaproveitado ~{reuse['reused_tokens']} tokens, resumo cobre {covered} turnos.")
+        return messages
+
+    @staticmethod
+    def count(messages: Sequence[Dict[str, str]]) -> int:
+        return sum(map(message_tokens, messages))
+
+    def prefix_stats(self) -> Dict[str, Any]:
+        """Taxas de reaproveitamento de prefixo dos prompts montados (ver PrefixReuseTracker)."""
+        return self.tracker.stats()
+
+    def _maybe_summarize(self, session_id: str, history: Sequence[Turn], cutoff: int, covered: int,
+                         model: str | None) -> None:
+        """Agenda a atualização do resumo quando `summary_every` turnos novos saíram da janela."""
+        if self.summarizer is None or cutoff - covered < self.summary_every:
+            return
+        with self._lock:
+            summary = self._summary_for(session_id)
+            if summary.pending is not None:
+                return
+            previous, new_turns = summary.text, list(history[summary.covered:cutoff])
+            summary.pending = self._executor.submit(self._summarize, summary, previous, new_turns, cutoff, model)
+
+    def _summarize(self, summary: _SessionSummary, previous: str, new_turns: List[Turn], cutoff: int,
+                   model: str | None) -> bool:
+        try:
+            text = self.summarizer(previous, new_turns, model)
+            if not text:
+                return False
+            with self._lock:
+                summary.text, summary.covered = text, cutoff
+            return True
+        except Exception:
+            logger.exception("Erro ao atualizar o resumo da conversa")
+            return False
+        finally:
+            with self._lock:
+                summary.pending = None
+
+    def wait_for_summary(self, session_id: str, timeout: float | None = None) -> None:
+        """Espera a atualização de resumo em andamento (se houver) da sessão; útil em testes e scripts."""
+        with self._lock:
+            pending = self._summaries[session_id].pending if session_id in self._summaries else None
+        if pending is not None:
+            pending.result(timeout=timeout)
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, Sequence
+
+SCHEMA_CONTEXT_HEADER = "Contexto do schema do banco de dados:"
+SUMMARY_HEADER = "Resumo da conversa até aqui:"
+RECALLED_HEADER = "Trechos anteriores da conversa relacionados à pergunta atual:"
+
+# Estimativa conservadora para modelos Llama/Phi em português (~3,5 caracteres por token)
+_CHARS_PER_TOKEN = 3.5
+# Tokens de formatação do template de chat por mensagem (papel, delimitadores)
+_MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Estimativa de tokens de um texto (em cache: cada mensagem é contada uma vez)."""
+    return math.ceil(len(text) / _CHARS_PER_TOKEN) if text else 0
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message.get("content") or "") + _MESSAGE_OVERHEAD
+
+
+def render_schema_context(schema_context: str | Mapping[str, Any] | None) -> str:
+    """Texto do contexto de schema, sempre igual para o mesmo conteúdo (chaves ordenadas)."""
+    if not schema_context:
+        return ""
+    if isinstance(schema_context, str):
+        return schema_context.strip()
+    return json.dumps(schema_context, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+def _normalize(message: Dict[str, str]) -> Dict[str, str]:
+    # Espaços no fim mudam os tokens sem mudar o sentido; padroniza para não quebrar o prefixo
+    return {"role": message["role"], "content": (message.get("content") or "").rstrip()}
+
+def assemble_prompt(user_message: str, history: Sequence[Dict[str, str]] = (), system_prompt: str | None = None,
+                    schema_context: str | Mapping[str, Any] | None = None, summary: str | None = None,
+                    recalled: Sequence[Dict[str, str]] = ()) -> List[Dict[str, str]]:
+    """Monta as mensagens do mais estável para o mais variável.
+
+    Ordem fixa: instruções de sistema, contexto do schema, resumo da conversa,
+    histórico (cronológico), trechos antigos relembrados e a mensagem atual. Tudo o que
+    muda a cada turno fica no fim, de modo que o prefixo enviado em turnos seguidos é
+    idêntico e o Ollama/llama.cpp reaproveita o cache KV dele em vez de reavaliá-lo.
+    """
+    messages: List[Dict[str, str]] = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt.strip()})
+    schema_text = render_schema_context(schema_context)
+    if schema_text:
+        messages.append({"role": "system", "content": f"{SCHEMA_CONTEXT_HEADER}\n{schema_text}"})
+    if summary:
+        messages.append({"role": "system", "content": f"{SUMMARY_HEADER} {summary.strip()}"})
+    messages.extend(_normalize(m) for m in history)
+    if recalled:
+        transcript = "\n".join(f"{'Usuário' if m['role'] == 'user' else 'Assistente'}: {m['content'].strip()}" for m in recalled)
+        messages.append({"role": "system", "content": f"{RECALLED_HEADER}\n{transcript}"})
+    messages.append({"role": "user", "content": user_message.strip()})
+    return messages
+
+def fingerprint_chain(messages: Sequence[Dict[str, str]]) -> List[str]:
+    """Impressão digital cumulativa: o i-ésimo valor identifica as mensagens [0..i]."""
+    chain, digest = [], b""
+    for message in messages:
+        digest = hashlib.blake2b(digest + message["role"].encode() + b"\x00" + message["content"].encode("utf-8"),
+                                 digest_size=8).digest()
+        chain.append(digest.hex())
+    return chain
+
+def stable_prefix_length(messages: Sequence[Dict[str, str]]) -> int:
+    """Quantas mensagens iniciais são instruções/contexto de schema (a parte fixa do prompt)."""
+    count = 0
+    for message in messages:
+        if message["role"] != "system" or message["content"].startswith((SUMMARY_HEADER, RECALLED_HEADER)):
+            break
+        count += 1
+    return count
+
+
+class PrefixReuseTracker:
+    """Mede quanto de cada prompt repete o prompt anterior da mesma sessão (thread-safe).
+
+    Para cada `observe(key, messages)`, compara as impressões digitais cumulativas com
+    as do prompt anterior da mesma chave (sessão + modelo) e conta as mensagens e
+    tokens (estimados) do prefixo comum, que o backend pode reaproveitar do cache KV.
+    Também conta quantos prompts começam por uma parte fixa (sistema + schema) já vista.
+    """
+
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._last: OrderedDict[str, List[str]] = OrderedDict()
+        self._stable_seen: OrderedDict[str, None] = OrderedDict()
+        self.prompts = 0
+        self.stable_hits = 0
+        self.reused_tokens = 0
+        self.total_tokens = 0
+
+    def observe(self, key: str, messages: Sequence[Dict[str, str]]) -> Dict[str, Any]:
+        """Registra o prompt e retorna o reaproveitamento em relação ao anterior da mesma chave."""
+        chain = fingerprint_chain(messages)
+        tokens = [message_tokens(m) for m in messages]
+        stable = stable_prefix_length(messages)
+        with self._lock:
+            previous = self._last.pop(key, [])
+            self._last[key] = chain
+            if len(self._last) > self.max_sessions:
+                self._last.popitem(last=False)
+            reused = 0
+            while reused < min(len(previous), len(chain)) and previous[reused] == chain[reused]:
+                reused += 1
+            stable_hit = False
+            if stable:
+                stable_fp = chain[stable - 1]
+                stable_hit = stable_fp in self._stable_seen
+                self._stable_seen[stable_fp] = None
+                self._stable_seen.move_to_end(stable_fp)
+                if len(self._stable_seen) > self.max_sessions:
+                    self._stable_seen.popitem(last=False)
+            reused_tokens = sum(tokens[:reused])
+            self.prompts += 1
+            self.stable_hits += stable_hit
+            self.reused_tokens += reused_tokens
+            self.total_tokens += sum(tokens)
+        return {"reused_messages": reused, "reused_tokens": reused_tokens, "total_tokens": sum(tokens),
+                "stable_hit": stable_hit, "fingerprint": chain[-1] if chain else None}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "prompts": self.prompts,
+                "stable_prefix_hit_rate": self.stable_hits / self.prompts if self.prompts else None,
+                "reused_tokens": self.reused_tokens,
+                "total_tokens": self.total_tokens,
+                "prefix_reuse_rate": self.reused_tokens / self.total_tokens if self.total_tokens else None,
+            }
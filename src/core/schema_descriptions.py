@@ -0,0 +1,142 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- Prompts (mesmo texto no Streamlit e no job em lote, para aproveitar cache/coalescência) ---
+def build_object_prompt(object_name, object_type):
+    """Prompt para sugerir a descrição de uma tabela/view."""
+    return f"Sugira descrição concisa pt-br para o objeto de banco de dados '{object_name}' (tipo: {object_type}). Propósito? Responda só descrição."
+
+def build_column_prompt(object_name, column_name, column_type):
+    """Prompt para sugerir a descrição de uma coluna."""
+    return f"Sugira descrição concisa pt-br para coluna '{column_name}' ({column_type}) do objeto '{object_name}'. Significado? Responda só descrição."
+
+def clean_ai_response(response):
+    """Remove espaços e aspas que o modelo costuma colocar em volta da descrição."""
+    return response.strip().strip('"').strip('\'').strip()
+
+def request_ai_description(prompt, cache=None, priority=None, model=None, cancel=None, on_chunk=None):
+    """Pede uma descrição ao Ollama e devolve o texto limpo.
+
+    Retorna None se a chamada falhar (conexão, HTTP, fila cheia) ou for cancelada e
+    "" se o modelo respondeu sem conteúdo útil.
+
+    Args:
+        prompt: Texto montado por build_object_prompt/build_column_prompt.
+        cache: ResponseCache opcional (reaproveita sugestões já geradas).
+        priority: Prioridade no escalonador; padrão BATCH (o chat interativo passa na frente).
+        model: Modelo Ollama; padrão OLLAMA_DEFAULT_MODEL.
+        cancel: CancelToken opcional; cancelá-lo interrompe a geração no Ollama.
+        on_chunk: Se informado, a resposta vem em stream e recebe o texto parcial a cada
+            chunk. Uma exceção levantada por ele (ex.: rerun do Streamlit) fecha o stream.
+    """
+    # Import tardio: as heurísticas deste módulo funcionam mesmo sem a integração Ollama
+    from src.ollama_integration.client import chat_completion
+    from src.ollama_integration.scheduler import Priority
+
+    if priority is None:
+        priority = Priority.BATCH
+    logger.debug(f"Enviando prompt para IA: {prompt}")
+    messages = [{"role": "user", "content": prompt}]
+    if on_chunk is None:
+        response = chat_completion(messages=messages, model=model, stream=False, priority=priority, cache=cache,
+                                   cancel=cancel)
+    else:
+        chunks = chat_completion(messages=messages, model=model, stream=True, priority=priority, cache=cache,
+                                 cancel=cancel)
+        response = ""
+        try:
+            for chunk in chunks or ():
+                response += chunk
+                on_chunk(response)
+        finally:
+            if chunks is not None:
+                chunks.close()
+        if not response or (cancel is not None and cancel.cancelled):
+            response = None # Stream sem nenhum chunk: o cliente já logou o erro
+    if response is None:
+        return None
+    cleaned_response = clean_ai_response(response)
+    logger.debug(f"Resposta da IA (limpa): {cleaned_response}")
+    return cleaned_response
+
+# --- Heurística de descrições existentes (Adaptada de view_schema_app.py) ---
+def find_existing_description(metadata, schema_data, current_object_name, target_col_name):
+    """
+    Procura por uma descrição existente para uma coluna:
+    1. Busca por nome exato em outras tabelas/views.
+    2. Se for FK, busca a descrição da PK referenciada.
+    3. Se for PK, busca a descrição de uma coluna FK que a referencie.
+    """
+    if not metadata or not schema_data or not target_col_name or not current_object_name:
+        return None, None # Retorna None para descrição e para a fonte
+
+    # 1. Busca por nome exato (prioridade)
+    for obj_type_key in ['TABLES', 'VIEWS', 'DESCONHECIDOS']:
+        for obj_name, obj_meta in metadata.get(obj_type_key, {}).items():
+            if obj_name == current_object_name: continue
+            col_meta = obj_meta.get('COLUMNS', {}).get(target_col_name)
+            if col_meta and col_meta.get('description', '').strip():
+                desc = col_meta['description']
+                source = f"nome exato em `{obj_name}`"
+                logger.debug(f"Heurística: Descrição encontrada por {source} para {current_object_name}.{target_col_name}")
+                return desc, source
+
+    # Se não achou por nome exato, tenta via FKs (precisa do schema_data técnico)
+    current_object_info = schema_data.get(current_object_name)
+    if not current_object_info:
+        logger.warning(f"Schema técnico não encontrado para {current_object_name} ao buscar heurística FK.")
+        return None, None
+    
+    current_constraints = current_object_info.get('constraints', {})
+    current_pk_cols = [col for pk in current_constraints.get('primary_key', []) for col in pk.get('columns', [])]
+
+    # 2. Busca Direta (Se target_col é FK)
+    for fk in current_constraints.get('foreign_keys', []):
+        fk_columns = fk.get('columns', [])
+        ref_table = fk.get('references_table')
+        ref_columns = fk.get('references_columns', [])
+        if target_col_name in fk_columns and ref_table and ref_columns:
+            try:
+                idx = fk_columns.index(target_col_name)
+                ref_col_name = ref_columns[idx]
+                # Busca descrição da PK referenciada
+                ref_object_info = schema_data.get(ref_table) # Precisa info técnica da tabela referenciada
+                if not ref_object_info:
+                     logger.warning(f"Schema técnico não encontrado para tabela referenciada {ref_table}")
+                     continue
+                ref_obj_type = ref_object_info.get('object_type', 'TABLE')
+                ref_obj_type_key = ref_obj_type + "S"
+                
+                ref_col_meta = metadata.get(ref_obj_type_key, {}).get(ref_table, {}).get('COLUMNS', {}).get(ref_col_name)
+                if ref_col_meta and ref_col_meta.get('description', '').strip():
+                    desc = ref_col_meta['description']
+                    source = f"chave estrangeira para `{ref_table}.{ref_col_name}`"
+                    logger.debug(f"Heurística: Descrição encontrada por {source} para {current_object_name}.{target_col_name}")
+                    return desc, source
+            except (IndexError, ValueError): continue
+
+    # 3. Busca Inversa (Se target_col é PK)
+    if target_col_name in current_pk_cols:
+        for other_obj_name, other_obj_info in schema_data.items():
+            if other_obj_name == current_object_name: continue
+            other_constraints = other_obj_info.get('constraints', {})
+            for other_fk in other_constraints.get('foreign_keys', []):
+                 if other_fk.get('references_table') == current_object_name and \
+                    target_col_name in other_fk.get('references_columns', []):
+                     referencing_columns = other_fk.get('columns', [])
+                     ref_pk_columns = other_fk.get('references_columns', [])
+                     try:
+                         idx_pk = ref_pk_columns.index(target_col_name)
+                         referencing_col_name = referencing_columns[idx_pk]
+                         other_obj_type = other_obj_info.get('object_type', 'TABLE')
+                         other_obj_type_key = other_obj_type + "S"
+                         other_col_meta = metadata.get(other_obj_type_key, {}).get(other_obj_name, {}).get('COLUMNS', {}).get(referencing_col_name)
+                         if other_col_meta and other_col_meta.get('description', '').strip():
+                             desc = other_col_meta['description']
+                             source = f"coluna `{referencing_col_name}` em `{other_obj_name}` (ref. esta PK)"
+                             logger.debug(f"Heurística: Descrição encontrada por {source} para {current_object_name}.{target_col_name}")
+                             return desc, source
+                     except (IndexError, ValueError): continue
+
+    return None, None # Nenhuma descrição encontrada
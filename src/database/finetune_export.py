@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import Any, Dict, Iterator, List, Tuple
+
+from src.database.history import ConnectionManager, get_connection_manager
+from src.database.retention import iter_archive
+
+MIN_CONVERSATION_TURNS = 2 # Exigir pelo menos 2 turnos (user+assistant) para considerar
+# Uma sessão só é exportada depois de ficar esse tempo sem mensagens novas (conversa concluída)
+FINETUNE_SETTLE_MINUTES = int(os.getenv("FINETUNE_SETTLE_MINUTES", "30"))
+
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def format_conversation(messages: List[Tuple[str, str]]) -> Dict[str, Any] | None:
+    """Formata uma lista de tuplas (user, assistant) no formato SFTTrainer ({"messages": [...]})."""
+    formatted = []
+    for user_msg, assistant_msg in messages:
+        if user_msg:
+            formatted.append({"role": "user", "content": user_msg})
+        if assistant_msg:
+            formatted.append({"role": "assistant", "content": assistant_msg})
+    return {"messages": formatted} if formatted else None
+
+def iter_sessions(conn, since_id: int = 0, settled_before: str | None = None, positive_only: bool = False,
+                  min_turns: int = MIN_CONVERSATION_TURNS) -> Iterator[Tuple[str, List[Tuple[str, str]], int, int]]:
+    """Percorre as sessões alteradas depois de `since_id`, uma de cada vez (memória constante).
+
+    Os filtros rodam no SQL: sessões com última mensagem depois de `since_id` e antes de
+    `settled_before`; mensagens com pergunta e resposta (e, com `positive_only`,
+    feedback 👍); pelo menos `min_turns` mensagens restantes na sessão (função de janela,
+    calculada sessão a sessão). As linhas vêm em ORDER BY session_id, id (coberto pelo
+    índice de sessão), sem ordenação em memória; cada sessão é produzida assim que a
+    próxima começa.
+
+    Yields:
+        (session_id, [(pergunta, resposta), ...], first_id da sessão, last_id da sessão)
+    """
+    sql = f''' SELECT session_id, user_message, assistant_message, first_id, last_id FROM (
+                   SELECT h.id, h.session_id, h.user_message, h.assistant_message, s.first_id, s.last_id,
+                          COUNT(*) OVER (PARTITION BY h.session_id) AS turns
+                   FROM chat_history h JOIN chat_sessions s ON s.session_id = h.session_id
+                   WHERE h.session_id IN (SELECT session_id FROM chat_sessions
+                                          WHERE last_id > ? {"AND last_at <= ?" if settled_before else ""})
+                     AND h.user_message <> '' AND h.assistant_message <> ''
+                     {"AND h.feedback = 1" if positive_only else ""}
+               )
+               WHERE turns >= ?
+               ORDER BY session_id, id '''
+    params = [since_id] + ([settled_before] if settled_before else []) + [min_turns]
+    for session_id, rows in groupby(conn.execute(sql, params), key=lambda row: row[0]):
+        rows = list(rows)
+        yield session_id, [(row[1], row[2]) for row in rows], rows[0][3], rows[0][4]
+
+def _iter_archived_sessions(positive_only: bool, min_turns: int) -> Iterator[List[Tuple[str, str]]]:
+    """Sessões do arquivo morto (agrupadas em memória: uma sessão pode cruzar partições)."""
+    sessions: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+    for row in iter_archive():
+        if row.get("session_id") and row.get("user_message") and row.get("assistant_message") \
+                and (not positive_only or row.get("feedback") == 1):
+            sessions[row["session_id"]].append((row["user_message"], row["assistant_message"]))
+    for messages in sessions.values():
+        if len(messages) >= min_turns:
+            yield messages
+
+
+def export_finetune_data(output_path: str, manager: ConnectionManager | None = None, positive_only: bool = False,
+                         min_turns: int = MIN_CONVERSATION_TURNS, settle_minutes: int | None = None,
+                         rebuild: bool = False, include_archive: bool = True,
+                         now: datetime | None = None) -> Dict[str, Any] | None:
+    """Exporta as conversas para JSONL (SFTTrainer), só acrescentando o que mudou desde a última vez.
+
+    O estado fica em `<output_path>.state.json`: a marca d'água (maior `last_id` de sessão
+    já exportada), o tamanho do arquivo no fim da última execução concluída e os filtros
+    usados. A cada execução:
+
+    - sessões com mensagens novas depois da marca (e paradas há `settle_minutes`) são
+      acrescentadas ao arquivo; uma sessão já exportada que recebeu mensagens novas
+      entra de novo, completa (conta em `superseded`; `rebuild` remove as versões antigas);
+    - o que foi escrito por uma execução interrompida (depois do tamanho salvo) é descartado;
+    - com filtros diferentes dos da última execução, ou com `rebuild`, o arquivo é refeito do
+      zero (incluindo o arquivo morto da retenção, se `include_archive`).
+
+    Returns:
+        Relatório (sessões e mensagens escritas, marca d'água, modo) ou None em caso de erro.
+    """
+    conn = (manager or get_connection_manager()).connection()
+    if conn is None:
+        return None
+    settle_minutes = settle_minutes if settle_minutes is not None else FINETUNE_SETTLE_MINUTES
+    filters = {"positive_only": positive_only, "min_turns": min_turns}
+    state_path = output_path + ".state.json"
+    state = None
+    if not rebuild and os.path.exists(state_path) and os.path.exists(output_path):
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("filters") != filters:
+            logging.info("Filtros diferentes dos da última exportação: refazendo o arquivo do zero.")
+            state = None
+
+    started = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+    settled_before = (now - timedelta(minutes=settle_minutes)).strftime(_TIMESTAMP_FORMAT) if settle_minutes > 0 else None
+    since_id = state["last_id"] if state else 0
+    report = {"mode": "incremental" if state else "rebuild", "sessions": 0, "messages": 0, "superseded": 0}
+    if not state and os.path.exists(state_path):
+        # O arquivo vai ser refeito: um estado antigo apontaria para um tamanho que não vale mais
+        # se esta execução falhar no meio
+        os.remove(state_path)
+    with open(output_path, "r+b" if state else "wb") as raw:
+        if state:
+            raw.truncate(state["output_bytes"]) # Descarta a cauda de uma execução interrompida
+            raw.seek(state["output_bytes"])
+
+        def write(messages: List[Tuple[str, str]]) -> None:
+            raw.write((json.dumps(format_conversation(messages), ensure_ascii=False) + "\n").encode("utf-8"))
+            report["sessions"] += 1
+            report["messages"] += len(messages)
+
+        if not state and include_archive:
+            for messages in _iter_archived_sessions(positive_only, min_turns):
+                write(messages)
+        try:
+            conn.execute("BEGIN") # Mesma foto do banco (WAL) para as sessões e a nova marca d'água
+            try:
+                # Sessões ignoradas pelos filtros também avançam a marca (voltam se mudarem de novo)
+                row = conn.execute(f"SELECT MAX(last_id) FROM chat_sessions WHERE last_id > ?"
+                                   f"{' AND last_at <= ?' if settled_before else ''}",
+                                   [since_id] + ([settled_before] if settled_before else [])).fetchone()
+                last_id = max(since_id, row[0] or 0)
+                for session_id, messages, first_id, _ in iter_sessions(conn, since_id, settled_before,
+                                                                       positive_only, min_turns):
+                    write(messages)
+                    report["superseded"] += first_id <= since_id # Já exportada antes, com menos mensagens
+            finally:
+                conn.rollback() # Só leitura
+        except Exception as e:
+            logging.error(f"Erro ao exportar o histórico para {output_path}: {e}")
+            return None
+        raw.flush()
+        os.fsync(raw.fileno())
+        output_bytes = raw.tell()
+
+    superseded = report["superseded"] + (state.get("superseded", 0) if state else 0)
+    new_state = {"last_id": last_id, "output_bytes": output_bytes, "filters": filters, "superseded": superseded,
+                 "updated_at": now.strftime(_TIMESTAMP_FORMAT)}
+    with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(new_state, f)
+    os.replace(state_path + ".tmp", state_path)
+    report.update(last_id=last_id, output_bytes=output_bytes, superseded_total=superseded,
+                  duration_s=round(time.perf_counter() - started, 3))
+    return report
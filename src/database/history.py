@@ -1,76 +1,443 @@
+import atexit
+import queue
 import sqlite3
 import logging
 import os
-from datetime import datetime
+import re
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Tuple
 
 # Define o nome do arquivo do banco de dados
-DB_FILE = "chat_history.db"
+DB_FILE = os.getenv("CHAT_HISTORY_DB", "chat_history.db")
+
+# Ajustes das conexões (ver ConnectionManager). Com WAL, synchronous=NORMAL não corrompe o
+# banco numa queda; no pior caso perde as últimas transações ainda não gravadas no checkpoint.
+HISTORY_DB_SYNCHRONOUS = os.getenv("HISTORY_DB_SYNCHRONOUS", "NORMAL")
+HISTORY_DB_CACHE_SIZE_KB = int(os.getenv("HISTORY_DB_CACHE_SIZE_KB", "16384"))
+HISTORY_DB_BUSY_TIMEOUT_MS = int(os.getenv("HISTORY_DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Gravação em segundo plano (HistoryWriter): tamanho máximo da fila e operações por transação
+HISTORY_WRITE_QUEUE = int(os.getenv("HISTORY_WRITE_QUEUE", "1000"))
+HISTORY_WRITE_BATCH = int(os.getenv("HISTORY_WRITE_BATCH", "100"))
+# Com a fila cheia, quanto tempo quem grava espera por uma vaga antes de desistir da operação
+HISTORY_WRITE_TIMEOUT = float(os.getenv("HISTORY_WRITE_TIMEOUT", "5"))
+
+# Métricas de desempenho opcionais de cada mensagem (argumento `metrics` de save_chat_message)
+PERF_COLUMNS = {
+    "model": "TEXT",
+    "ttft_ms": "INTEGER", # Do envio da mensagem ao primeiro pedaço da resposta
+    "latency_ms": "INTEGER", # Do envio da mensagem à resposta completa
+    "prompt_tokens": "INTEGER",
+    "completion_tokens": "INTEGER",
+    "status": "TEXT", # 'ok', 'error', 'cancelled' ou 'reused'
+}
+
+# Mensagens que falharam ou foram canceladas ficam gravadas só pelas métricas (resposta
+# vazia): não contam como turno nem voltam ao recarregar a conversa
+_COUNTS_AS_TURN = "({row}.status IS NOT 'error' AND {row}.status IS NOT 'cancelled')"
+
+
+class ConnectionManager:
+    """Uma conexão SQLite persistente por thread, em modo WAL.
+
+    Antes cada gravação abria uma conexão, fazia o commit e fechava, no modo de journal
+    padrão (rollback): todo INSERT pagava a abertura do arquivo, a leitura do schema e
+    vários fsync, e um escritor bloqueava os leitores. Aqui cada thread abre a sua conexão
+    uma vez e a reutiliza, com:
+
+    - `journal_mode=WAL`: leitores não bloqueiam o escritor (e vice-versa) e cada commit
+      é um append no arquivo -wal;
+    - `synchronous` (padrão NORMAL): fsync só no checkpoint, não a cada commit;
+    - `cache_size`: cache de páginas por conexão (em KiB);
+    - `busy_timeout`: escritores concorrentes esperam o lock em vez de falhar na hora.
+
+    O schema é garantido na primeira conexão (`auto_migrate`): as migrações pendentes
+    (ver `migrate`) rodam uma vez por processo; depois disso, nada. Criar o gerenciador
+    ou importar este módulo não toca no disco.
+
+    As conexões não devem ser fechadas por quem as usa; `close_all()` fecha todas
+    (ex.: no encerramento do processo ou ao trocar de arquivo nos testes).
+    """
+
+    def __init__(self, path: str | None = None, synchronous: str | None = None,
+                 cache_size_kb: int | None = None, busy_timeout_ms: int | None = None,
+                 auto_migrate: bool = True):
+        self.path = path or DB_FILE
+        self.synchronous = synchronous or HISTORY_DB_SYNCHRONOUS
+        self.cache_size_kb = cache_size_kb if cache_size_kb is not None else HISTORY_DB_CACHE_SIZE_KB
+        self.busy_timeout_ms = busy_timeout_ms if busy_timeout_ms is not None else HISTORY_DB_BUSY_TIMEOUT_MS
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[int, sqlite3.Connection] = {} # ident da thread -> conexão
+        self.opened = 0
+        self.journal_mode: str | None = None
+        self.auto_migrate = auto_migrate
+        self.schema_version: int | None = None # Conhecida após a primeira conexão
+        self._migrate_lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection | None:
+        """Conexão da thread atual (aberta e configurada na primeira chamada). None em caso de erro."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        try:
+            # check_same_thread=False só para permitir o close_all() de outra thread;
+            # cada conexão é usada apenas pela thread dona
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+            conn.row_factory = sqlite3.Row # Retorna linhas como dicionários
+            # Só tem efeito em banco novo (antes da primeira tabela); bancos antigos passam
+            # a usá-lo no primeiro VACUUM da retenção (src.database.retention)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self.journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            if self.journal_mode.lower() != "wal":
+                logging.warning(f"Banco {self.path} não suporta WAL (journal_mode={self.journal_mode}).")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute(f"PRAGMA cache_size={-abs(self.cache_size_kb)}") # Negativo: tamanho em KiB
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao conectar ao banco de dados {self.path}: {e}")
+            if conn is not None:
+                conn.close()
+            return None
+        self._local.conn = conn
+        with self._lock:
+            self._prune_dead_threads()
+            self._connections[threading.get_ident()] = conn
+            self.opened += 1
+        logging.info(f"Conexão com o banco de dados {self.path} estabelecida (thread {threading.current_thread().name}).")
+        if self.auto_migrate and self.schema_version is None:
+            self._ensure_schema(conn)
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection) -> None:
+        with self._migrate_lock: # Outras threads esperam a migração em vez de migrar junto
+            if self.schema_version is not None:
+                return
+            try:
+                self.schema_version = migrate(conn)
+            except sqlite3.Error as e:
+                # A conexão é devolvida mesmo assim; a próxima conexão tenta de novo
+                logging.error(f"Erro ao inicializar/atualizar a tabela 'chat_history': {e}")
+
+    def _prune_dead_threads(self) -> None:
+        # Threads que terminaram não vão mais usar a conexão delas
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._connections if ident not in alive]:
+            self._connections.pop(ident).close()
+
+    def close_all(self) -> None:
+        """Fecha as conexões de todas as threads; a próxima chamada de cada uma abre outra."""
+        with self._lock:
+            connections, self._connections = list(self._connections.values()), {}
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logging.warning(f"Erro ao fechar conexão com {self.path}: {e}")
+        self._local = threading.local()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"path": self.path, "journal_mode": self.journal_mode, "synchronous": self.synchronous,
+                    "open_connections": len(self._connections), "opened_total": self.opened}
+
+
+_default_manager: ConnectionManager | None = None
+_default_manager_lock = threading.Lock()
+
+def get_connection_manager() -> ConnectionManager:
+    """Retorna o gerenciador de conexões compartilhado do processo (banco DB_FILE)."""
+    global _default_manager
+    if _default_manager is None:
+        with _default_manager_lock:
+            if _default_manager is None:
+                _default_manager = ConnectionManager()
+    return _default_manager
 
 def get_db_connection():
-    """Estabelece conexão com o banco de dados SQLite."""
-    conn = None
+    """Retorna a conexão persistente da thread atual com o banco (não feche: ela é reutilizada)."""
+    return get_connection_manager().connection()
+
+# --- Migrações do schema ---
+# Cada passo leva o banco da versão N-1 para N (N = posição na lista, a partir de 1); a versão
+# atual fica em PRAGMA user_version. Passos novos entram sempre no fim da lista.
+
+def _migration_create_chat_history(conn: sqlite3.Connection) -> None:
+    """v1: tabela chat_history (bancos antigos, criados antes da coluna feedback, ganham a coluna)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT, -- Para agrupar mensagens de uma mesma sessão (opcional)
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            user_message TEXT NOT NULL,
+            assistant_message TEXT NOT NULL,
+            feedback INTEGER DEFAULT NULL
+        )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_history)")}
+    if "feedback" not in columns:
+        conn.execute("ALTER TABLE chat_history ADD COLUMN feedback INTEGER DEFAULT NULL")
+        logging.info("Coluna 'feedback' adicionada à tabela 'chat_history'.")
+
+def _migration_session_indexes(conn: sqlite3.Connection) -> None:
+    """v2: índices por sessão e por data, e a tabela chat_sessions (uma linha por sessão).
+
+    - (session_id, id): recarregar uma sessão em ordem é uma busca no índice, sem ordenar;
+    - (timestamp): consultas por período (análises, retenção);
+    - chat_sessions, mantida por trigger a cada INSERT: listar as sessões mais recentes
+      com paginação por chave (last_id) sem agrupar a tabela inteira.
+    """
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_session ON chat_history(session_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_timestamp ON chat_history(timestamp)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            session_id TEXT PRIMARY KEY,
+            first_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            started_at DATETIME,
+            last_at DATETIME,
+            turns INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_last_id ON chat_sessions(last_id)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_chat_history_session AFTER INSERT ON chat_history
+        WHEN NEW.session_id IS NOT NULL
+        BEGIN
+            INSERT INTO chat_sessions(session_id, first_id, last_id, started_at, last_at, turns)
+            VALUES (NEW.session_id, NEW.id, NEW.id, NEW.timestamp, NEW.timestamp, 1)
+            ON CONFLICT(session_id) DO UPDATE SET
+                last_id = MAX(last_id, excluded.last_id),
+                last_at = MAX(last_at, excluded.last_at),
+                turns = turns + 1;
+        END
+    """)
+    # Sessões que já existiam
+    conn.execute("""
+        INSERT OR IGNORE INTO chat_sessions(session_id, first_id, last_id, started_at, last_at, turns)
+        SELECT session_id, MIN(id), MAX(id), MIN(timestamp), MAX(timestamp), COUNT(*)
+        FROM chat_history WHERE session_id IS NOT NULL GROUP BY session_id
+    """)
+
+def fts5_available(conn: sqlite3.Connection) -> bool:
+    return bool(conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").fetchone()[0])
+
+def _migration_full_text_index(conn: sqlite3.Connection) -> None:
+    """v3: índice FTS5 das mensagens (chat_history_fts), mantido por triggers.
+
+    Tabela de conteúdo externo: o índice guarda só os termos (o texto continua em
+    chat_history). `_` faz parte dos termos, para que nomes como PED_VALOR sejam um termo
+    só; acentos são ignorados na busca. Sem FTS5 no SQLite, a migração só avisa e a busca
+    cai para LIKE (lenta); o índice é criado por `migrate` quando o FTS5 aparecer.
+    """
+    if not fts5_available(conn):
+        logging.warning("SQLite sem FTS5: a busca no histórico usará LIKE (varredura completa).")
+        return
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+            user_message, assistant_message,
+            content='chat_history', content_rowid='id',
+            tokenize="unicode61 remove_diacritics 2 tokenchars '_'"
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_chat_history_fts_insert AFTER INSERT ON chat_history BEGIN
+            INSERT INTO chat_history_fts(rowid, user_message, assistant_message)
+            VALUES (NEW.id, NEW.user_message, NEW.assistant_message);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_chat_history_fts_delete AFTER DELETE ON chat_history BEGIN
+            INSERT INTO chat_history_fts(chat_history_fts, rowid, user_message, assistant_message)
+            VALUES ('delete', OLD.id, OLD.user_message, OLD.assistant_message);
+        END
+    """)
+    # Só mudanças no texto mexem no índice (gravar feedback não)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_chat_history_fts_update AFTER UPDATE OF user_message, assistant_message
+        ON chat_history BEGIN
+            INSERT INTO chat_history_fts(chat_history_fts, rowid, user_message, assistant_message)
+            VALUES ('delete', OLD.id, OLD.user_message, OLD.assistant_message);
+            INSERT INTO chat_history_fts(rowid, user_message, assistant_message)
+            VALUES (NEW.id, NEW.user_message, NEW.assistant_message);
+        END
+    """)
+    conn.execute("INSERT INTO chat_history_fts(chat_history_fts) VALUES ('rebuild')") # Mensagens que já existiam
+
+def _migration_session_age_index(conn: sqlite3.Connection) -> None:
+    """v4: índice de chat_sessions por última atividade (retenção: conversas antigas)."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_last_at ON chat_sessions(last_at)")
+
+def _migration_positive_feedback_index(conn: sqlite3.Connection) -> None:
+    """v5: índice parcial das mensagens com feedback positivo (reaproveitamento de respostas)."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_positive ON chat_history(id) WHERE feedback = 1")
+
+def _migration_performance_columns(conn: sqlite3.Connection) -> None:
+    """v6: métricas de desempenho por mensagem e agregados por hora (ver perf_rollup).
+
+    - Colunas em chat_history (NULL nas mensagens anteriores): modelo, TTFT e latência
+      total (ms), tokens do prompt e da resposta e status ('ok', 'error', 'cancelled',
+      'reused');
+    - chat_perf_hourly: uma linha por (hora, modelo), mantida pelo PerfRollup;
+    - chat_perf_dirty: horas com mensagens novas ainda não agregadas, marcadas por trigger
+      a cada INSERT com métricas (inclusive as que chegam fora de ordem).
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_history)")}
+    for column, sql_type in PERF_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE chat_history ADD COLUMN {column} {sql_type}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_perf_hourly (
+            hour TEXT NOT NULL, -- 'AAAA-MM-DD HH:00:00' (UTC)
+            model TEXT NOT NULL,
+            requests INTEGER NOT NULL, -- Todas as mensagens, qualquer status
+            errors INTEGER NOT NULL,
+            cancelled INTEGER NOT NULL,
+            reused INTEGER NOT NULL,
+            ok INTEGER NOT NULL, -- Base das latências abaixo
+            latency_sum_ms INTEGER NOT NULL,
+            latency_p50_ms INTEGER,
+            latency_p95_ms INTEGER,
+            latency_p99_ms INTEGER,
+            latency_max_ms INTEGER,
+            ttft_p50_ms INTEGER,
+            ttft_p95_ms INTEGER,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            latency_hist TEXT NOT NULL, -- Histograma (JSON) para juntar horas: ver perf_rollup
+            ttft_hist TEXT NOT NULL,
+            PRIMARY KEY (hour, model)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_perf_hourly_model ON chat_perf_hourly(model, hour)")
+    conn.execute("CREATE TABLE IF NOT EXISTS chat_perf_dirty (hour TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_chat_history_perf AFTER INSERT ON chat_history
+        WHEN NEW.status IS NOT NULL
+        BEGIN
+            INSERT OR IGNORE INTO chat_perf_dirty(hour) VALUES (substr(NEW.timestamp, 1, 13) || ':00:00');
+        END
+    """)
+
+def _migration_session_turns_skip_failures(conn: sqlite3.Connection) -> None:
+    """v7: turns de chat_sessions deixa de contar mensagens com status 'error' ou 'cancelled'.
+
+    Essas linhas existem só pelas métricas (a resposta fica vazia); `load_session` também
+    as ignora, então a conversa restaurada e a contagem de turnos batem.
+    """
+    conn.execute("DROP TRIGGER IF EXISTS trg_chat_history_session")
+    conn.execute(f"""
+        CREATE TRIGGER trg_chat_history_session AFTER INSERT ON chat_history
+        WHEN NEW.session_id IS NOT NULL
+        BEGIN
+            INSERT INTO chat_sessions(session_id, first_id, last_id, started_at, last_at, turns)
+            VALUES (NEW.session_id, NEW.id, NEW.id, NEW.timestamp, NEW.timestamp, {_COUNTS_AS_TURN.format(row="NEW")})
+            ON CONFLICT(session_id) DO UPDATE SET
+                last_id = MAX(last_id, excluded.last_id),
+                last_at = MAX(last_at, excluded.last_at),
+                turns = turns + excluded.turns;
+        END
+    """)
+    conn.execute(f"""
+        UPDATE chat_sessions SET turns = (
+            SELECT COUNT(*) FROM chat_history h
+            WHERE h.session_id = chat_sessions.session_id AND {_COUNTS_AS_TURN.format(row="h")}
+        )
+    """)
+
+MIGRATIONS = [
+    _migration_create_chat_history,
+    _migration_session_indexes,
+    _migration_full_text_index,
+    _migration_session_age_index,
+    _migration_positive_feedback_index,
+    _migration_performance_columns,
+    _migration_session_turns_skip_failures,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Aplica as migrações pendentes, cada uma em sua transação. Retorna a versão final do schema."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        logging.warning(f"Banco do histórico na versão {version}, mais nova que a deste código ({SCHEMA_VERSION}).")
+    while version < SCHEMA_VERSION:
+        conn.execute("BEGIN IMMEDIATE") # Outro processo migrando ao mesmo tempo espera aqui
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                step = MIGRATIONS[version]
+                step(conn)
+                version += 1
+                conn.execute(f"PRAGMA user_version = {version}")
+                logging.info(f"Schema do histórico migrado para a versão {version} ({step.__doc__.split(':')[0]}).")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    if version >= 3:
+        _ensure_full_text_index(conn)
+    return version
+
+def _ensure_full_text_index(conn: sqlite3.Connection) -> None:
+    """Cria o índice FTS5 em bancos que passaram da v3 num SQLite sem FTS5 (ex.: Python atualizado depois)."""
+    if not fts5_available(conn) or _has_full_text_index(conn):
+        return
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        conn = sqlite3.connect(DB_FILE)
-        conn.row_factory = sqlite3.Row # Retorna linhas como dicionários
-        logging.info(f"Conexão com o banco de dados {DB_FILE} estabelecida.")
-        return conn
-    except sqlite3.Error as e:
-        logging.error(f"Erro ao conectar ao banco de dados {DB_FILE}: {e}")
-        return None
+        if not _has_full_text_index(conn): # Outro processo pode ter criado enquanto esperávamos
+            _migration_full_text_index(conn)
+            logging.info("Índice FTS5 do histórico criado (SQLite agora tem FTS5).")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _has_full_text_index(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_history_fts'").fetchone() is not None
 
 def init_db():
-    """Inicializa o BD, adicionando a coluna feedback se necessário."""
+    """Garante o schema do banco padrão já (normalmente acontece sozinho no primeiro uso)."""
     conn = get_db_connection()
     if conn is None: return
 
     try:
-        cursor = conn.cursor()
-        # Cria a tabela se não existir (já inclui a coluna nova)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chat_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT, -- Para agrupar mensagens de uma mesma sessão (opcional)
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                user_message TEXT NOT NULL,
-                assistant_message TEXT NOT NULL,
-                feedback INTEGER DEFAULT NULL
-            )
-        """)
-        # Tenta adicionar a coluna 'feedback' se ela não existir (para bancos antigos)
-        try:
-            cursor.execute("ALTER TABLE chat_history ADD COLUMN feedback INTEGER DEFAULT NULL")
-            logging.info("Coluna 'feedback' adicionada à tabela 'chat_history'.")
-        except sqlite3.OperationalError as e:
-            # Ignora o erro se a coluna já existir
-            if "duplicate column name" in str(e):
-                pass # Coluna já existe, tudo bem
-            else:
-                raise # Levanta outros erros de alteração
-        conn.commit()
+        migrate(conn)
         logging.info("Tabela 'chat_history' verificada/atualizada com sucesso.")
     except sqlite3.Error as e:
         logging.error(f"Erro ao inicializar/atualizar a tabela 'chat_history': {e}")
-    finally:
-        if conn: conn.close()
 
-def save_chat_message(user_message: str, assistant_message: str, session_id: str | None = None) -> int | None:
-    """Salva uma interação de chat no BD e retorna o ID da linha inserida."""
+def _metrics_values(metrics: Dict[str, Any] | None) -> tuple:
+    """Valores das colunas de PERF_COLUMNS, na ordem (chaves desconhecidas são erro de programação)."""
+    metrics = metrics or {}
+    unknown = set(metrics) - set(PERF_COLUMNS)
+    if unknown:
+        raise ValueError(f"Métricas desconhecidas: {sorted(unknown)}")
+    return tuple(metrics.get(column) for column in PERF_COLUMNS)
+
+def save_chat_message(user_message: str, assistant_message: str, session_id: str | None = None,
+                      metrics: Dict[str, Any] | None = None) -> int | None:
+    """Salva uma interação de chat no BD e retorna o ID da linha inserida.
+
+    `metrics` (opcional) preenche as colunas de PERF_COLUMNS (modelo, latências, tokens, status).
+    """
     conn = get_db_connection()
     if conn is None: return None
 
-    sql = ''' INSERT INTO chat_history(user_message, assistant_message, session_id)
-              VALUES(?,?,?) '''
+    sql = f''' INSERT INTO chat_history(user_message, assistant_message, session_id, {", ".join(PERF_COLUMNS)})
+               VALUES(?,?,?{",?" * len(PERF_COLUMNS)}) '''
     last_id = None
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql, (user_message, assistant_message, session_id))
-        conn.commit()
+        with conn: # Commit ao sair (rollback em caso de erro)
+            cursor = conn.execute(sql, (user_message, assistant_message, session_id) + _metrics_values(metrics))
         last_id = cursor.lastrowid # Obtém o ID da última linha inserida
         logging.info(f"Mensagem salva no histórico (ID: {last_id})")
     except sqlite3.Error as e:
         logging.error(f"Erro ao salvar mensagem no histórico: {e}")
-    finally:
-        if conn: conn.close()
     return last_id # Retorna o ID
 
 def update_feedback(message_id: int, feedback_value: int):
@@ -86,14 +453,372 @@ def update_feedback(message_id: int, feedback_value: int):
               SET feedback = ?
               WHERE id = ? '''
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql, (feedback_value, message_id))
-        conn.commit()
+        with conn:
+            conn.execute(sql, (feedback_value, message_id))
         logging.info(f"Feedback ({feedback_value}) atualizado para a mensagem ID: {message_id}")
     except sqlite3.Error as e:
         logging.error(f"Erro ao atualizar feedback para mensagem ID {message_id}: {e}")
-    finally:
-        if conn: conn.close()
 
-# Chama init_db quando o módulo é importado para garantir que a tabela exista
-init_db() 
\ No newline at end of file
+# --- Consultas ---
+
+def iter_positive_exchanges(after_id: int = 0, batch_size: int = 500) -> Iterator[Tuple[int, str, str, str | None]]:
+    """(id, pergunta, resposta, modelo) dos primeiros turnos com feedback 👍, em ordem de ID, lidos em lotes.
+
+    Só o primeiro turno de cada sessão: as respostas seguintes dependem da conversa. Cópias
+    servidas pelo reaproveitamento (status 'reused') ficam de fora: o 👍 nelas não duplica
+    a resposta original.
+    """
+    conn = get_db_connection()
+    if conn is None: return
+
+    # Sem estatísticas o planejador prefere varrer pela chave primária; o índice parcial só tem as 👍
+    sql = ''' SELECT id, user_message, assistant_message, model FROM chat_history AS h INDEXED BY idx_chat_history_positive
+              WHERE feedback = 1 AND id > ? AND status IS NOT 'reused'
+                AND (session_id IS NULL OR id = (SELECT first_id FROM chat_sessions s WHERE s.session_id = h.session_id))
+              ORDER BY id
+              LIMIT ? '''
+    while True:
+        try:
+            rows = conn.execute(sql, (after_id, batch_size)).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao ler respostas bem avaliadas do histórico: {e}")
+            return
+        yield from (tuple(row) for row in rows)
+        if len(rows) < batch_size:
+            return
+        after_id = rows[-1][0]
+
+def list_sessions(limit: int = 50, before: int | None = None) -> Dict[str, Any] | None:
+    """Lista as sessões da mais recente para a mais antiga, paginando por chave.
+
+    Args:
+        limit: Sessões por página.
+        before: Cursor da página anterior (`next_cursor`); None para a primeira página.
+
+    Returns:
+        {"sessions": [{"session_id", "turns", "started_at", "last_at", "first_id", "last_id"}, ...],
+         "next_cursor": int | None} ou None em caso de erro. Cada página é uma busca no
+        índice de chat_sessions a partir do cursor: o custo não cresce com a profundidade.
+    """
+    conn = get_db_connection()
+    if conn is None: return None
+
+    sql = ''' SELECT session_id, turns, started_at, last_at, first_id, last_id
+              FROM chat_sessions
+              {where}
+              ORDER BY last_id DESC
+              LIMIT ? '''
+    try:
+        if before is None:
+            rows = conn.execute(sql.format(where=""), (limit,)).fetchall()
+        else:
+            rows = conn.execute(sql.format(where="WHERE last_id < ?"), (before, limit)).fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Erro ao listar sessões do histórico: {e}")
+        return None
+    sessions = [dict(row) for row in rows]
+    next_cursor = sessions[-1]["last_id"] if len(sessions) == limit else None
+    return {"sessions": sessions, "next_cursor": next_cursor}
+
+def load_session(session_id: str, after_id: int | None = None, limit: int | None = None) -> List[Dict[str, Any]] | None:
+    """Mensagens de uma sessão em ordem cronológica (busca no índice (session_id, id)).
+
+    Args:
+        session_id: Sessão a recarregar.
+        after_id: Só mensagens com ID maior (continuação de uma página anterior).
+        limit: Máximo de mensagens; None para a sessão inteira.
+
+    Returns:
+        Lista de dicionários (id, timestamp, user_message, assistant_message, feedback) ou None em caso de erro.
+        Mensagens que falharam ou foram canceladas (status 'error'/'cancelled') ficam de fora.
+    """
+    conn = get_db_connection()
+    if conn is None: return None
+
+    sql = ''' SELECT id, timestamp, user_message, assistant_message, feedback
+              FROM chat_history
+              WHERE session_id = ? AND id > ? AND {counts_as_turn}
+              ORDER BY id
+              LIMIT ? '''.format(counts_as_turn=_COUNTS_AS_TURN.format(row="chat_history"))
+    try:
+        rows = conn.execute(sql, (session_id, after_id or 0, limit if limit is not None else -1)).fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Erro ao carregar a sessão {session_id} do histórico: {e}")
+        return None
+    return [dict(row) for row in rows]
+
+_SEARCH_TERM_RE = re.compile(r"\w+")
+
+def _fts_query(text: str) -> str | None:
+    """Converte o texto digitado numa consulta FTS5 segura: todos os termos, entre aspas (E)."""
+    terms = _SEARCH_TERM_RE.findall(text or "")
+    return " ".join(f'"{term}"' for term in terms) if terms else None
+
+def _as_db_timestamp(value: datetime | str | None, end_of_day: bool = False) -> str | None:
+    """Formata `value` como CURRENT_TIMESTAMP (UTC). Texto é lido como ISO 8601 (ValueError se inválido).
+
+    Com `end_of_day`, uma data sem hora ("2025-01-31") vale até o último segundo do dia.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        text = value.strip()
+        value = datetime.fromisoformat(text)
+        if end_of_day and len(text) == 10: # Só a data (AAAA-MM-DD)
+            value = value.replace(hour=23, minute=59, second=59)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+def search_history(query: str, limit: int = 20, feedback: int | None = None,
+                   since: datetime | str | None = None, until: datetime | str | None = None,
+                   order: str = "rank") -> List[Dict[str, Any]] | None:
+    """Busca mensagens antigas por termos (índice FTS5).
+
+    Args:
+        query: Texto livre; todas as palavras precisam aparecer (na pergunta ou na resposta).
+        limit: Máximo de resultados.
+        feedback: Só mensagens com este feedback (1 ou -1); None para todas.
+        since / until: Período (inclusive) pelo timestamp da mensagem, em UTC; texto em
+            ISO 8601 ("2025-01-31" em `until` inclui o dia inteiro). ValueError se inválido.
+        order: "rank" (mais relevantes primeiro; calcula o BM25 de todas as ocorrências) ou
+            "recent" (mais recentes primeiro; para no `limit`, bem mais rápido para termos comuns).
+
+    Returns:
+        Lista de dicionários (id, session_id, timestamp, feedback, user_snippet,
+        assistant_snippet, rank) com os termos encontrados marcados com ** nos trechos,
+        ou None em caso de erro. rank é o BM25 (menor = mais relevante).
+    """
+    match = _fts_query(query)
+    if match is None:
+        return []
+    conn = get_db_connection()
+    if conn is None: return None
+
+    filters, params = [], []
+    if feedback is not None:
+        filters.append("h.feedback = ?")
+        params.append(feedback)
+    if since is not None:
+        filters.append("h.timestamp >= ?")
+        params.append(_as_db_timestamp(since))
+    if until is not None:
+        filters.append("h.timestamp <= ?")
+        params.append(_as_db_timestamp(until, end_of_day=True))
+    where = "".join(f" AND {f}" for f in filters)
+    try:
+        if _has_full_text_index(conn):
+            sql = f''' SELECT h.id, h.session_id, h.timestamp, h.feedback,
+                              snippet(chat_history_fts, 0, '**', '**', '…', 16) AS user_snippet,
+                              snippet(chat_history_fts, 1, '**', '**', '…', 24) AS assistant_snippet,
+                              bm25(chat_history_fts) AS rank
+                       FROM chat_history_fts JOIN chat_history h ON h.id = chat_history_fts.rowid
+                       WHERE chat_history_fts MATCH ?{where}
+                       ORDER BY {"chat_history_fts.rowid DESC" if order == "recent" else "rank"}
+                       LIMIT ? '''
+            rows = conn.execute(sql, (match, *params, limit)).fetchall()
+        else:
+            # Sem FTS5: todas as palavras em qualquer um dos campos, mais recentes primeiro
+            terms = _SEARCH_TERM_RE.findall(query)
+            likes = " AND ".join("(h.user_message LIKE ? OR h.assistant_message LIKE ?)" for _ in terms)
+            sql = f''' SELECT h.id, h.session_id, h.timestamp, h.feedback,
+                              h.user_message AS user_snippet, h.assistant_message AS assistant_snippet, NULL AS rank
+                       FROM chat_history h
+                       WHERE {likes}{where}
+                       ORDER BY h.id DESC
+                       LIMIT ? '''
+            rows = conn.execute(sql, (*[f"%{t}%" for t in terms for _ in (0, 1)], *params, limit)).fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Erro ao buscar no histórico ({query!r}): {e}")
+        return None
+    return [dict(row) for row in rows]
+
+_INSERT_SQL = (f"INSERT INTO chat_history(user_message, assistant_message, session_id, {', '.join(PERF_COLUMNS)}) "
+               f"VALUES(?,?,?{',?' * len(PERF_COLUMNS)})")
+_FEEDBACK_SQL = "UPDATE chat_history SET feedback = ? WHERE id = ?"
+_STOP = object()
+
+class HistoryWriter:
+    """Grava o histórico em segundo plano, em lotes, fora do caminho da resposta.
+
+    `save_chat_message` e `update_feedback` só colocam a operação numa fila limitada e
+    retornam na hora; uma thread grava o que estiver na fila em uma única transação
+    (até `batch_size` operações), usando a conexão persistente dela (ConnectionManager).
+
+    O ID de cada mensagem vem do próprio banco (`lastrowid` do INSERT): `save_chat_message`
+    devolve um `Future` resolvido pela thread de gravação depois do commit. `update_feedback`
+    aceita esse `Future` no lugar do ID, então o botão de feedback não precisa esperar a
+    gravação; como a fila é FIFO, o feedback é sempre gravado depois da mensagem.
+
+    Com a fila cheia, quem grava espera uma vaga (até `put_timeout` segundos) em vez de
+    gravar por fora da fila, o que poderia pôr um feedback na frente do INSERT dele.
+    `stop()` (registrado no atexit pelo primeiro `start()`) grava o que falta.
+    """
+
+    def __init__(self, manager: ConnectionManager | None = None, max_queue: int | None = None,
+                 batch_size: int | None = None, put_timeout: float | None = None):
+        self.manager = manager
+        self.batch_size = batch_size or HISTORY_WRITE_BATCH
+        self.put_timeout = put_timeout if put_timeout is not None else HISTORY_WRITE_TIMEOUT
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue or HISTORY_WRITE_QUEUE)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._atexit_registered = False
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.overflows = 0
+
+    def _connection(self) -> sqlite3.Connection | None:
+        return (self.manager or get_connection_manager()).connection()
+
+    def _submit(self, operation: Tuple[str, tuple, Future | None]) -> None:
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(operation)
+            return
+        except queue.Full:
+            self.overflows += 1
+            logging.warning("Fila de gravação do histórico cheia; aguardando vaga.")
+        try:
+            self._queue.put(operation, timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self.failed += 1
+            logging.error(f"Fila de gravação do histórico cheia por {self.put_timeout}s; operação descartada.")
+            if operation[2] is not None:
+                operation[2].set_result(None)
+
+    def save_chat_message(self, user_message: str, assistant_message: str, session_id: str | None = None,
+                          metrics: Dict[str, Any] | None = None) -> "Future[int | None]":
+        """Enfileira a interação; o `Future` devolvido recebe o ID gravado (None se a gravação falhou)."""
+        values = _metrics_values(metrics)
+        future: Future = Future()
+        self._submit((_INSERT_SQL, (user_message, assistant_message, session_id) + values, future))
+        return future
+
+    def update_feedback(self, message_id: "int | Future[int | None]", feedback_value: int) -> None:
+        """Enfileira o feedback de uma mensagem (gravado depois dela, mesmo que ainda esteja na fila).
+
+        `message_id` pode ser o `Future` devolvido por `save_chat_message`.
+        """
+        if message_id is None or feedback_value not in [1, -1]:
+            logging.warning(f"Tentativa de atualizar feedback com ID inválido ({message_id}) ou valor ({feedback_value})")
+            return
+        self._submit((_FEEDBACK_SQL, (feedback_value, message_id), None))
+
+    # --- Thread de gravação ---
+    def _run(self) -> None:
+        while True:
+            operation = self._queue.get()
+            batch = [operation]
+            # O que já estiver na fila vai na mesma transação
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            operations = [op for op in batch if op is not _STOP]
+            try:
+                if operations:
+                    self._write(operations)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(operations) < len(batch):
+                return
+
+    @staticmethod
+    def _execute(conn: sqlite3.Connection, sql: str, params: tuple, ids: Dict[Future, int]) -> int:
+        # Um Future no lugar do ID é o de um INSERT anterior: deste lote (ainda sem commit) ou de um já gravado
+        params = tuple((ids[p] if p in ids else p.result()) if isinstance(p, Future) else p for p in params)
+        return conn.execute(sql, params).lastrowid
+
+    def _write(self, operations: List[Tuple[str, tuple, Future | None]]) -> None:
+        conn = self._connection()
+        if conn is None:
+            with self._lock:
+                self.failed += len(operations)
+            for _, _, future in operations:
+                if future is not None:
+                    future.set_result(None)
+            return
+        ids: Dict[Future, int] = {}
+        try:
+            with conn:
+                for sql, params, future in operations:
+                    rowid = self._execute(conn, sql, params, ids)
+                    if future is not None:
+                        ids[future] = rowid
+            with self._lock:
+                self.batches += 1
+                self.written += len(operations)
+            for future, rowid in ids.items():
+                future.set_result(rowid)
+            logging.debug(f"Histórico: {len(operations)} operações gravadas em uma transação.")
+            return
+        except sqlite3.Error as e:
+            logging.warning(f"Erro ao gravar lote do histórico ({e}); gravando uma operação por vez.")
+        # Uma operação ruim não derruba as outras do lote
+        for sql, params, future in operations:
+            rowid = None
+            try:
+                with conn:
+                    rowid = self._execute(conn, sql, params, {})
+                with self._lock:
+                    self.written += 1
+            except sqlite3.Error as e:
+                with self._lock:
+                    self.failed += 1
+                logging.error(f"Erro ao gravar no histórico ({sql.split()[0]}): {e}")
+            if future is not None:
+                future.set_result(rowid)
+
+    # --- Ciclo de vida ---
+    def start(self) -> "HistoryWriter":
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+                if not self._atexit_registered:
+                    atexit.register(self.stop)
+                    self._atexit_registered = True
+        return self
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Espera a fila esvaziar (tudo gravado). Retorna False se o tempo acabou antes."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def stop(self, timeout: float | None = 10.0) -> None:
+        """Grava o que está na fila e encerra a thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            logging.error(f"Writer do histórico não terminou em {timeout}s; {self._queue.qsize()} operações na fila.")
+
+    def status(self) -> Dict[str, Any]:
+        return {"queued": self._queue.qsize(), "batches": self.batches, "written": self.written,
+                "failed": self.failed, "overflows": self.overflows, "running": self._thread is not None}
+
+
+_default_writer: HistoryWriter | None = None
+
+def get_history_writer() -> HistoryWriter:
+    """Retorna o writer em segundo plano compartilhado do processo (banco DB_FILE)."""
+    global _default_writer
+    if _default_writer is None:
+        with _default_manager_lock:
+            if _default_writer is None:
+                _default_writer = HistoryWriter()
+    return _default_writer
+ 
\ No newline at end of file
@@ -0,0 +1,280 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List
+
+from src.database.history import ConnectionManager, get_connection_manager
+
+# Intervalo entre agregações automáticas (start()), em minutos
+PERF_ROLLUP_INTERVAL_MINUTES = float(os.getenv("PERF_ROLLUP_INTERVAL_MINUTES", "5"))
+
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S" # Mesmo formato de CURRENT_TIMESTAMP (UTC)
+
+# Histograma logarítmico: o balde i cobre (GROWTH^(i-1), GROWTH^i] ms. Percentis tirados dele
+# (juntando várias horas) erram no máximo ~10% para cima; os percentis de cada hora são exatos.
+_HIST_GROWTH = 1.1
+_LOG_GROWTH = math.log(_HIST_GROWTH)
+
+
+def _bucket(ms: float) -> int:
+    return 0 if ms <= 1 else math.ceil(math.log(ms) / _LOG_GROWTH)
+
+def _bucket_value(bucket: int) -> int:
+    return round(_HIST_GROWTH ** bucket)
+
+def _percentile(sorted_values: List[int], p: float) -> int | None:
+    """Percentil pelo posto mais próximo (valor que de fato ocorreu)."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p * len(sorted_values)) - 1)]
+
+def _histogram(values: Iterable[int]) -> Dict[str, int]:
+    hist: Dict[str, int] = {}
+    for value in values:
+        key = str(_bucket(value))
+        hist[key] = hist.get(key, 0) + 1
+    return hist
+
+def _hist_percentile(hist: Dict[int, int], p: float) -> int | None:
+    total = sum(hist.values())
+    if not total:
+        return None
+    rank, seen = max(1, math.ceil(p * total)), 0
+    for bucket in sorted(hist):
+        seen += hist[bucket]
+        if seen >= rank:
+            return _bucket_value(bucket)
+    return None
+
+def _as_hour(value: datetime | str | None) -> str | None:
+    """'AAAA-MM-DD HH:00:00' da hora que contém `value` (datetime ingênuo = UTC).
+
+    Aceita texto ISO ('AAAA-MM-DD', 'AAAA-MM-DD HH:MM', ...); levanta ValueError se inválido.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(minute=0, second=0, microsecond=0).strftime(_TIMESTAMP_FORMAT)
+
+
+def message_metrics(model: str | None, status: str, latency_s: float, ttft_s: float | None = None,
+                    timing: Any = None) -> Dict[str, Any]:
+    """Métricas de uma mensagem para `save_chat_message(metrics=...)`.
+
+    `timing` (ChatTiming da chamada, opcional) fornece os tokens de prompt e de resposta
+    e o modelo efetivamente usado.
+    """
+    return {
+        "model": (getattr(timing, "model", None) or model),
+        "status": status,
+        "latency_ms": round(latency_s * 1000),
+        "ttft_ms": round(ttft_s * 1000) if ttft_s is not None else None,
+        "prompt_tokens": getattr(timing, "prompt_eval_count", None),
+        "completion_tokens": getattr(timing, "eval_count", None),
+    }
+
+
+class PerfRollup:
+    """Mantém chat_perf_hourly (agregados por hora e modelo) em dia, de forma incremental.
+
+    Cada INSERT com métricas marca a hora da mensagem em chat_perf_dirty (trigger da
+    migração v6). `run_once()` recalcula só as horas marcadas, a partir das mensagens
+    daquela hora (índice por timestamp), e desmarca, uma hora por transação: mensagens
+    que chegam atrasadas ou fora de ordem de ID apenas marcam a hora de novo. Os
+    agregados sobrevivem à retenção (as mensagens arquivadas saem de chat_history, as
+    linhas de chat_perf_hourly ficam).
+
+    Por (hora, modelo): contagem por status, percentis exatos da latência (p50/p95/p99)
+    e do TTFT (p50/p95) das respostas 'ok', tokens, e histogramas logarítmicos que
+    `latency_report` junta para qualquer período sem ler as mensagens.
+    """
+
+    def __init__(self, manager: ConnectionManager | None = None, interval_minutes: float | None = None):
+        self.manager = manager
+        self.interval_minutes = interval_minutes if interval_minutes is not None else PERF_ROLLUP_INTERVAL_MINUTES
+        self._lock = threading.Lock() # Uma execução por vez
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.last_report: Dict[str, Any] | None = None
+
+    def _connection(self):
+        return (self.manager or get_connection_manager()).connection()
+
+    def _rollup_hour(self, conn, hour: str) -> int:
+        """Recalcula as linhas de `hour` em chat_perf_hourly. Retorna quantas mensagens leu."""
+        end = (datetime.strptime(hour, _TIMESTAMP_FORMAT) + timedelta(hours=1)).strftime(_TIMESTAMP_FORMAT)
+        rows = conn.execute(
+            "SELECT COALESCE(model, ''), status, latency_ms, ttft_ms, prompt_tokens, completion_tokens "
+            "FROM chat_history WHERE timestamp >= ? AND timestamp < ? AND status IS NOT NULL", (hour, end)).fetchall()
+        by_model: Dict[str, List[tuple]] = {}
+        for row in rows:
+            by_model.setdefault(row[0], []).append(row)
+        conn.execute("DELETE FROM chat_perf_hourly WHERE hour = ?", (hour,))
+        for model, model_rows in by_model.items():
+            ok_rows = [row for row in model_rows if row[1] == "ok" and row[2] is not None]
+            latencies = sorted(row[2] for row in ok_rows)
+            ttfts = sorted(row[3] for row in ok_rows if row[3] is not None)
+            statuses = [row[1] for row in model_rows]
+            conn.execute(
+                "INSERT INTO chat_perf_hourly(hour, model, requests, errors, cancelled, reused, ok, latency_sum_ms, "
+                "latency_p50_ms, latency_p95_ms, latency_p99_ms, latency_max_ms, ttft_p50_ms, ttft_p95_ms, "
+                "prompt_tokens, completion_tokens, latency_hist, ttft_hist) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (hour, model, len(model_rows), statuses.count("error"), statuses.count("cancelled"),
+                 statuses.count("reused"), len(latencies), sum(latencies),
+                 _percentile(latencies, 0.5), _percentile(latencies, 0.95), _percentile(latencies, 0.99),
+                 latencies[-1] if latencies else None, _percentile(ttfts, 0.5), _percentile(ttfts, 0.95),
+                 sum(row[4] or 0 for row in model_rows), sum(row[5] or 0 for row in model_rows),
+                 json.dumps(_histogram(latencies)), json.dumps(_histogram(ttfts))))
+        return len(rows)
+
+    def run_once(self) -> Dict[str, Any]:
+        """Agrega as horas pendentes; retorna quantas horas e mensagens foram processadas."""
+        with self._lock:
+            started = time.perf_counter()
+            report = {"hours": 0, "rows": 0}
+            conn = self._connection()
+            if conn is None:
+                return report
+            while not self._stop.is_set():
+                conn.execute("BEGIN IMMEDIATE") # Novas mensagens esperam: a hora não é desmarcada pela metade
+                try:
+                    row = conn.execute("SELECT hour FROM chat_perf_dirty ORDER BY hour LIMIT 1").fetchone()
+                    if row is None:
+                        conn.commit()
+                        break
+                    report["rows"] += self._rollup_hour(conn, row[0])
+                    conn.execute("DELETE FROM chat_perf_dirty WHERE hour = ?", (row[0],))
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                report["hours"] += 1
+            report["duration_s"] = round(time.perf_counter() - started, 3)
+            self.last_report = report
+        if report["hours"]:
+            logging.info(f"Métricas do chat: {report['hours']} horas reagregadas ({report['rows']} mensagens) "
+                         f"em {report['duration_s']}s.")
+        return report
+
+    def start(self) -> "PerfRollup":
+        """Agrega agora e depois a cada `interval_minutes`, em segundo plano."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="perf-rollup", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logging.exception("Erro ao agregar as métricas do chat")
+            if self._stop.wait(self.interval_minutes * 60):
+                break
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> Dict[str, Any]:
+        return {"interval_minutes": self.interval_minutes, "running": self._thread is not None and self._thread.is_alive(),
+                "last_report": self.last_report}
+
+
+# --- Consultas (só chat_perf_hourly) ---
+
+def latency_report(since: datetime | str | None = None, until: datetime | str | None = None,
+                   model: str | None = None, by_model: bool = True,
+                   manager: ConnectionManager | None = None) -> List[Dict[str, Any]] | None:
+    """Latência e volume por modelo (ou no total, com `by_model=False`) no período [since, until).
+
+    O período é arredondado para horas inteiras. Os percentis vêm da soma dos histogramas
+    das horas (erro de até ~10%), sem ler chat_history. Retorna None em caso de erro.
+    """
+    conn = (manager or get_connection_manager()).connection()
+    if conn is None:
+        return None
+    conditions, params = [], []
+    if since is not None:
+        conditions.append("hour >= ?")
+        params.append(_as_hour(since))
+    if until is not None:
+        conditions.append("hour < ?")
+        params.append(_as_hour(until))
+    if model is not None:
+        conditions.append("model = ?")
+        params.append(model)
+    sql = ("SELECT hour, model, requests, errors, cancelled, reused, ok, latency_sum_ms, latency_max_ms, "
+           "prompt_tokens, completion_tokens, latency_hist, ttft_hist FROM chat_perf_hourly"
+           + (" WHERE " + " AND ".join(conditions) if conditions else ""))
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    except Exception as e:
+        logging.error(f"Erro ao ler as métricas agregadas do chat: {e}")
+        return None
+
+    groups: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        key = row[1] if by_model else "*"
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {"model": key, "first_hour": row[0], "last_hour": row[0], "hours": 0,
+                                   "requests": 0, "errors": 0, "cancelled": 0, "reused": 0, "ok": 0,
+                                   "latency_sum_ms": 0, "latency_max_ms": None, "prompt_tokens": 0,
+                                   "completion_tokens": 0, "_latency": {}, "_ttft": {}}
+        group["first_hour"] = min(group["first_hour"], row[0])
+        group["last_hour"] = max(group["last_hour"], row[0])
+        group["hours"] += 1
+        for i, name in enumerate(("requests", "errors", "cancelled", "reused", "ok", "latency_sum_ms"), start=2):
+            group[name] += row[i]
+        if row[8] is not None:
+            group["latency_max_ms"] = max(group["latency_max_ms"] or 0, row[8])
+        group["prompt_tokens"] += row[9]
+        group["completion_tokens"] += row[10]
+        for name, column in (("_latency", 11), ("_ttft", 12)):
+            for bucket, count in json.loads(row[column]).items():
+                group[name][int(bucket)] = group[name].get(int(bucket), 0) + count
+
+    report = []
+    for group in groups.values():
+        latency, ttft = group.pop("_latency"), group.pop("_ttft")
+        group["error_rate"] = round(group["errors"] / group["requests"], 4) if group["requests"] else None
+        group["avg_latency_ms"] = round(group["latency_sum_ms"] / group["ok"]) if group["ok"] else None
+        for p in (50, 95, 99):
+            group[f"latency_p{p}_ms"] = _hist_percentile(latency, p / 100)
+        for p in (50, 95):
+            group[f"ttft_p{p}_ms"] = _hist_percentile(ttft, p / 100)
+        report.append(group)
+    return report
+
+def compare_periods(split_at: datetime | str, window_hours: int | None = None, tolerance: float = 0.1,
+                    manager: ConnectionManager | None = None) -> Dict[str, Any] | None:
+    """Compara a latência antes e depois de `split_at` (ex.: troca do modelo padrão).
+
+    Com `window_hours`, cada lado usa só essa quantidade de horas ao redor do corte.
+    `regressed` indica um p95 total depois do corte mais de `tolerance` (fração) acima
+    do de antes; a tolerância padrão cobre a resolução dos histogramas.
+    """
+    split_hour = _as_hour(split_at)
+    split = datetime.strptime(split_hour, _TIMESTAMP_FORMAT)
+    since = split - timedelta(hours=window_hours) if window_hours else None
+    until = split + timedelta(hours=window_hours) if window_hours else None
+    sides = {}
+    for name, bounds in (("before", (since, split)), ("after", (split, until))):
+        total = latency_report(*bounds, by_model=False, manager=manager)
+        models = latency_report(*bounds, by_model=True, manager=manager)
+        if total is None or models is None:
+            return None
+        sides[name] = {"total": total[0] if total else None, "models": models}
+    before_p95 = sides["before"]["total"] and sides["before"]["total"]["latency_p95_ms"]
+    after_p95 = sides["after"]["total"] and sides["after"]["total"]["latency_p95_ms"]
+    change = (after_p95 - before_p95) / before_p95 if before_p95 and after_p95 else None
+    return {"split_at": split_hour, "window_hours": window_hours, **sides,
+            "p95_change": round(change, 4) if change is not None else None,
+            "regressed": change is not None and change > tolerance}
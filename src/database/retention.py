@@ -0,0 +1,208 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List
+
+from src.database.history import ConnectionManager, get_connection_manager
+
+# Conversas sem mensagens novas há mais que isso (dias) saem do banco para o arquivo morto; 0 desativa
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "0"))
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", os.path.join("data", "history_archive"))
+# Intervalo entre execuções automáticas (start()), em horas
+HISTORY_RETENTION_INTERVAL_HOURS = float(os.getenv("HISTORY_RETENTION_INTERVAL_HOURS", "24"))
+
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S" # Mesmo formato de CURRENT_TIMESTAMP (UTC)
+
+
+def iter_archive(archive_dir: str | None = None, since: str | None = None,
+                 until: str | None = None) -> Iterator[Dict[str, Any]]:
+    """Lê as mensagens arquivadas, mês a mês, em ordem de ID dentro de cada mês.
+
+    Cada linha é um dicionário com as colunas de chat_history. `since`/`until` ("AAAA-MM"
+    ou "AAAA-MM-DD ...") pulam partições inteiras fora do período. Uma mensagem gravada
+    duas vezes (execução interrompida entre gravar o arquivo e apagar do banco) aparece
+    uma vez só.
+    """
+    archive_dir = archive_dir or HISTORY_ARCHIVE_DIR
+    if not os.path.isdir(archive_dir):
+        return
+    for month in sorted(os.listdir(archive_dir)):
+        if (since and month < since[:7]) or (until and month > until[:7]):
+            continue
+        partition = os.path.join(archive_dir, month)
+        rows: Dict[int, Dict[str, Any]] = {}
+        for part in sorted(os.listdir(partition)):
+            if not part.endswith(".jsonl.gz"):
+                continue # Inclui .tmp de uma gravação interrompida
+            with gzip.open(os.path.join(partition, part), "rt", encoding="utf-8") as f:
+                for line in f:
+                    row = json.loads(line)
+                    rows[row["id"]] = row
+        for message_id in sorted(rows):
+            yield rows[message_id]
+
+
+class HistoryRetention:
+    """Retenção do chat_history.db: arquiva conversas antigas e compacta o banco.
+
+    - Arquivo morto: conversas (sessões inteiras, pela última mensagem) mais antigas
+      que `max_age_days` vão para `archive_dir/AAAA-MM/part-*.jsonl.gz` (uma linha JSON
+      por mensagem, partição pelo mês da mensagem) e são apagadas do banco, em lotes de
+      `batch_size` sessões. O arquivo é gravado (fsync + rename) antes do DELETE, então
+      uma interrupção no meio no máximo duplica mensagens no arquivo (`iter_archive`
+      ignora a cópia), nunca as perde. Mensagens sem sessão seguem o próprio timestamp.
+    - Compactação: com `auto_vacuum=INCREMENTAL` as páginas liberadas voltam ao sistema
+      com `PRAGMA incremental_vacuum`, sem reescrever o banco; bancos criados antes disso
+      passam por um VACUUM completo uma única vez. Depois, checkpoint do WAL (TRUNCATE).
+    - `run_once()` devolve um relatório com o que foi arquivado e os bytes recuperados;
+      `start()` repete a cada `interval_hours` em uma thread própria.
+    """
+
+    def __init__(self, manager: ConnectionManager | None = None, max_age_days: int | None = None,
+                 archive_dir: str | None = None, batch_size: int = 500, interval_hours: float | None = None):
+        self.manager = manager
+        self.max_age_days = max_age_days if max_age_days is not None else HISTORY_RETENTION_DAYS
+        self.archive_dir = archive_dir or HISTORY_ARCHIVE_DIR
+        self.batch_size = batch_size
+        self.interval_hours = interval_hours if interval_hours is not None else HISTORY_RETENTION_INTERVAL_HOURS
+        self._lock = threading.Lock() # Uma execução por vez
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.last_report: Dict[str, Any] | None = None
+
+    def _connection(self):
+        return (self.manager or get_connection_manager()).connection()
+
+    # --- Arquivo morto ---
+    def _write_partitions(self, rows: List[Dict[str, Any]]) -> List[str]:
+        """Grava as linhas nas partições mensais (um arquivo novo por partição). Retorna os arquivos."""
+        by_month: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_month.setdefault((row["timestamp"] or "0000-00")[:7], []).append(row)
+        files = []
+        for month, month_rows in sorted(by_month.items()):
+            partition = os.path.join(self.archive_dir, month)
+            os.makedirs(partition, exist_ok=True)
+            path = os.path.join(partition, f"part-{time.time_ns()}-{month_rows[0]['id']}.jsonl.gz")
+            with open(path + ".tmp", "wb") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as f:
+                    for row in month_rows:
+                        f.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(path + ".tmp", path)
+            files.append(path)
+        return files
+
+    def _archive_batch(self, conn, rows: List[Dict[str, Any]], sessions: List[str], cutoff: str) -> List[str]:
+        files = self._write_partitions(rows)
+        ids = json.dumps([row["id"] for row in rows])
+        with conn:
+            conn.execute("DELETE FROM chat_history WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+            # Sessão que recebeu mensagem nova durante o lote fica (a mensagem nova não foi arquivada)
+            conn.execute("DELETE FROM chat_sessions WHERE session_id IN (SELECT value FROM json_each(?)) "
+                         "AND last_at < ?", (json.dumps(sessions), cutoff))
+        return files
+
+    def archive(self, cutoff: str) -> Dict[str, Any]:
+        """Arquiva e apaga as conversas com última mensagem antes de `cutoff` ("AAAA-MM-DD HH:MM:SS", UTC)."""
+        conn = self._connection()
+        report = {"sessions": 0, "rows": 0, "files": 0, "archived_bytes": 0}
+        if conn is None:
+            return report
+        while not self._stop.is_set():
+            sessions = [row[0] for row in conn.execute(
+                "SELECT session_id FROM chat_sessions WHERE last_at < ? ORDER BY last_at LIMIT ?",
+                (cutoff, self.batch_size))]
+            if sessions:
+                rows = [dict(row) for row in conn.execute(
+                    "SELECT * FROM chat_history WHERE session_id IN (SELECT value FROM json_each(?)) ORDER BY id",
+                    (json.dumps(sessions),))]
+            else:
+                # Mensagens sem sessão
+                rows = [dict(row) for row in conn.execute(
+                    "SELECT * FROM chat_history WHERE session_id IS NULL AND timestamp < ? ORDER BY timestamp LIMIT ?",
+                    (cutoff, self.batch_size * 10))]
+                if not rows:
+                    break
+            files = self._archive_batch(conn, rows, sessions, cutoff)
+            report["sessions"] += len(sessions)
+            report["rows"] += len(rows)
+            report["files"] += len(files)
+            report["archived_bytes"] += sum(os.path.getsize(path) for path in files)
+        return report
+
+    # --- Compactação ---
+    def _db_bytes(self) -> int:
+        path = (self.manager or get_connection_manager()).path
+        return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+    def compact(self) -> Dict[str, Any]:
+        """Devolve ao sistema as páginas livres do banco e trunca o WAL."""
+        conn = self._connection()
+        if conn is None:
+            return {}
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        full_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2 # 2 = INCREMENTAL
+        if full_vacuum:
+            logging.info("Ativando auto_vacuum=INCREMENTAL no histórico (VACUUM completo, só desta vez).")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        # Junta segmentos do índice FTS5 que ficaram com muitas exclusões (trabalho limitado)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_history_fts'").fetchone():
+            with conn:
+                conn.execute("INSERT INTO chat_history_fts(chat_history_fts, rank) VALUES ('merge', 500)")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return {"free_pages": free_pages, "free_bytes": free_pages * page_size, "full_vacuum": full_vacuum}
+
+    # --- Execução ---
+    def run_once(self, now: datetime | None = None) -> Dict[str, Any]:
+        """Arquiva (se `max_age_days` > 0) e compacta; retorna o relatório da execução."""
+        with self._lock:
+            started = time.perf_counter()
+            bytes_before = self._db_bytes()
+            report: Dict[str, Any] = {"cutoff": None, "sessions": 0, "rows": 0, "files": 0, "archived_bytes": 0}
+            if self.max_age_days > 0:
+                now = now or datetime.now(timezone.utc)
+                report["cutoff"] = (now - timedelta(days=self.max_age_days)).strftime(_TIMESTAMP_FORMAT)
+                report.update(self.archive(report["cutoff"]))
+            report.update(self.compact())
+            report["db_bytes_before"] = bytes_before
+            report["db_bytes_after"] = self._db_bytes()
+            report["reclaimed_bytes"] = max(0, bytes_before - report["db_bytes_after"])
+            report["duration_s"] = round(time.perf_counter() - started, 3)
+            self.last_report = report
+        logging.info(f"Retenção do histórico: {report['rows']} mensagens de {report['sessions']} sessões arquivadas "
+                     f"({report['archived_bytes']} bytes em {report['files']} arquivos), "
+                     f"{report['reclaimed_bytes']} bytes recuperados em {report['duration_s']}s.")
+        return report
+
+    def start(self) -> "HistoryRetention":
+        """Executa agora e depois a cada `interval_hours`, em segundo plano."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="history-retention", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logging.exception("Erro na retenção do histórico")
+            if self._stop.wait(self.interval_hours * 3600):
+                break
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> Dict[str, Any]:
+        return {"max_age_days": self.max_age_days, "archive_dir": self.archive_dir,
+                "running": self._thread is not None and self._thread.is_alive(), "last_report": self.last_report}
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import weakref
+from typing import Any, AsyncIterator, Callable, Dict, List
+
+import aiohttp
+
+from src.ollama_integration.balancer import Endpoint, EndpointPool, get_default_pool
+from src.ollama_integration.cache import ResponseCache, replay_chunks
+from src.ollama_integration.cancellation import CancelToken
+from src.ollama_integration.client import (OLLAMA_API_URL, OLLAMA_COALESCE, OLLAMA_POOL_SIZE, ChatCallMixin,
+                                           build_chat_payload)
+from src.ollama_integration.ndjson import StreamState, aiter_chat_chunks
+from src.ollama_integration.resilience import CircuitBreaker, Timeouts, get_breaker
+from src.ollama_integration.scheduler import Priority, QueueFullError, RequestScheduler, get_scheduler
+from src.ollama_integration.singleflight import AsyncSingleFlight
+from src.ollama_integration.telemetry import ChatTiming, MetricsSink, get_metrics_sink, publish_timing
+
+
+class AsyncOllamaClient(ChatCallMixin):
+    """Cliente asyncio do Ollama (aiohttp), para servir muitos streams em um único event loop.
+
+    Cada stream ocupa apenas uma corrotina enquanto espera tokens, em vez de uma
+    thread de worker. A `aiohttp.ClientSession` é criada na primeira chamada, dentro
+    do loop em execução, e mantém um pool de conexões keep-alive de `pool_size`.
+    Com um `EndpointPool`, os streams são distribuídos entre os backends como no cliente síncrono.
+    Tempos limite (`Timeouts`) e disjuntor por backend também valem aqui; streams não são repetidos.
+    Cache, disjuntor, escalonador, telemetria e decodificação NDJSON são os mesmos do
+    `OllamaClient`; streams idênticos em andamento no mesmo loop são coalescidos
+    (`coalesce`, padrão OLLAMA_COALESCE).
+    """
+
+    def __init__(self, api_url: str | None = None, pool_size: int | None = None, scheduler: RequestScheduler | None = None,
+                 metrics: MetricsSink | None = None, balancer: EndpointPool | None = None,
+                 timeouts: Timeouts | None = None, breaker: CircuitBreaker | None = None,
+                 coalesce: bool | None = None):
+        self.balancer = balancer if balancer is not None else (get_default_pool() if api_url is None else None)
+        if self.balancer is not None and api_url is None:
+            api_url = self.balancer.primary.chat_url
+        self.api_url = api_url or OLLAMA_API_URL
+        self.base_url = self.api_url.replace("/api/chat", "").replace("/api/generate", "")
+        self.pool_size = pool_size or OLLAMA_POOL_SIZE
+        # Mesmo escalonador do cliente síncrono para o backend: a concorrência é somada
+        self._explicit_scheduler = scheduler
+        self.scheduler = scheduler or get_scheduler(self.base_url)
+        self.metrics = metrics or get_metrics_sink()
+        self.timeouts = timeouts or Timeouts()
+        self._explicit_breaker = breaker
+        self.breaker = breaker or get_breaker(self.base_url)
+        self.singleflight = AsyncSingleFlight() if (OLLAMA_COALESCE if coalesce is None else coalesce) else None
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            # Sem timeout total: gerações longas não devem ser interrompidas pelo cliente.
+            # sock_read limita o silêncio entre chunks; o primeiro token tem limite próprio.
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeouts.connect,
+                                            sock_read=max(self.timeouts.read, self.timeouts.first_token))
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self) -> None:
+        """Fecha a sessão e as conexões do pool."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self) -> "AsyncOllamaClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def achat_completion(self, messages: List[Dict[str, str]], model: str | None = None,
+                               priority: Priority = Priority.INTERACTIVE, options: Dict[str, Any] | None = None,
+                               cache: ResponseCache | None = None,
+                               on_timing: Callable[[ChatTiming], None] | None = None,
+                               cancel: CancelToken | None = None) -> AsyncIterator[str]:
+        """Envia mensagens para /api/chat e produz os pedaços (chunks) da resposta conforme chegam.
+
+        Contraparte assíncrona de `OllamaClient.chat_completion(stream=True)`. Em caso de
+        erro de conexão/HTTP/JSON o erro é logado e a iteração termina sem produzir
+        (mais) chunks, assim como o gerador síncrono.
+
+        Args:
+            messages: Uma lista de dicionários, cada um com "role" (user/assistant) e "content".
+            model: O nome do modelo Ollama a ser usado. Se None, usa OLLAMA_DEFAULT_MODEL do .env ou 'llama3'.
+            priority: Classe de prioridade no escalonador do backend.
+            options: Opções de geração do Ollama (temperature, top_p, ...).
+            cache: Cache de respostas opcional; um acerto é reproduzido em chunks sem chamar o Ollama.
+            on_timing: Recebe o `ChatTiming` (TTFT, carga, prompt, geração) quando o stream termina.
+                Streams coalescidos com um idêntico em andamento não geram registro próprio.
+            cancel: Alça de cancelamento; `cancel.cancel()` (de qualquer thread) encerra o stream
+                na hora. Fechar o iterador (`aclose()`) ou cancelar a task que o consome tem o
+                mesmo efeito. A conexão com o Ollama é fechada quando nenhum assinante do
+                stream (coalescido ou não) continua lendo.
+
+        Yields:
+            Pedaços (chunks) da resposta do assistant.
+        """
+        if cancel is not None and cancel.cancelled:
+            return
+        endpoint, timing, cached, on_complete = self._start_call(messages, model, options, priority, True, cache, on_timing)
+        if cached is not None:
+            for chunk in replay_chunks(cached):
+                yield chunk
+            return
+
+        if self.singleflight is None:
+            source = self._achat(messages, model, priority, options, on_complete, endpoint, timing, on_timing, cancel)
+        else:
+            flight_key = self._flight_key(model, messages, options, True)
+            source = self.singleflight.stream(
+                flight_key,
+                lambda abort: self._achat(messages, model, priority, options, on_complete, endpoint, timing, on_timing, abort),
+                cancel)
+        try:
+            async for chunk in source:
+                yield chunk
+        finally:
+            await source.aclose()
+
+    async def _achat(self, messages: List[Dict[str, str]], model: str | None, priority: Priority,
+                     options: Dict[str, Any] | None, on_complete: Callable[[str], None] | None,
+                     endpoint: Endpoint | None, timing: ChatTiming,
+                     on_timing: Callable[[ChatTiming], None] | None,
+                     cancel: CancelToken | None) -> AsyncIterator[str]:
+        """Disjuntor, slot do escalonador e o stream aiohttp de uma chamada (sem cache nem coalescência)."""
+        breaker = self._breaker_for(endpoint)
+        if self._circuit_open(breaker, timing, on_timing):
+            return
+
+        self._begin_queue(endpoint)
+        try:
+            lease = await self._scheduler_for(endpoint).alease(priority)
+        except QueueFullError as e:
+            self._rejected(endpoint, timing, e, on_timing)
+            return
+        except asyncio.CancelledError:
+            if endpoint is not None:
+                self.balancer.end(endpoint)
+            raise
+        self._admitted(endpoint, lease, timing)
+
+        payload = build_chat_payload(messages, model, stream=True, options=options)
+        target_model = payload["model"]
+        api_url = endpoint.chat_url if endpoint is not None else self.api_url
+        logging.debug(f"[async] Enviando para {api_url} com modelo {target_model}")
+        state = StreamState()
+        unregister = None
+        abandoned = False
+        try:
+            if cancel is not None and cancel.cancelled:
+                return
+            if not breaker.allow():
+                logging.error(f"Circuito aberto para {breaker.name}; chamada recusada sem contatar o Ollama.")
+                return
+            async with self._get_session().post(api_url, json=payload) as response:
+                self._record_status(breaker, endpoint, response.status, target_model)
+                if response.status >= 400:
+                    body = await response.text()
+                    logging.error(f"Erro HTTP {response.status} ao acessar {api_url}")
+                    logging.error(f"Resposta recebida: {body}")
+                    return
+
+                logging.info(f"Iniciando stream assíncrono para o modelo {target_model}...")
+                if cancel is not None:
+                    loop = asyncio.get_running_loop()
+                    unregister = cancel.on_cancel(lambda: loop.call_soon_threadsafe(response.close))
+                async for chunk in aiter_chat_chunks(self._iter_lines(response), state):
+                    if cancel is not None and cancel.cancelled:
+                        break
+                    if state.chunk_count == 1:
+                        timing.mark_first_token()
+                    yield chunk
+                logging.info(f"Stream assíncrono finalizado para {target_model}. Total linhas: {state.line_count}.")
+        except (GeneratorExit, asyncio.CancelledError):
+            abandoned = True # aclose() do iterador ou cancelamento da task que o consumia
+            raise
+        except aiohttp.ClientConnectionError as e:
+            if cancel is not None and cancel.cancelled:
+                pass # Conexão fechada pelo cancelamento; não é falha do backend
+            else:
+                logging.error(f"Erro de conexão ao tentar acessar {api_url}: {e}")
+                self._record_failure(breaker, endpoint)
+        except asyncio.TimeoutError as e:
+            logging.error(f"Timeout ao tentar acessar {api_url}: {e}")
+            self._record_failure(breaker, endpoint)
+        except aiohttp.ClientError as e:
+            if not (cancel is not None and cancel.cancelled):
+                logging.error(f"Erro inesperado de request para {api_url}: {e}")
+        finally:
+            if unregister is not None:
+                unregister()
+            self._finish_stream(timing, state, abandoned, cancel, on_complete)
+            lease.release()
+            publish_timing(self.metrics, timing, state.done, on_timing)
+
+    async def _iter_lines(self, response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+        """Linhas do corpo; a primeira tem o limite de primeiro token (carga + avaliação do prompt)."""
+        first = await asyncio.wait_for(response.content.readline(), self.timeouts.first_token)
+        if not first:
+            return
+        yield first
+        async for line in response.content:
+            yield line
+
+
+# --- Cliente compartilhado (um por event loop, pois a ClientSession é ligada ao loop) ---
+_default_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOllamaClient]" = weakref.WeakKeyDictionary()
+
+def get_default_async_client() -> AsyncOllamaClient:
+    """Retorna o cliente assíncrono compartilhado do event loop em execução."""
+    loop = asyncio.get_running_loop()
+    client = _default_clients.get(loop)
+    if client is None:
+        client = AsyncOllamaClient()
+        _default_clients[loop] = client
+    return client
+
+def achat_completion(messages: List[Dict[str, str]], model: str | None = None,
+                     priority: Priority = Priority.INTERACTIVE, options: Dict[str, Any] | None = None,
+                     cache: ResponseCache | None = None,
+                     on_timing: Callable[[ChatTiming], None] | None = None,
+                     cancel: CancelToken | None = None) -> AsyncIterator[str]:
+    """Versão assíncrona de `chat_completion(stream=True)` usando o cliente do loop atual.
+
+    Uso:
+        async for chunk in achat_completion(messages, model="llama3"):
+            ...
+    """
+    return get_default_async_client().achat_completion(messages=messages, model=model, priority=priority,
+                                                       options=options, cache=cache, on_timing=on_timing,
+                                                       cancel=cancel)
@@ -0,0 +1,188 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List
+
+import requests
+
+# Lista de backends separados por vírgula (ex.: "http://gpu1:11434,http://gpu2:11434").
+# Se vazio, o cliente usa apenas o OLLAMA_API_URL.
+OLLAMA_API_URLS = [url.strip() for url in os.getenv("OLLAMA_API_URLS", "").split(",") if url.strip()]
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+
+
+def normalize_base_url(url: str) -> str:
+    """Aceita tanto a URL base quanto a de /api/chat ou /api/generate."""
+    return url.rstrip("/").replace("/api/chat", "").replace("/api/generate", "")
+
+
+class Endpoint:
+    """Um backend Ollama do pool, com seu estado de saúde e carga."""
+    __slots__ = ("base_url", "chat_url", "healthy", "outstanding", "loaded_models", "failures", "last_check", "routed")
+
+    def __init__(self, url: str):
+        self.base_url = normalize_base_url(url)
+        self.chat_url = f"{self.base_url}/api/chat"
+        self.healthy = True # Otimista até a primeira verificação
+        self.outstanding = 0 # Requisições em andamento (inclui as que esperam no escalonador)
+        self.loaded_models: set[str] = set()
+        self.failures = 0 # Falhas consecutivas
+        self.last_check = 0.0
+        self.routed = 0
+
+
+class EndpointPool:
+    """Distribui as requisições entre vários backends Ollama.
+
+    - Menor carga: cada requisição vai para o backend saudável com menos requisições
+      em andamento (`begin`/`end`).
+    - Afinidade por modelo: backends que já têm o modelo carregado (visto em /api/ps
+      ou em respostas anteriores) têm preferência, desde que não estejam mais de
+      `affinity_slack` requisições acima do menos carregado.
+    - Saúde: uma thread consulta /api/ps a cada `health_interval` segundos; um backend
+      que falha (na verificação ou em `report_failure`) fica fora da rotação até
+      voltar a responder.
+    """
+
+    def __init__(self, urls: Iterable[str], health_interval: float | None = None,
+                 affinity_slack: int = 2, health_timeout: float = 2.0):
+        self.endpoints = [Endpoint(url) for url in urls]
+        if not self.endpoints:
+            raise ValueError("EndpointPool precisa de pelo menos um endpoint.")
+        self.health_interval = health_interval if health_interval is not None else OLLAMA_HEALTH_INTERVAL
+        self.affinity_slack = affinity_slack
+        self.health_timeout = health_timeout
+        self._lock = threading.Lock()
+        self._rr = 0 # Desempate round-robin
+        self._session = requests.Session()
+        self._stop = threading.Event()
+        self._checked = threading.Event() # Primeira verificação concluída
+        self._thread: threading.Thread | None = None
+
+    @property
+    def primary(self) -> Endpoint:
+        return self.endpoints[0]
+
+    # --- Roteamento ---
+    def choose(self, model: str | None = None) -> Endpoint:
+        """Escolhe o backend para a próxima requisição (não altera a carga; use `begin`)."""
+        with self._lock:
+            candidates = [ep for ep in self.endpoints if ep.healthy]
+            if not candidates:
+                # Todos fora: tenta mesmo assim o que falhou menos (pode ter voltado)
+                logging.warning("Nenhum backend Ollama saudável; tentando o com menos falhas.")
+                candidates = [min(self.endpoints, key=lambda ep: ep.failures)]
+            least = min(ep.outstanding for ep in candidates)
+            if model:
+                warm = [ep for ep in candidates if model in ep.loaded_models and ep.outstanding <= least + self.affinity_slack]
+                if warm:
+                    candidates = warm
+                    least = min(ep.outstanding for ep in candidates)
+            tied = [ep for ep in candidates if ep.outstanding == least]
+            self._rr += 1
+            return tied[self._rr % len(tied)]
+
+    def begin(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.outstanding += 1
+            endpoint.routed += 1
+
+    def end(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def report_success(self, endpoint: Endpoint, model: str | None = None) -> None:
+        with self._lock:
+            endpoint.failures = 0
+            endpoint.healthy = True
+            if model:
+                endpoint.loaded_models.add(model)
+
+    def report_failure(self, endpoint: Endpoint) -> None:
+        """Erro de conexão/timeout: tira o backend da rotação até a próxima verificação bem-sucedida."""
+        with self._lock:
+            endpoint.failures += 1
+            if endpoint.healthy:
+                logging.warning(f"Backend Ollama {endpoint.base_url} marcado como indisponível.")
+            endpoint.healthy = False
+
+    # --- Verificação de saúde ---
+    def check(self, endpoint: Endpoint) -> bool:
+        """Consulta /api/ps do backend, atualizando saúde e modelos carregados."""
+        try:
+            response = self._session.get(f"{endpoint.base_url}/api/ps", timeout=self.health_timeout)
+            response.raise_for_status()
+            loaded = {m.get("name") or m.get("model") for m in response.json().get("models", [])}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.debug(f"Verificação de saúde falhou para {endpoint.base_url}: {e}")
+            self.report_failure(endpoint)
+            return False
+        with self._lock:
+            if not endpoint.healthy:
+                logging.info(f"Backend Ollama {endpoint.base_url} voltou a responder.")
+            endpoint.healthy = True
+            endpoint.failures = 0
+            endpoint.loaded_models = loaded
+            endpoint.last_check = time.time()
+        return True
+
+    def check_all(self) -> None:
+        for endpoint in self.endpoints:
+            self.check(endpoint)
+
+    def start(self) -> "EndpointPool":
+        """Inicia a verificação periódica em segundo plano, a primeira já de imediato.
+
+        Não bloqueia: até a primeira verificação terminar, todos os backends contam como
+        saudáveis (falhas reais os tiram da rotação via `report_failure`).
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ollama-health", daemon=True)
+            self._thread.start()
+        return self
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """Espera a primeira verificação de saúde; retorna False se `timeout` expirar antes."""
+        return self._checked.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.check_all()
+            except Exception:
+                logging.exception("Erro na verificação de saúde dos backends Ollama")
+            self._checked.set()
+            if self._stop.wait(self.health_interval):
+                return
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._session.close()
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{
+                "url": ep.base_url,
+                "healthy": ep.healthy,
+                "outstanding": ep.outstanding,
+                "routed": ep.routed,
+                "failures": ep.failures,
+                "loaded_models": sorted(ep.loaded_models),
+            } for ep in self.endpoints]
+
+
+# --- Pool padrão (a partir de OLLAMA_API_URLS), compartilhado pelos clientes sync e async ---
+_default_pool: EndpointPool | None = None
+_default_pool_lock = threading.Lock()
+
+def get_default_pool() -> EndpointPool | None:
+    """Retorna o pool de OLLAMA_API_URLS (iniciado na primeira chamada) ou None se não configurado."""
+    global _default_pool
+    if not OLLAMA_API_URLS:
+        return None
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = EndpointPool(OLLAMA_API_URLS).start()
+            logging.info(f"Balanceamento entre {len(OLLAMA_API_URLS)} backends Ollama: {OLLAMA_API_URLS}")
+        return _default_pool
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List
+
+# Padrão usado para "fatiar" uma resposta em cache em chunks parecidos com os do stream
+_REPLAY_CHUNK_RE = re.compile(r"\S+\s*|\s+")
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], options: Dict[str, Any] | None = None) -> str:
+    """Gera a chave do cache a partir do modelo, mensagens normalizadas e opções de geração.
+
+    A normalização ignora diferenças de espaços em branco no conteúdo e a ordem das
+    chaves dos dicionários, para que prompts equivalentes compartilhem a mesma entrada.
+    """
+    normalized = {
+        "model": model,
+        "messages": [{"role": m.get("role", ""), "content": _normalize_text(m.get("content") or "")} for m in messages],
+        "options": options or {},
+    }
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def replay_chunks(text: str) -> Iterator[str]:
+    """Reproduz um texto em cache como uma sequência de chunks (palavra + espaço)."""
+    for match in _REPLAY_CHUNK_RE.finditer(text):
+        yield match.group(0)
+
+
+class ResponseCache:
+    """Cache de respostas do LLM com dois níveis: LRU em memória e SQLite em disco.
+
+    - Memória: `OrderedDict` limitado a `max_memory_entries` (LRU).
+    - Disco (opcional, se `path` for informado): sobrevive a reinícios; limitado a
+      `max_disk_bytes` somando o tamanho das respostas (remove as menos acessadas).
+    - TTL: entradas mais velhas que `ttl_seconds` são tratadas como ausentes.
+
+    É seguro para uso entre threads (Streamlit/Gradio).
+    """
+
+    def __init__(self, path: str | None = None, ttl_seconds: float = 7 * 24 * 3600,
+                 max_memory_entries: int = 512, max_disk_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        self._conn: sqlite3.Connection | None = None
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_response_cache(last_access)")
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Erro ao abrir cache de respostas em disco ({path}): {e}. Usando apenas memória.")
+            self._conn = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, response: str, created_at: float) -> None:
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get(self, key: str) -> str | None:
+        """Retorna a resposta em cache (ou None), promovendo acertos do disco para a memória."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if not self._is_expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return response
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT response, created_at FROM llm_response_cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        response, created_at = row
+                        if not self._is_expired(created_at, now):
+                            self._conn.execute("UPDATE llm_response_cache SET last_access = ? WHERE key = ?", (now, key))
+                            self._conn.commit()
+                            self._remember(key, response, created_at)
+                            self._stats["disk_hits"] += 1
+                            return response
+                        self._conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+                        self._conn.commit()
+                        self._stats["expired"] += 1
+                except sqlite3.Error as e:
+                    logging.error(f"Erro ao ler cache de respostas em disco: {e}")
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, response: str) -> None:
+        """Guarda uma resposta nos dois níveis e aplica o limite de tamanho do disco."""
+        if not response:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            self._stats["stores"] += 1
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_response_cache(key, response, created_at, last_access, size) VALUES(?,?,?,?,?)",
+                    (key, response, now, now, len(response.encode("utf-8"))),
+                )
+                self._enforce_disk_limit()
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Erro ao gravar cache de respostas em disco: {e}")
+
+    def _enforce_disk_limit(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_response_cache").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        # Remove as entradas menos acessadas até caber no limite
+        for key, size in self._conn.execute("SELECT key, size FROM llm_response_cache ORDER BY last_access ASC").fetchall():
+            if total <= self.max_disk_bytes:
+                break
+            self._conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+            total -= size
+            self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM llm_response_cache")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de acerto/erro e ocupação atual."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            if self._conn is not None:
+                count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_response_cache").fetchone()
+                stats["disk_entries"], stats["disk_bytes"] = count, size
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
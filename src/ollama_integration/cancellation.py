@@ -0,0 +1,75 @@
+import logging
+import socket
+import threading
+from typing import Any, Callable, Iterator, List
+
+
+class CancelToken:
+    """Alça para cancelar uma geração em andamento a partir de outra thread/corrotina.
+
+    Quem faz a chamada passa o token em `cancel=`; o cliente registra com `on_cancel`
+    como interromper a conexão (ex.: derrubar o socket do stream). `cancel()` executa
+    esses callbacks na hora, de modo que o Ollama vê a conexão fechada e para de gerar,
+    e o leitor bloqueado acorda e devolve o slot do escalonador.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: str | None = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self, reason: str = "cancelado") -> bool:
+        """Cancela (idempotente). Retorna True se este foi o primeiro pedido."""
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._cancelled = True
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        logging.info(f"Geração cancelada: {reason}")
+        for callback in callbacks:
+            _run_callback(callback)
+        return True
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Registra `callback`; se já cancelado, executa na hora. Retorna a função que desfaz o registro."""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                def unregister() -> None:
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return unregister
+        _run_callback(callback)
+        return lambda: None
+
+
+def _run_callback(callback: Callable[[], None]) -> None:
+    try:
+        callback()
+    except Exception:
+        logging.exception("Erro em callback de cancelamento")
+
+def until_cancelled(chunks: Iterator[str], cancel: CancelToken) -> Iterator[str]:
+    """Repassa os chunks até o token ser cancelado."""
+    for chunk in chunks:
+        if cancel.cancelled:
+            return
+        yield chunk
+
+def abort_response(response: Any) -> None:
+    """Derruba o socket de uma resposta `requests` em stream (pode ser chamado de outra thread).
+
+    `shutdown` acorda a thread bloqueada na leitura (que recebe fim de conexão) sem
+    disputar o objeto de resposta com ela; quem lê fecha a resposta no `finally`.
+    """
+    try:
+        response.raw.connection.sock.shutdown(socket.SHUT_RDWR)
+    except (AttributeError, OSError):
+        pass # Resposta simulada ou conexão já encerrada
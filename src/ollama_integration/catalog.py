@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from src.ollama_integration.client import OllamaClient, get_default_client, resolve_model
+
+# Validade da lista de modelos (s); depois disso a próxima leitura dispara uma atualização em segundo plano
+OLLAMA_CATALOG_TTL = float(os.getenv("OLLAMA_CATALOG_TTL", "60"))
+
+
+class ModelCatalog:
+    """Lista de modelos do Ollama (/api/tags) em cache, atualizada em segundo plano.
+
+    - Sem espera: `models()` nunca acessa a rede. Devolve a última lista obtida (mesmo
+      vencida) e, se ela passou de `ttl` segundos, agenda uma atualização. Antes da
+      primeira resposta do Ollama, devolve só o modelo padrão (OLLAMA_DEFAULT_MODEL).
+    - Atualização: `refresh()` roda em uma thread própria; pedidos feitos enquanto uma
+      atualização está em andamento compartilham o mesmo Future. Se o Ollama não
+      responder, a lista anterior é mantida.
+    - Notificação: listeners registrados com `subscribe` recebem a nova lista quando o
+      conjunto de modelos muda; `version` é incrementado a cada mudança (a UI compara
+      a versão que já mostrou).
+    - `start()` agenda a primeira busca e atualiza a lista a cada `ttl` segundos.
+    """
+
+    def __init__(self, client: OllamaClient | None = None, ttl: float | None = None, timeout: float = 5.0):
+        self.client = client or get_default_client()
+        self.ttl = ttl if ttl is not None else OLLAMA_CATALOG_TTL
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._models: List[str] | None = None # None = nunca obtida
+        self._fetched_at = 0.0 # time.monotonic() da última busca bem-sucedida
+        self._version = 0
+        self._refreshes = 0
+        self._failures = 0
+        self._pending: Future | None = None
+        self._listeners: List[Callable[[List[str]], None]] = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ollama-catalog")
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def is_stale(self) -> bool:
+        with self._lock:
+            return self._models is None or time.monotonic() - self._fetched_at > self.ttl
+
+    def models(self) -> List[str]:
+        """Lista atual de modelos, sem bloquear (agenda uma atualização se estiver vencida)."""
+        if self.is_stale():
+            self.refresh()
+        with self._lock:
+            if self._models is None:
+                return [resolve_model(None)]
+            return list(self._models)
+
+    def subscribe(self, listener: Callable[[List[str]], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    # --- Atualização ---
+    def refresh(self) -> Future:
+        """Agenda uma busca em /api/tags e retorna o Future (True se a lista foi obtida)."""
+        with self._lock:
+            if self._pending is not None:
+                return self._pending
+            future = self._pending = self._executor.submit(self._fetch)
+        return future
+
+    def _fetch(self) -> bool:
+        try:
+            models = self.client.list_models(timeout=self.timeout)
+            with self._lock:
+                self._refreshes += 1
+                if models is None:
+                    self._failures += 1
+                    return False
+                changed = self._models is None or set(models) != set(self._models)
+                self._models = models
+                self._fetched_at = time.monotonic()
+                if changed:
+                    self._version += 1
+                listeners = list(self._listeners) if changed else []
+            if changed:
+                logging.info(f"Catálogo de modelos do Ollama atualizado: {models}")
+            for listener in listeners:
+                try:
+                    listener(list(models))
+                except Exception:
+                    logging.exception("Erro em listener do catálogo de modelos")
+            return True
+        finally:
+            with self._lock:
+                self._pending = None
+
+    # --- Ciclo de vida ---
+    def start(self) -> "ModelCatalog":
+        """Agenda a primeira busca (sem esperar por ela) e inicia a atualização periódica."""
+        self.refresh()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ollama-catalog-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.ttl):
+            self.refresh()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "models": list(self._models) if self._models is not None else None,
+                "age_s": time.monotonic() - self._fetched_at if self._models is not None else None,
+                "version": self._version,
+                "refreshing": self._pending is not None,
+                "refreshes": self._refreshes,
+                "failures": self._failures,
+            }
+
+
+# --- Catálogo compartilhado do processo ---
+_default_catalog: ModelCatalog | None = None
+_default_catalog_lock = threading.Lock()
+
+def get_model_catalog() -> ModelCatalog:
+    """Retorna o catálogo compartilhado (sobre o cliente padrão), criando-o na primeira chamada."""
+    global _default_catalog
+    with _default_catalog_lock:
+        if _default_catalog is None:
+            _default_catalog = ModelCatalog()
+        return _default_catalog
@@ -2,19 +2,33 @@ import requests
 import json
 import os
 import logging
-from typing import List, Dict, Generator, Any, Union # Melhorar type hinting
+import threading
+import time
+import weakref
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Generator, Any, Sequence, Union # Melhorar type hinting
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from src.ollama_integration.balancer import Endpoint, EndpointPool, get_default_pool
+from src.ollama_integration.cache import ResponseCache, make_cache_key, replay_chunks
+from src.ollama_integration.cancellation import CancelToken, abort_response, until_cancelled
+from src.ollama_integration.ndjson import StreamState, iter_chat_chunks
+from src.ollama_integration.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, Timeouts, get_breaker
+from src.ollama_integration.singleflight import SingleFlight
+from src.ollama_integration.scheduler import Lease, Priority, QueueFullError, RequestScheduler, get_scheduler
+from src.ollama_integration.telemetry import ChatTiming, MetricsSink, get_metrics_sink, publish_timing
 
-# Configuração básica do logging - MUDADO PARA DEBUG
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+# Carrega as variáveis do arquivo .env para o ambiente
+load_dotenv()
+
+# Configuração básica do logging - DEBUG por padrão; LOG_LEVEL=INFO no .env elimina o log por token
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "DEBUG").upper(), format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
 
 # Para evitar logs muito verbosos de bibliotecas externas (opcional)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.getLogger("requests").setLevel(logging.WARNING)
 
-# Carrega as variáveis do arquivo .env para o ambiente
-load_dotenv()
-
 # Agora usa /api/chat por padrão
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/chat")
 
@@ -22,136 +36,700 @@ OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/chat")
 OLLAMA_BASE_URL = OLLAMA_API_URL.replace("/api/chat", "").replace("/api/generate", "")
 OLLAMA_TAGS_URL = f"{OLLAMA_BASE_URL}/api/tags"
 
-def get_available_models() -> List[str]:
-    """Busca a lista de modelos disponíveis na API /api/tags do Ollama."""
-    try:
-        logging.info(f"Buscando modelos disponíveis em {OLLAMA_TAGS_URL}...")
-        response = requests.get(OLLAMA_TAGS_URL, timeout=5) # Timeout curto
-        response.raise_for_status()
-        data = response.json()
-        models = [model['name'] for model in data.get('models', [])]
-        logging.info(f"Modelos encontrados: {models}")
-        # Garante que o modelo padrão do .env esteja na lista, se existir
-        default_model = os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
-        if default_model not in models:
-             logging.warning(f"Modelo padrão '{default_model}' do .env não encontrado via API /tags.")
-             # Poderíamos optar por adicioná-lo mesmo assim, ou apenas logar.
-             # Por segurança, não vamos adicioná-lo se a API não o listou.
-        return models
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Erro ao buscar modelos da API Ollama ({OLLAMA_TAGS_URL}): {e}")
-        # Retorna lista vazia ou com fallback?
-        # Retornar apenas o default pode ser uma opção segura.
-        default_model = os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
-        logging.warning(f"Retornando apenas o modelo padrão '{default_model}' devido a erro na API /tags.")
-        return [default_model]
-    except json.JSONDecodeError as e:
-        logging.error(f"Erro ao decodificar resposta JSON da API /tags: {e}")
-        default_model = os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
-        logging.warning(f"Retornando apenas o modelo padrão '{default_model}' devido a erro JSON.")
-        return [default_model]
-    except Exception as e:
-        logging.exception(f"Erro inesperado ao buscar modelos: {e}")
-        default_model = os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
-        logging.warning(f"Retornando apenas o modelo padrão '{default_model}' devido a erro inesperado.")
-        return [default_model]
-
-def chat_completion(messages: List[Dict[str, str]], model: str | None = None, stream: bool = False) -> Union[str, Generator[str, Any, None], None]:
-    """Envia um histórico de mensagens para a API /api/chat do Ollama e retorna a resposta.
-
-    Args:
-        messages: Uma lista de dicionários, cada um com "role" (user/assistant) e "content".
-        model: O nome do modelo Ollama a ser usado. Se None, usa OLLAMA_DEFAULT_MODEL do .env ou 'llama3'.
-        stream: Se a resposta deve ser retornada como stream (True) ou de uma vez (False).
-
-    Returns:
-        Se stream=False, retorna a string completa da resposta do assistant ou None.
-        Se stream=True, retorna um gerador que produz pedaços (chunks) da resposta do assistant.
-        Retorna None em caso de erro.
-    """
-    target_model = model if model else os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
-    logging.debug(f"Enviando para {OLLAMA_API_URL} com modelo {target_model} e stream={stream}")
-    logging.debug(f"Messages: {messages}")
+# Tamanho do pool de conexões keep-alive (conexões simultâneas por host)
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "10"))
+
+# Por quanto tempo o Ollama mantém o modelo na memória após cada requisição (ex.: "30m", "-1").
+# Se não definido, vale o padrão do servidor (5 minutos).
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE") or None
+
+# Requisições idênticas em andamento compartilham uma única geração ("0" desativa)
+OLLAMA_COALESCE = os.getenv("OLLAMA_COALESCE", "1") != "0"
+
+# Embeddings (/api/embed): modelo, textos por requisição e lotes simultâneos por chamada de embed()
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+OLLAMA_EMBED_BATCH_SIZE = int(os.getenv("OLLAMA_EMBED_BATCH_SIZE", "64"))
+OLLAMA_EMBED_CONCURRENCY = int(os.getenv("OLLAMA_EMBED_CONCURRENCY", "2"))
+
 
+def resolve_model(model: str | None) -> str:
+    """Retorna o modelo informado ou o OLLAMA_DEFAULT_MODEL do .env ('llama3' se ausente)."""
+    return model if model else os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
+
+def build_chat_payload(messages: List[Dict[str, str]], model: str | None, stream: bool, options: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """Monta o corpo da requisição /api/chat (compartilhado pelos clientes sync e async)."""
     payload = {
-        "model": target_model,
+        "model": resolve_model(model),
         "messages": messages,
         "stream": stream
     }
+    if options:
+        payload["options"] = options # Ex.: temperature, top_p, num_ctx
+    if OLLAMA_KEEP_ALIVE:
+        payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+    return payload
 
-    try:
-        response = requests.post(OLLAMA_API_URL, json=payload, stream=stream) # Habilita stream na request
-        response.raise_for_status()
 
+class EmbeddingResult:
+    """Vetores retornados por `embed()`, guardados de forma compacta.
+
+    Cada texto distinto é armazenado uma vez, em um único `array('f')` (float32,
+    linha a linha); `index` (array('I')) liga cada posição da entrada à sua linha.
+    `result[i]` devolve um `memoryview` do vetor do i-ésimo texto (sem cópia).
+    """
+    __slots__ = ("model", "dim", "data", "index", "batches", "elapsed_s")
+
+    def __init__(self, model: str, dim: int, data: array, index: array, batches: int, elapsed_s: float):
+        self.model = model
+        self.dim = dim
+        self.data = data
+        self.index = index
+        self.batches = batches
+        self.elapsed_s = elapsed_s
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> memoryview:
+        row = self.index[i]
+        return memoryview(self.data)[row * self.dim:(row + 1) * self.dim]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def unique_count(self) -> int:
+        return len(self.data) // self.dim if self.dim else 0
+
+    @property
+    def inputs_per_s(self) -> float | None:
+        """Textos de entrada (incluindo repetidos) por segundo de parede."""
+        return len(self.index) / self.elapsed_s if self.elapsed_s > 0 else None
+
+    def tolist(self) -> List[List[float]]:
+        return [vector.tolist() for vector in self]
+
+
+class ChatCallMixin:
+    """Etapas em volta de uma chamada /api/chat comuns aos clientes síncrono e assíncrono.
+
+    Escolha do backend, registro de tempos, cache, disjuntor, slot do escalonador e
+    contabilidade do balanceador ficam aqui; cada cliente só faz o transporte (requests
+    ou aiohttp). Quem herda define `balancer`, `base_url`, `scheduler`, `breaker`,
+    `metrics`, `_explicit_scheduler` e `_explicit_breaker`.
+    """
+
+    def _scheduler_for(self, endpoint: Endpoint | None) -> RequestScheduler:
+        if endpoint is None or self._explicit_scheduler is not None:
+            return self.scheduler
+        return get_scheduler(endpoint.base_url)
+
+    def _breaker_for(self, endpoint: Endpoint | None) -> CircuitBreaker:
+        if endpoint is None or self._explicit_breaker is not None:
+            return self.breaker
+        return get_breaker(endpoint.base_url)
+
+    def _start_call(self, messages: List[Dict[str, str]], model: str | None, options: Dict[str, Any] | None,
+                    priority: Priority, stream: bool, cache: ResponseCache | None,
+                    on_timing: Callable[[ChatTiming], None] | None):
+        """Escolhe o backend, abre o ChatTiming e consulta o cache.
+
+        Returns:
+            (endpoint, timing, texto em cache ou None, on_complete que grava no cache ou None).
+            Num acerto o registro já foi publicado.
+        """
+        target_model = resolve_model(model)
+        endpoint = self.balancer.choose(target_model) if self.balancer is not None else None
+        backend = endpoint.base_url if endpoint is not None else self.base_url
+        timing = ChatTiming(target_model, backend=backend, priority=priority.name.lower(), stream=stream)
+        if cache is None:
+            return endpoint, timing, None, None
+        cache_key = make_cache_key(target_model, messages, options)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Resposta servida do cache (modelo {target_model}).")
+            timing.cached = True
+            publish_timing(self.metrics, timing, True, on_timing)
+            return endpoint, timing, cached, None
+        return endpoint, timing, None, lambda text: cache.set(cache_key, text)
+
+    @staticmethod
+    def _flight_key(model: str | None, messages: List[Dict[str, str]], options: Dict[str, Any] | None,
+                    stream: bool) -> str:
+        return ("stream:" if stream else "full:") + make_cache_key(resolve_model(model), messages, options)
+
+    def _circuit_open(self, breaker: CircuitBreaker, timing: ChatTiming,
+                      on_timing: Callable[[ChatTiming], None] | None) -> bool:
+        """Falha rápido: com o circuito aberto, não entra na fila de um backend fora do ar."""
+        if breaker.state != CircuitBreaker.OPEN:
+            return False
+        logging.error(f"Circuito aberto para {breaker.name}; chamada recusada sem contatar o Ollama.")
+        breaker.allow() # Contabiliza a rejeição
+        publish_timing(self.metrics, timing, False, on_timing)
+        return True
+
+    def _begin_queue(self, endpoint: Endpoint | None) -> None:
+        if endpoint is not None:
+            self.balancer.begin(endpoint) # Conta desde a fila: backends congestionados recebem menos
+
+    def _rejected(self, endpoint: Endpoint | None, timing: ChatTiming, error: Exception,
+                  on_timing: Callable[[ChatTiming], None] | None) -> None:
+        """O escalonador recusou a chamada (fila cheia)."""
+        logging.error(f"Requisição rejeitada pelo escalonador: {error}")
+        if endpoint is not None:
+            self.balancer.end(endpoint)
+        publish_timing(self.metrics, timing, False, on_timing)
+
+    def _admitted(self, endpoint: Endpoint | None, lease: Lease, timing: ChatTiming) -> None:
+        if endpoint is not None:
+            lease.on_release = lambda: self.balancer.end(endpoint)
+        timing.mark_admitted()
+
+    def _record_status(self, breaker: CircuitBreaker, endpoint: Endpoint | None, status: int, model: str) -> None:
+        """HTTP 5xx conta como falha do backend; o resto, como sucesso."""
+        if status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+            if endpoint is not None:
+                self.balancer.report_success(endpoint, model)
+
+    def _record_failure(self, breaker: CircuitBreaker, endpoint: Endpoint | None) -> None:
+        """Erro de conexão ou timeout: falha do backend."""
+        breaker.record_failure()
+        if endpoint is not None:
+            self.balancer.report_failure(endpoint)
+
+    @staticmethod
+    def _finish_stream(timing: ChatTiming, state: StreamState, abandoned: bool, cancel: CancelToken | None,
+                       on_complete: Callable[[str], None] | None) -> None:
+        """Fecha o registro de um stream: métricas do Ollama e cache se terminou, cancelamento se não."""
+        if state.done:
+            timing.apply_ollama_metrics(state.final)
+            if on_complete:
+                on_complete(state.text)
+        elif abandoned or (cancel is not None and cancel.cancelled):
+            # A conexão foi fechada: o Ollama para de gerar
+            timing.cancelled = True
+            timing.eval_count = state.chunk_count
+            logging.info(f"Stream de {timing.model} cancelado após {state.chunk_count} chunks.")
+
+
+class OllamaClient(ChatCallMixin):
+    """Cliente HTTP do Ollama com pool de conexões keep-alive compartilhado.
+
+    Uma única `requests.Session` é reutilizada por todas as chamadas, de modo que
+    as conexões TCP ficam abertas entre um turno de chat e o próximo. O pool do
+    urllib3 por trás do `HTTPAdapter` é thread-safe; com `pool_block=True`, threads
+    excedentes esperam por uma conexão livre em vez de abrir conexões avulsas.
+
+    Com um `EndpointPool` (ou OLLAMA_API_URLS no .env, quando `api_url` não é
+    informado), cada chamada /api/chat vai para o backend saudável menos carregado,
+    com o escalonador próprio daquele backend.
+
+    Resiliência: toda chamada tem tempo limite de conexão, de primeiro token e de
+    leitura (`Timeouts`); chamadas sem stream são repetidas com backoff (`RetryPolicy`);
+    e um disjuntor por backend (`CircuitBreaker`) recusa chamadas na hora enquanto o
+    backend está fora do ar, em vez de acumular trabalho atrás dele.
+
+    Coalescência: chamadas idênticas (modelo, mensagens e opções) feitas enquanto a
+    primeira ainda roda não geram de novo; recebem o mesmo resultado ou, em stream,
+    os mesmos chunks (`SingleFlight`).
+
+    Embeddings: `embed()` envia textos para /api/embed em lotes paralelos (com limite)
+    e devolve os vetores em um `EmbeddingResult` compacto.
+    """
+
+    def __init__(self, api_url: str | None = None, pool_size: int | None = None, scheduler: RequestScheduler | None = None,
+                 metrics: MetricsSink | None = None, balancer: EndpointPool | None = None,
+                 timeouts: Timeouts | None = None, retry: RetryPolicy | None = None, breaker: CircuitBreaker | None = None,
+                 coalesce: bool | None = None):
+        self.balancer = balancer if balancer is not None else (get_default_pool() if api_url is None else None)
+        if self.balancer is not None and api_url is None:
+            api_url = self.balancer.primary.chat_url # Usado nas chamadas administrativas (/api/tags, /api/ps)
+        self.api_url = api_url or OLLAMA_API_URL
+        self.base_url = self.api_url.replace("/api/chat", "").replace("/api/generate", "")
+        self.tags_url = f"{self.base_url}/api/tags"
+        self.generate_url = f"{self.base_url}/api/generate"
+        self.ps_url = f"{self.base_url}/api/ps"
+        self.embed_url = f"{self.base_url}/api/embed"
+        self.pool_size = pool_size or OLLAMA_POOL_SIZE
+        # Todas as chamadas /api/chat passam pelo escalonador do backend (concorrência + prioridade)
+        self._explicit_scheduler = scheduler
+        self.scheduler = scheduler or get_scheduler(self.base_url)
+        # Cada chamada gera um ChatTiming (TTFT, carga, prompt, geração) registrado aqui
+        self.metrics = metrics or get_metrics_sink()
+        self.timeouts = timeouts or Timeouts()
+        self.retry = retry or RetryPolicy()
+        self._explicit_breaker = breaker
+        self.breaker = breaker or get_breaker(self.base_url)
+        self.singleflight = SingleFlight() if (OLLAMA_COALESCE if coalesce is None else coalesce) else None
+
+        self._session = requests.Session()
+        hosts = len(self.balancer.endpoints) if self.balancer is not None else 1
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=self.pool_size, pool_block=True)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def close(self) -> None:
+        """Fecha todas as conexões do pool."""
+        self._session.close()
+
+    def resilience_metrics(self) -> Dict[str, Any]:
+        """Estado do disjuntor e contadores de novas tentativas deste cliente."""
+        return {"breaker": self.breaker.metrics(), "retry": self.retry.metrics()}
+
+    def __enter__(self) -> "OllamaClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def get_available_models(self) -> List[str]:
+        """Busca a lista de modelos disponíveis na API /api/tags do Ollama."""
+        try:
+            logging.info(f"Buscando modelos disponíveis em {self.tags_url}...")
+            response = self._session.get(self.tags_url, timeout=5) # Timeout curto
+            response.raise_for_status()
+            data = response.json()
+            models = [model['name'] for model in data.get('models', [])]
+            logging.info(f"Modelos encontrados: {models}")
+            # Garante que o modelo padrão do .env esteja na lista, se existir
+            default_model = os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
+            if default_model not in models:
+                 logging.warning(f"Modelo padrão '{default_model}' do .env não encontrado via API /tags.")
+                 # Poderíamos optar por adicioná-lo mesmo assim, ou apenas logar.
+                 # Por segurança, não vamos adicioná-lo se a API não o listou.
+            return models
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Erro ao buscar modelos da API Ollama ({self.tags_url}): {e}")
+            # Retorna lista vazia ou com fallback?
+            # Retornar apenas o default pode ser uma opção segura.
+            default_model = os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
+            logging.warning(f"Retornando apenas o modelo padrão '{default_model}' devido a erro na API /tags.")
+            return [default_model]
+        except json.JSONDecodeError as e:
+            logging.error(f"Erro ao decodificar resposta JSON da API /tags: {e}")
+            default_model = os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
+            logging.warning(f"Retornando apenas o modelo padrão '{default_model}' devido a erro JSON.")
+            return [default_model]
+        except Exception as e:
+            logging.exception(f"Erro inesperado ao buscar modelos: {e}")
+            default_model = os.getenv("OLLAMA_DEFAULT_MODEL", "llama3")
+            logging.warning(f"Retornando apenas o modelo padrão '{default_model}' devido a erro inesperado.")
+            return [default_model]
+
+    def list_models(self, timeout: float = 5) -> List[str] | None:
+        """Modelos instalados (GET /api/tags); None se o Ollama não responder (sem fallback)."""
+        try:
+            response = self._session.get(self.tags_url, timeout=timeout)
+            response.raise_for_status()
+            return [m["name"] for m in response.json().get("models", [])]
+        except (requests.exceptions.RequestException, json.JSONDecodeError, KeyError) as e:
+            logging.error(f"Erro ao buscar modelos da API Ollama ({self.tags_url}): {e}")
+            return None
+
+    def load_model(self, model: str, keep_alive: str | int | None = None, timeout: float = 600) -> Dict[str, Any] | None:
+        """Carrega o modelo na memória do Ollama (POST /api/generate sem prompt).
+
+        Retorna a resposta do Ollama (com `load_duration` em ns) ou None em caso de erro.
+        """
+        payload: Dict[str, Any] = {"model": model}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        try:
+            response = self._session.post(self.generate_url, json=payload, timeout=timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            logging.error(f"Erro ao carregar o modelo '{model}' em {self.base_url}: {e}")
+            return None
+
+    def unload_model(self, model: str) -> bool:
+        """Libera o modelo da memória do Ollama (keep_alive=0)."""
+        return self.load_model(model, keep_alive=0, timeout=30) is not None
+
+    def list_running_model_details(self) -> List[Dict[str, Any]] | None:
+        """Entradas de GET /api/ps (name, expires_at, size_vram, ...); None se o Ollama não responder."""
+        try:
+            response = self._session.get(self.ps_url, timeout=5)
+            response.raise_for_status()
+            return response.json().get("models", [])
+        except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            logging.error(f"Erro ao consultar modelos carregados ({self.ps_url}): {e}")
+            return None
+
+    def list_running_models(self) -> List[str] | None:
+        """Modelos atualmente carregados na memória (GET /api/ps); None se o Ollama não responder."""
+        running = self.list_running_model_details()
+        if running is None:
+            return None
+        return [m.get("name") or m.get("model") for m in running]
+
+    def chat_completion(self, messages: List[Dict[str, str]], model: str | None = None, stream: bool = False,
+                        priority: Priority = Priority.INTERACTIVE, options: Dict[str, Any] | None = None,
+                        cache: ResponseCache | None = None,
+                        on_timing: Callable[[ChatTiming], None] | None = None,
+                        cancel: CancelToken | None = None) -> Union[str, Generator[str, Any, None], None]:
+        """Envia um histórico de mensagens para a API /api/chat do Ollama e retorna a resposta.
+
+        Args:
+            messages: Uma lista de dicionários, cada um com "role" (user/assistant) e "content".
+            model: O nome do modelo Ollama a ser usado. Se None, usa OLLAMA_DEFAULT_MODEL do .env ou 'llama3'.
+            stream: Se a resposta deve ser retornada como stream (True) ou de uma vez (False).
+            priority: Classe de prioridade no escalonador (INTERACTIVE para chat, BATCH para geração em massa).
+            options: Opções de geração do Ollama (temperature, top_p, ...). Fazem parte da chave do cache.
+            cache: Cache de respostas opcional. Em um acerto, a resposta é devolvida sem chamar o
+                Ollama (em stream, o texto em cache é reproduzido em chunks).
+            on_timing: Recebe o `ChatTiming` da chamada quando ela termina (em stream, ao fim do
+                gerador). O registro também vai para `self.metrics`. Chamadas coalescidas com
+                uma idêntica em andamento não geram registro próprio (não houve chamada ao Ollama).
+            cancel: Alça de cancelamento. `cancel.cancel()` (de qualquer thread) encerra o stream
+                desta chamada na hora, sem mais chunks. Se ninguém mais lê a mesma geração
+                (coalescida), a conexão com o Ollama é fechada, o que interrompe a geração e
+                devolve o slot do escalonador. Sem stream, a chamada é feita em stream por baixo
+                (para poder ser interrompida) e retorna None se cancelada.
+
+        Returns:
+            Se stream=False, retorna a string completa da resposta do assistant ou None.
+            Se stream=True, retorna um gerador que produz pedaços (chunks) da resposta do assistant.
+            Retorna None em caso de erro, se a fila do backend estiver cheia, se o
+            circuito do backend estiver aberto ou se a chamada foi cancelada.
+        """
+        if cancel is not None and not stream:
+            chunks = self.chat_completion(messages, model, True, priority, options, cache, on_timing, cancel)
+            text = "".join(chunks) if chunks is not None else None
+            return None if cancel.cancelled else text
+        if cancel is not None and cancel.cancelled:
+            return None
+        endpoint, timing, cached, on_complete = self._start_call(messages, model, options, priority, stream, cache, on_timing)
+        if cached is not None:
+            return replay_chunks(cached) if stream else cached
+
+        run = lambda token: self._chat(messages, model, stream, priority, options, on_complete, endpoint, timing,
+                                       on_timing, token)
+        if self.singleflight is None:
+            return run(cancel)
+        flight_key = self._flight_key(model, messages, options, stream)
         if stream:
-            def stream_generator() -> Generator[str, Any, None]:
-                logging.info(f"Iniciando stream para o modelo {target_model}...")
-                full_response_content = "" # Para log completo no final
-                line_count = 0 # Contador de linhas
-                yield_count = 0 # Contador de yields
-                try:
-                    for line in response.iter_lines():
-                        line_count += 1
-                        if line:
-                            decoded_line = line.decode('utf-8')
-                            logging.debug(f"Stream Line {line_count} Raw: {decoded_line}") # Log linha crua
-                            try:
-                                json_line = json.loads(decoded_line)
-                                logging.debug(f"Stream Line {line_count} JSON: {json_line}") # Log JSON decodificado
-                                
-                                chunk = json_line.get("message", {}).get("content", "")
-                                logging.debug(f"Stream Line {line_count} Chunk: '{chunk}'") # Log pedaço extraído
-                                
-                                if chunk:
-                                    full_response_content += chunk
-                                    logging.debug(f"Stream Line {line_count}: Yielding chunk...") # Log antes do yield
-                                    yield_count += 1
-                                    yield chunk
-                                else:
-                                    logging.debug(f"Stream Line {line_count}: Chunk is empty, skipping yield.")
-                                
-                                if json_line.get("done", False):
-                                    logging.info(f"Stream completo recebido (done=True na linha {line_count}). Resposta: {full_response_content}")
-                                    break
-                            except json.JSONDecodeError:
-                                logging.error(f"Erro ao decodificar linha do stream JSON: {decoded_line}")
-                                break
-                            except Exception as e:
-                                logging.exception(f"Erro processando linha do stream: {decoded_line}")
-                                break
-                    # Log final após o loop
-                    logging.info(f"Stream finalizado para {target_model}. Total linhas: {line_count}, Total yields: {yield_count}.")
-                except Exception as e:
-                    logging.exception(f"Erro durante o processamento do stream: {e}")
-                finally:
+            # O `cancel` de quem chamou só encerra a assinatura dele; a geração compartilhada
+            # recebe o token da coalescência, cancelado quando o último assinante sai
+            return self.singleflight.stream(flight_key, run, cancel)
+        return self.singleflight.do(flight_key, lambda: run(None)) # Sem stream e sem cancel (ver acima)
+
+    def _chat(self, messages: List[Dict[str, str]], model: str | None, stream: bool, priority: Priority,
+              options: Dict[str, Any] | None, on_complete: Callable[[str], None] | None, endpoint: Endpoint | None,
+              timing: ChatTiming, on_timing: Callable[[ChatTiming], None] | None,
+              cancel: CancelToken | None = None) -> Union[str, Generator[str, Any, None], None]:
+        """Disjuntor + escalonador + envio de uma chamada (sem cache nem coalescência)."""
+        if self._circuit_open(self._breaker_for(endpoint), timing, on_timing):
+            return None
+
+        self._begin_queue(endpoint)
+        try:
+            lease = self._scheduler_for(endpoint).lease(priority)
+        except QueueFullError as e:
+            self._rejected(endpoint, timing, e, on_timing)
+            return None
+        self._admitted(endpoint, lease, timing)
+        if cancel is not None and cancel.cancelled:
+            # Cancelada enquanto esperava na fila: nem chega a contatar o Ollama
+            lease.release()
+            timing.cancelled = True
+            publish_timing(self.metrics, timing, False, on_timing)
+            return None
+
+        result = None
+        try:
+            result = self._send_chat(messages, model, stream, lease, options, on_complete,
+                                     timing, lambda ok: publish_timing(self.metrics, timing, ok, on_timing), endpoint, cancel)
+            return result
+        finally:
+            # Em stream, o slot só é devolvido quando o gerador termina (ou é coletado)
+            if not (stream and result is not None):
+                lease.release()
+                publish_timing(self.metrics, timing, result is not None, on_timing)
+
+    def _send_chat(self, messages: List[Dict[str, str]], model: str | None, stream: bool, lease: Lease,
+                   options: Dict[str, Any] | None = None, on_complete: Callable[[str], None] | None = None,
+                   timing: ChatTiming | None = None, on_stream_end: Callable[[bool], None] | None = None,
+                   endpoint: Endpoint | None = None, cancel: CancelToken | None = None) -> Union[str, Generator[str, Any, None], None]:
+        """Executa a requisição /api/chat (já com o slot do escalonador obtido).
+
+        `on_complete` recebe o texto completo quando a resposta termina com sucesso (done=True).
+        `timing` recebe o TTFT e as métricas do Ollama; `on_stream_end(ok)` é chamado quando
+        um stream termina (sem stream, quem chama é responsável por fechar o registro).
+        `endpoint` é o backend escolhido pelo balanceador (None = `self.api_url`).
+        `cancel` interrompe o stream: o socket é derrubado e o gerador termina.
+        """
+        timing = timing or ChatTiming(resolve_model(model))
+        payload = build_chat_payload(messages, model, stream, options)
+        target_model = payload["model"]
+        api_url = endpoint.chat_url if endpoint is not None else self.api_url
+        logging.debug(f"Enviando para {api_url} com modelo {target_model} e stream={stream}")
+        logging.debug(f"Messages: {messages}")
+
+        breaker = self._breaker_for(endpoint)
+
+        try:
+            response = self._post(api_url, payload, stream, breaker, endpoint)
+            response.raise_for_status()
+
+            if stream:
+                unregister = cancel.on_cancel(lambda: abort_response(response)) if cancel is not None else None
+                closed = threading.Lock() # Encerramento único: pelo `finally` do gerador ou pelo finalizador
+
+                def close_stream(ok: bool) -> None:
+                    if not closed.acquire(blocking=False):
+                        return
+                    if unregister is not None:
+                        unregister()
+                    response.close() # Num stream interrompido, derruba a conexão (e devolve-a ao pool)
+                    lease.release()
+                    if on_stream_end:
+                        on_stream_end(ok)
+
+                def abandon_unstarted() -> None:
+                    # Gerador descartado sem ser iterado: o `finally` dele nunca roda
+                    if not closed.locked():
+                        timing.cancelled = True
+                    close_stream(False)
+
+                def stream_generator() -> Generator[str, Any, None]:
+                    logging.info(f"Iniciando stream para o modelo {target_model}...")
+                    state = StreamState()
+                    lines = response.iter_lines()
+                    abandoned = False
+                    try:
+                        chunks = iter_chat_chunks(lines, state)
+                        if cancel is not None:
+                            chunks = until_cancelled(chunks, cancel)
+                        for chunk in chunks:
+                            timing.mark_first_token()
+                            # Depois do primeiro token, vale o limite de silêncio entre chunks
+                            _set_read_timeout(response, self.timeouts.read)
+                            yield chunk
+                            break
+                        yield from chunks
+                        if state.done:
+                            logging.info(f"Stream completo recebido (done=True na linha {state.line_count}). Resposta: {state.text}")
+                            # Consome o restante do corpo para que a conexão volte ao pool (keep-alive)
+                            for _ in lines:
+                                pass
+                        # Log final após o loop
+                        logging.info(f"Stream finalizado para {target_model}. Total linhas: {state.line_count}, Total yields: {state.chunk_count}.")
+                    except GeneratorExit:
+                        abandoned = True # Quem lia desistiu (gerador fechado)
+                        raise
+                    except requests.exceptions.RequestException as e:
+                        if cancel is not None and cancel.cancelled:
+                            pass # Socket derrubado pelo cancelamento; não é falha do backend
+                        else:
+                            # Timeout de primeiro token / leitura ou conexão caída no meio do stream
+                            logging.error(f"Erro de rede durante o stream de {api_url}: {e}")
+                            self._record_failure(breaker, endpoint)
+                    except Exception as e:
+                        logging.exception(f"Erro durante o processamento do stream: {e}")
+                    finally:
+                        self._finish_stream(timing, state, abandoned, cancel, on_complete)
+                        close_stream(state.done)
+                generator = stream_generator()
+                # A resposta já está aberta: um gerador descartado sem ser iterado (ou fechado antes
+                # do primeiro next(), como faz o SingleFlight) ainda precisa devolver a conexão do
+                # pool, o slot do escalonador e o registro de tempos
+                weakref.finalize(generator, abandon_unstarted)
+                return generator
+            else:
+                logging.info(f"Recebendo resposta completa para o modelo {target_model}...")
+                response_data = response.json()
+                # Na API /chat, a resposta está em response_data["message"]["content"]
+                full_response = response_data.get("message", {}).get("content", "")
+                timing.apply_ollama_metrics(response_data)
+                logging.info(f"Resposta completa recebida: {full_response}")
+                if on_complete and full_response:
+                    on_complete(full_response)
+                return full_response
+
+        except CircuitOpenError as e:
+            logging.error(str(e))
+            return None
+        except requests.exceptions.ConnectionError as e:
+            logging.error(f"Erro de conexão ao tentar acessar {api_url}: {e}")
+            return None
+        except requests.exceptions.Timeout as e:
+            logging.error(f"Timeout ao tentar acessar {api_url}: {e}")
+            return None
+        except requests.exceptions.HTTPError as e:
+            logging.error(f"Erro HTTP {response.status_code} ao acessar {api_url}: {e}")
+            logging.error(f"Resposta recebida: {response.text}")
+            return None
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Erro inesperado de request para {api_url}: {e}")
+            return None
+        except json.JSONDecodeError as e:
+            # Isso pode acontecer se stream=False e a resposta não for JSON válido
+            logging.error(f"Erro ao decodificar a resposta JSON do Ollama (stream=False). Status: {response.status_code}")
+            logging.error(f"Resposta recebida: {response.text}")
+            return None
+        except Exception as e:
+            logging.exception(f"Erro inesperado na função chat_completion: {e}")
+            return None
+
+    def _post(self, api_url: str, payload: Dict[str, Any], stream: bool, breaker: CircuitBreaker,
+              endpoint: Endpoint | None = None) -> requests.Response:
+        """POST /api/chat com tempos limite, disjuntor e, sem stream, novas tentativas com backoff.
+
+        Erros de conexão, timeouts e HTTP 5xx contam como falha do backend. Levanta
+        CircuitOpenError se o circuito estiver aberto; a última falha é repassada a quem chamou.
+        """
+        attempts = 1 if stream else 1 + self.retry.max_retries
+        # Em stream, o tempo de leitura inicial é o de primeiro token (trocado após o 1º chunk)
+        timeout = (self.timeouts.connect, self.timeouts.first_token if stream else self.timeouts.read)
+        for attempt in range(attempts):
+            if attempt:
+                self.retry.sleep(attempt - 1)
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuito aberto para {breaker.name}; chamada recusada sem contatar o Ollama.")
+            try:
+                response = self._session.post(api_url, json=payload, stream=stream, timeout=timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record_failure(breaker, endpoint)
+                if attempt + 1 < attempts:
+                    logging.warning(f"Falha ao acessar {api_url} ({e}); nova tentativa {attempt + 1}/{attempts - 1}.")
+                    continue
+                if attempts > 1:
+                    self.retry.record_exhausted()
+                raise
+            self._record_status(breaker, endpoint, response.status_code, payload["model"])
+            if response.status_code >= 500:
+                if attempt + 1 < attempts:
+                    logging.warning(f"HTTP {response.status_code} de {api_url}; nova tentativa {attempt + 1}/{attempts - 1}.")
                     response.close()
-            return stream_generator()
-        else:
-            logging.info(f"Recebendo resposta completa para o modelo {target_model}...")
-            response_data = response.json()
-            # Na API /chat, a resposta está em response_data["message"]["content"]
-            full_response = response_data.get("message", {}).get("content", "")
-            logging.info(f"Resposta completa recebida: {full_response}")
-            return full_response
-
-    except requests.exceptions.ConnectionError as e:
-        logging.error(f"Erro de conexão ao tentar acessar {OLLAMA_API_URL}: {e}")
-        return None
-    except requests.exceptions.Timeout as e:
-        logging.error(f"Timeout ao tentar acessar {OLLAMA_API_URL}: {e}")
-        return None
-    except requests.exceptions.HTTPError as e:
-        logging.error(f"Erro HTTP {response.status_code} ao acessar {OLLAMA_API_URL}: {e}")
-        logging.error(f"Resposta recebida: {response.text}")
-        return None
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Erro inesperado de request para {OLLAMA_API_URL}: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        # Isso pode acontecer se stream=False e a resposta não for JSON válido
-        logging.error(f"Erro ao decodificar a resposta JSON do Ollama (stream=False). Status: {response.status_code}")
-        logging.error(f"Resposta recebida: {response.text}")
-        return None
-    except Exception as e:
-        logging.exception(f"Erro inesperado na função chat_completion: {e}")
-        return None 
\ No newline at end of file
+                    continue
+                if attempts > 1:
+                    self.retry.record_exhausted()
+            return response
+
+    def embed(self, inputs: Sequence[str], model: str | None = None, batch_size: int | None = None,
+              concurrency: int | None = None, priority: Priority = Priority.BATCH,
+              options: Dict[str, Any] | None = None) -> EmbeddingResult | None:
+        """Gera embeddings para `inputs` via /api/embed, em lotes enviados em paralelo.
+
+        Textos repetidos são enviados uma única vez. Os lotes de `batch_size` textos
+        (OLLAMA_EMBED_BATCH_SIZE) rodam em até `concurrency` (OLLAMA_EMBED_CONCURRENCY)
+        threads; cada lote passa pelo escalonador, balanceador e disjuntor como uma
+        chamada de chat sem stream (inclusive as novas tentativas).
+
+        Args:
+            inputs: Textos a vetorizar (a ordem do resultado é a mesma).
+            model: Modelo de embeddings. Se None, usa OLLAMA_EMBED_MODEL do .env ('nomic-embed-text').
+            priority: Classe de prioridade no escalonador (BATCH por padrão: reindexações
+                não atrasam o chat).
+
+        Returns:
+            EmbeddingResult (vetores float32 + textos/s), ou None se algum lote falhar.
+        """
+        model = model or OLLAMA_EMBED_MODEL
+        batch_size = batch_size or OLLAMA_EMBED_BATCH_SIZE
+        concurrency = concurrency or OLLAMA_EMBED_CONCURRENCY
+        started = time.perf_counter()
+
+        rows: Dict[str, int] = {}
+        index = array("I", (rows.setdefault(text, len(rows)) for text in inputs))
+        unique = list(rows) # Dicionários preservam a ordem de inserção: posição == linha
+        batches = [unique[i:i + batch_size] for i in range(0, len(unique), batch_size)]
+
+        try:
+            if len(batches) <= 1:
+                vectors = [self._embed_batch(batch, model, priority, options) for batch in batches]
+            else:
+                with ThreadPoolExecutor(max_workers=min(concurrency, len(batches)), thread_name_prefix="ollama-embed") as executor:
+                    vectors = list(executor.map(lambda batch: self._embed_batch(batch, model, priority, options), batches))
+        except QueueFullError as e:
+            logging.error(f"Lote de embeddings rejeitado pelo escalonador: {e}")
+            return None
+        except (requests.exceptions.RequestException, CircuitOpenError, json.JSONDecodeError, ValueError) as e:
+            logging.error(f"Erro ao gerar embeddings com o modelo '{model}': {e}")
+            return None
+
+        dim = len(vectors[0][0]) if vectors and vectors[0] else 0
+        data = array("f")
+        for batch_vectors in vectors:
+            for vector in batch_vectors:
+                if len(vector) != dim:
+                    logging.error(f"Embeddings com dimensões diferentes ({len(vector)} != {dim}) do modelo '{model}'.")
+                    return None
+                data.extend(vector)
+        result = EmbeddingResult(model, dim, data, index, len(batches), time.perf_counter() - started)
+        if result.inputs_per_s is not None:
+            logging.info(f"Embeddings: {len(result)} textos ({result.unique_count} distintos) em {len(batches)} lotes, "
+                         f"{result.elapsed_s:.2f}s ({result.inputs_per_s:.1f} textos/s).")
+        return result
+
+    def _embed_batch(self, texts: List[str], model: str, priority: Priority,
+                     options: Dict[str, Any] | None) -> List[List[float]]:
+        """Envia um lote para /api/embed (com slot do escalonador). Levanta em caso de erro."""
+        endpoint = self.balancer.choose(model) if self.balancer is not None else None
+        embed_url = f"{endpoint.base_url}/api/embed" if endpoint is not None else self.embed_url
+        breaker = self._breaker_for(endpoint)
+        payload: Dict[str, Any] = {"model": model, "input": texts}
+        if options:
+            payload["options"] = options
+        if OLLAMA_KEEP_ALIVE:
+            payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+
+        if endpoint is not None:
+            self.balancer.begin(endpoint)
+        try:
+            with self._scheduler_for(endpoint).slot(priority):
+                response = self._post(embed_url, payload, False, breaker, endpoint)
+                response.raise_for_status()
+                embeddings = response.json().get("embeddings") or []
+        finally:
+            if endpoint is not None:
+                self.balancer.end(endpoint)
+        if len(embeddings) != len(texts):
+            raise ValueError(f"/api/embed retornou {len(embeddings)} vetores para {len(texts)} textos")
+        return embeddings
+
+
+def _set_read_timeout(response: requests.Response, seconds: float) -> None:
+    """Ajusta o timeout de leitura do socket de uma resposta em andamento (melhor esforço)."""
+    try:
+        response.raw.connection.sock.settimeout(seconds)
+    except AttributeError:
+        pass # Resposta simulada ou conexão já devolvida ao pool
+
+
+# --- Cliente compartilhado (pool único por processo) ---
+_default_client: OllamaClient | None = None
+_default_client_lock = threading.Lock()
+
+def get_default_client() -> OllamaClient:
+    """Retorna o cliente compartilhado do processo, criando-o na primeira chamada."""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = OllamaClient()
+    return _default_client
+
+def get_available_models() -> List[str]:
+    """Busca a lista de modelos disponíveis usando o cliente compartilhado."""
+    return get_default_client().get_available_models()
+
+def embed(inputs: Sequence[str], model: str | None = None, batch_size: int | None = None,
+          concurrency: int | None = None, priority: Priority = Priority.BATCH) -> EmbeddingResult | None:
+    """Gera embeddings usando o cliente compartilhado (ver OllamaClient.embed)."""
+    return get_default_client().embed(inputs, model=model, batch_size=batch_size,
+                                      concurrency=concurrency, priority=priority)
+
+def chat_completion(messages: List[Dict[str, str]], model: str | None = None, stream: bool = False,
+                    priority: Priority = Priority.INTERACTIVE, options: Dict[str, Any] | None = None,
+                    cache: ResponseCache | None = None,
+                    on_timing: Callable[[ChatTiming], None] | None = None,
+                    cancel: CancelToken | None = None) -> Union[str, Generator[str, Any, None], None]:
+    """Envia mensagens para /api/chat usando o cliente compartilhado (ver OllamaClient.chat_completion)."""
+    return get_default_client().chat_completion(messages=messages, model=model, stream=stream,
+                                                priority=priority, options=options, cache=cache,
+                                                on_timing=on_timing, cancel=cancel)
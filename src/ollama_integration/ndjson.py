@@ -0,0 +1,96 @@
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List
+
+# Referência local: evita a busca de atributo `json.loads` a cada linha
+_loads = json.loads
+
+
+class StreamState:
+    """Estado acumulado enquanto um stream NDJSON do /api/chat é decodificado.
+
+    O texto é acumulado em uma lista de partes (`"".join` só no final), em vez de
+    concatenações repetidas de string.
+    """
+    __slots__ = ("parts", "line_count", "final", "error_line")
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.line_count = 0
+        self.final: Dict[str, Any] | None = None # Última mensagem (done=True), com as métricas do Ollama
+        self.error_line: bytes | None = None # Linha que não pôde ser decodificada
+
+    @property
+    def done(self) -> bool:
+        return self.final is not None
+
+    @property
+    def finished(self) -> bool:
+        return self.final is not None or self.error_line is not None
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self.parts)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def decode_chat_line(line: bytes, state: StreamState, debug: bool = False) -> str | None:
+    """Decodifica uma linha NDJSON do /api/chat e devolve o conteúdo dela (ou None).
+
+    Passo comum aos clientes síncrono (`iter_chat_chunks`) e assíncrono (`aiter_chat_chunks`).
+    Depois de uma linha `done=True` (guardada em `state.final`) ou de uma linha inválida
+    (guardada em `state.error_line`, com log de erro), `state.finished` fica True e quem
+    lê deve parar.
+    """
+    state.line_count += 1
+    try:
+        data = _loads(line)
+    except ValueError: # json.JSONDecodeError e UnicodeDecodeError
+        state.error_line = line
+        logging.error("Erro ao decodificar linha do stream JSON: %s", line.decode("utf-8", errors="replace"))
+        return None
+    message = data.get("message")
+    chunk = message.get("content") if message else None
+    if debug:
+        logging.debug("Stream linha %d: chunk=%r done=%s", state.line_count, chunk, data.get("done", False))
+    if chunk:
+        state.parts.append(chunk)
+    if data.get("done"):
+        state.final = data
+    return chunk or None
+
+
+def iter_chat_chunks(lines: Iterable[bytes], state: StreamState) -> Iterator[str]:
+    """Decodifica linhas NDJSON (bytes crus) do /api/chat e produz o conteúdo de cada uma.
+
+    - `json.loads` direto nos bytes, sem `decode('utf-8')` intermediário.
+    - Nenhum log por linha a menos que DEBUG esteja habilitado (verificado uma vez).
+    - Para na mensagem `done=True` (guardada em `state.final`) ou na primeira linha
+      inválida (guardada em `state.error_line`, com log de erro).
+    """
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    for line in lines:
+        if not line:
+            continue
+        chunk = decode_chat_line(line, state, debug)
+        if chunk:
+            yield chunk
+        if state.finished:
+            return
+
+
+async def aiter_chat_chunks(lines: AsyncIterable[bytes], state: StreamState) -> AsyncIterator[str]:
+    """Versão assíncrona de `iter_chat_chunks` (linhas do aiohttp, com o '\\n' final)."""
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+    async for line in lines:
+        line = line.rstrip(b"\r\n")
+        if not line:
+            continue
+        chunk = decode_chat_line(line, state, debug)
+        if chunk:
+            yield chunk
+        if state.finished:
+            return
@@ -0,0 +1,222 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+from src.ollama_integration.client import OLLAMA_KEEP_ALIVE, OllamaClient, get_default_client, resolve_model
+from src.ollama_integration.telemetry import ChatTiming, MetricsSink, get_metrics_sink
+
+# Limites padrão (podem ser sobrescritos via .env)
+OLLAMA_WARM_KEEP_ALIVE = os.getenv("OLLAMA_WARM_KEEP_ALIVE", OLLAMA_KEEP_ALIVE or "30m")
+OLLAMA_MAX_RESIDENT_MODELS = int(os.getenv("OLLAMA_MAX_RESIDENT_MODELS", "2"))
+OLLAMA_IDLE_UNLOAD_SECONDS = float(os.getenv("OLLAMA_IDLE_UNLOAD_SECONDS", "1800"))
+
+# load_duration acima disso (s) indica que o modelo precisou ser carregado durante a chamada
+_COLD_LOAD_THRESHOLD_S = 0.5
+
+
+def _parse_expires_at(value: str | None) -> float | None:
+    """Converte o `expires_at` do /api/ps (ISO 8601, às vezes com nanossegundos) em epoch."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        logging.warning(f"expires_at inválido no /api/ps: {value!r}")
+        return None
+
+
+class _ModelUsage:
+    __slots__ = ("uses", "last_used", "loads", "last_load_s", "total_load_s")
+
+    def __init__(self):
+        self.uses = 0
+        self.last_used = 0.0
+        self.loads = 0
+        self.last_load_s: float | None = None
+        self.total_load_s = 0.0
+
+    def record_load(self, seconds: float) -> None:
+        self.loads += 1
+        self.last_load_s = seconds
+        self.total_load_s += seconds
+
+
+class ModelResidencyManager:
+    """Mantém os modelos certos carregados na memória do Ollama.
+
+    - Pré-carga: `start()` carrega os modelos fixos (por padrão, o OLLAMA_DEFAULT_MODEL).
+    - Aquecimento: `warm(model)` carrega um modelo em segundo plano (ex.: assim que o
+      usuário troca o modelo no dropdown), sem bloquear quem chamou; pedidos repetidos
+      para o mesmo modelo compartilham a mesma carga.
+    - keep_alive: cargas usam `keep_alive` (OLLAMA_WARM_KEEP_ALIVE) para o modelo não ser
+      descarregado pelo Ollama entre um turno e outro.
+    - Descarga: modelos não fixos sem uso há mais de `idle_unload_after` segundos, ou
+      além de `max_resident` (os menos usados recentemente primeiro), são liberados
+      (keep_alive=0), evitando que modelos raros fiquem disputando a memória da GPU.
+      Só entram nessa conta os modelos que este gerenciador carregou ou viu usar: os
+      carregados por outros processos (ex.: o job de geração em massa) só são liberados
+      quando o `expires_at` informado pelo /api/ps já passou, e nunca por excesso.
+    - Relatório: `status()` lista os modelos residentes e quanto tempo as cargas levaram.
+
+    O uso de cada modelo é observado pelas métricas das chamadas (`MetricsSink`).
+    """
+
+    def __init__(self, client: OllamaClient | None = None, pinned: Iterable[str] | None = None,
+                 keep_alive: str | int | None = None, max_resident: int | None = None,
+                 idle_unload_after: float | None = None, check_interval: float = 60.0,
+                 metrics: MetricsSink | None = None):
+        self.client = client or get_default_client()
+        self.pinned = set(pinned) if pinned is not None else {resolve_model(None)}
+        self.keep_alive = keep_alive if keep_alive is not None else OLLAMA_WARM_KEEP_ALIVE
+        self.max_resident = max_resident or OLLAMA_MAX_RESIDENT_MODELS
+        self.idle_unload_after = idle_unload_after if idle_unload_after is not None else OLLAMA_IDLE_UNLOAD_SECONDS
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._usage: Dict[str, _ModelUsage] = {}
+        self._resident: set[str] = set() # Visão local; /api/ps é a fonte de verdade quando responde
+        self._expires_at: Dict[str, float] = {} # expires_at (epoch) de cada modelo segundo o /api/ps
+        self._loading: Dict[str, Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ollama-warmup")
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        (metrics or get_metrics_sink()).subscribe(self._on_timing)
+
+    def _usage_for(self, model: str) -> _ModelUsage:
+        usage = self._usage.get(model)
+        if usage is None:
+            usage = self._usage[model] = _ModelUsage()
+        return usage
+
+    def _on_timing(self, timing: ChatTiming) -> None:
+        """Listener das métricas: registra o uso do modelo e cargas "a frio" durante chamadas."""
+        if timing.cached or not timing.ok:
+            return
+        with self._lock:
+            usage = self._usage_for(timing.model)
+            usage.uses += 1
+            usage.last_used = time.time()
+            if timing.load_duration_s and timing.load_duration_s >= _COLD_LOAD_THRESHOLD_S:
+                usage.record_load(timing.load_duration_s)
+                logging.warning(f"Modelo '{timing.model}' foi carregado durante uma chamada ({timing.load_duration_s:.2f}s).")
+            self._resident.add(timing.model)
+
+    # --- Carga / descarga ---
+    def warm(self, model: str) -> Future:
+        """Agenda a carga do modelo em segundo plano e retorna o Future (True se carregou)."""
+        model = resolve_model(model)
+        with self._lock:
+            future = self._loading.get(model)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._load, model)
+            self._loading[model] = future
+        return future
+
+    def _load(self, model: str) -> bool:
+        try:
+            logging.info(f"Aquecendo modelo '{model}' (keep_alive={self.keep_alive})...")
+            started = time.perf_counter()
+            response = self.client.load_model(model, keep_alive=self.keep_alive)
+            elapsed = time.perf_counter() - started
+            if response is None:
+                return False
+            with self._lock:
+                usage = self._usage_for(model)
+                usage.last_used = max(usage.last_used, time.time()) # Conta a ociosidade a partir da carga
+                if model not in self._resident or (response.get("load_duration") or 0) / 1e9 >= _COLD_LOAD_THRESHOLD_S:
+                    usage.record_load(elapsed)
+                self._resident.add(model)
+            logging.info(f"Modelo '{model}' residente (carga em {elapsed:.2f}s).")
+            self.enforce_limits(keep=model)
+            return True
+        finally:
+            with self._lock:
+                self._loading.pop(model, None)
+
+    def unload(self, model: str) -> bool:
+        if not self.client.unload_model(model):
+            return False
+        with self._lock:
+            self._resident.discard(model)
+        logging.info(f"Modelo '{model}' descarregado da memória do Ollama.")
+        return True
+
+    def resident_models(self) -> List[str]:
+        running = self.client.list_running_model_details()
+        with self._lock:
+            if running is not None:
+                self._resident = {m.get("name") or m.get("model") for m in running}
+                self._expires_at = {}
+                for m in running:
+                    expires_at = _parse_expires_at(m.get("expires_at"))
+                    if expires_at is not None:
+                        self._expires_at[m.get("name") or m.get("model")] = expires_at
+            return sorted(self._resident)
+
+    def enforce_limits(self, keep: str | None = None) -> List[str]:
+        """Descarrega modelos ociosos e os excedentes de `max_resident`. Retorna os descarregados."""
+        resident = self.resident_models()
+        now = time.time()
+        with self._lock:
+            protected = self.pinned | set(self._loading) | ({keep} if keep else set())
+            # Só os modelos que este processo carregou ou usou têm ociosidade conhecida aqui
+            candidates = [m for m in resident if m not in protected and m in self._usage]
+            last_used = {m: self._usage[m].last_used for m in candidates}
+            # Os demais pertencem a outros processos: só saem quando o próprio Ollama já os daria por expirados
+            expired = [m for m in resident if m not in protected and m not in self._usage
+                       and self._expires_at.get(m, float("inf")) <= now]
+        candidates.sort(key=lambda m: last_used[m]) # Menos usados recentemente primeiro
+
+        to_unload = [m for m in candidates if now - last_used[m] > self.idle_unload_after] + expired
+        excess = len(resident) - len(to_unload) - self.max_resident
+        for m in candidates:
+            if excess <= 0:
+                break
+            if m not in to_unload:
+                to_unload.append(m)
+                excess -= 1
+        return [m for m in to_unload if self.unload(m)]
+
+    # --- Ciclo de vida ---
+    def start(self, preload: Iterable[str] | None = None) -> "ModelResidencyManager":
+        """Pré-carrega os modelos fixos (ou `preload`) e inicia a verificação periódica."""
+        for model in (preload if preload is not None else self.pinned):
+            self.warm(model)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ollama-residency", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.enforce_limits()
+            except Exception:
+                logging.exception("Erro na verificação de residência dos modelos")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def status(self) -> Dict[str, Any]:
+        """Modelos residentes, em carga, e estatísticas de uso/carga por modelo."""
+        resident = self.resident_models()
+        with self._lock:
+            models = {
+                model: {
+                    "uses": usage.uses,
+                    "last_used": usage.last_used or None,
+                    "loads": usage.loads,
+                    "last_load_s": usage.last_load_s,
+                    "avg_load_s": usage.total_load_s / usage.loads if usage.loads else None,
+                    "pinned": model in self.pinned,
+                }
+                for model, usage in self._usage.items()
+            }
+            loading = sorted(self._loading)
+        return {"resident": resident, "loading": loading, "models": models}
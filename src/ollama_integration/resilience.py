@@ -0,0 +1,167 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict
+
+# Limites padrão (podem ser sobrescritos via .env)
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_FIRST_TOKEN_TIMEOUT = float(os.getenv("OLLAMA_FIRST_TOKEN_TIMEOUT", "120"))
+OLLAMA_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+OLLAMA_RETRY_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.5"))
+OLLAMA_BREAKER_FAILURES = int(os.getenv("OLLAMA_BREAKER_FAILURES", "5"))
+OLLAMA_BREAKER_RESET_SECONDS = float(os.getenv("OLLAMA_BREAKER_RESET_SECONDS", "30"))
+
+
+class Timeouts:
+    """Tempos limite (segundos) das chamadas ao Ollama.
+
+    connect: abertura da conexão TCP.
+    first_token: em stream, espera até o primeiro chunk (carga do modelo + avaliação do prompt).
+    read: em stream, silêncio máximo entre chunks depois do primeiro; sem stream, espera
+        pela resposta inteira (o Ollama só responde quando termina de gerar).
+    """
+    __slots__ = ("connect", "read", "first_token")
+
+    def __init__(self, connect: float | None = None, read: float | None = None, first_token: float | None = None):
+        self.connect = connect if connect is not None else OLLAMA_CONNECT_TIMEOUT
+        self.read = read if read is not None else OLLAMA_READ_TIMEOUT
+        self.first_token = first_token if first_token is not None else OLLAMA_FIRST_TOKEN_TIMEOUT
+
+
+class RetryPolicy:
+    """Novas tentativas com backoff exponencial e jitter ("full jitter").
+
+    Só deve ser usada em chamadas idempotentes (sem stream): um stream já entregue
+    em parte ao usuário não pode ser repetido.
+    """
+
+    def __init__(self, max_retries: int | None = None, backoff: float | None = None, max_backoff: float = 10.0):
+        self.max_retries = max_retries if max_retries is not None else OLLAMA_MAX_RETRIES
+        self.backoff = backoff if backoff is not None else OLLAMA_RETRY_BACKOFF
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.retries = 0 # Total de novas tentativas feitas
+        self.exhausted = 0 # Chamadas que falharam mesmo após todas as tentativas
+
+    def delay(self, attempt: int) -> float:
+        """Espera antes da nova tentativa `attempt` (0 = primeira repetição)."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def sleep(self, attempt: int) -> None:
+        with self._lock:
+            self.retries += 1
+        time.sleep(self.delay(attempt))
+
+    def record_exhausted(self) -> None:
+        with self._lock:
+            self.exhausted += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"max_retries": self.max_retries, "retries": self.retries, "exhausted": self.exhausted}
+
+
+class CircuitOpenError(Exception):
+    """Levantada (ou logada) quando o circuito do backend está aberto."""
+
+
+class CircuitBreaker:
+    """Disjuntor por backend: falha rápido enquanto o Ollama está fora do ar.
+
+    - Fechado: chamadas passam; `failure_threshold` falhas seguidas abrem o circuito.
+    - Aberto: chamadas são recusadas na hora (`allow()` retorna False) por `reset_timeout`
+      segundos, sem ocupar fila nem conexão.
+    - Meio-aberto: passado o tempo, uma única chamada de teste é liberada; sucesso fecha
+      o circuito, falha o reabre.
+
+    Contam como falha: erro de conexão, timeout e HTTP 5xx. Respostas 4xx são sucesso
+    do ponto de vista do backend (ele está respondendo).
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str = "ollama", failure_threshold: int | None = None, reset_timeout: float | None = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or OLLAMA_BREAKER_FAILURES
+        self.reset_timeout = reset_timeout if reset_timeout is not None else OLLAMA_BREAKER_RESET_SECONDS
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """True se a chamada pode seguir; False se deve falhar rápido."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._stats["successes"] += 1
+            self._failures = 0
+            if self._state != self.CLOSED:
+                logging.info(f"Circuito do backend '{self.name}' fechado novamente.")
+            self._state = self.CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._stats["failures"] += 1
+            self._failures += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+                self._stats["opened"] += 1
+                logging.error(f"Circuito do backend '{self.name}' aberto após {self._failures} falha(s) seguidas; "
+                              f"chamadas falharão rápido por {self.reset_timeout:.0f}s.")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                **self._stats,
+            }
+
+
+# --- Registro: um disjuntor por backend (URL base) ---
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(backend_url: str) -> CircuitBreaker:
+    """Retorna o disjuntor compartilhado do backend, criando-o na primeira chamada."""
+    with _breakers_lock:
+        breaker = _breakers.get(backend_url)
+        if breaker is None:
+            breaker = _breakers[backend_url] = CircuitBreaker(name=backend_url)
+        return breaker
+
+def all_breaker_metrics() -> list[Dict[str, Any]]:
+    """Estado e contadores de todos os disjuntores conhecidos."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.metrics() for breaker in breakers]
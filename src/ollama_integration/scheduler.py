@@ -0,0 +1,278 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import Any, Dict, Iterator, AsyncIterator
+
+# Limites padrão (podem ser sobrescritos via .env)
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))
+OLLAMA_MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "64"))
+
+
+class Priority(IntEnum):
+    """Classes de prioridade (valor menor = atendido primeiro)."""
+    INTERACTIVE = 0 # Turnos de chat / cliques de um usuário esperando a resposta
+    BATCH = 1 # Geração em massa (descrições do schema, reindexações)
+
+
+class QueueFullError(Exception):
+    """Levantada quando a fila do backend está cheia (rejeição imediata)."""
+
+
+class _Waiter:
+    """Entrada da fila: uma thread (Event) ou uma corrotina (Future) esperando um slot."""
+    __slots__ = ("priority", "enqueued_at", "event", "future", "loop", "cancelled", "granted")
+
+    def __init__(self, priority: Priority, loop: asyncio.AbstractEventLoop | None = None):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+        self.cancelled = False
+        self.granted = False
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class Lease:
+    """Slot obtido do escalonador; `release()` é idempotente.
+
+    Útil quando o slot precisa sobreviver à função que o obteve (ex.: respostas em
+    stream, liberadas só quando o gerador termina). `on_release`, se definido, é
+    chamado uma vez junto com a liberação (ex.: contabilidade do balanceador).
+    """
+    __slots__ = ("_scheduler", "priority", "_released", "on_release")
+
+    def __init__(self, scheduler: "RequestScheduler", priority: Priority):
+        self._scheduler = scheduler
+        self.priority = priority
+        self._released = False
+        self.on_release = None
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._scheduler.release(self.priority)
+            if self.on_release is not None:
+                self.on_release()
+
+
+class RequestScheduler:
+    """Escalonador de requisições para um backend Ollama.
+
+    - Concorrência limitada: no máximo `max_concurrency` requisições em andamento.
+    - Prioridades: quando um slot libera, o próximo da fila é sempre o de menor
+      `Priority` (FIFO dentro da mesma classe).
+    - Reserva para o interativo: trabalhos BATCH ocupam no máximo
+      `max_batch_concurrency` slots, deixando folga para turnos de chat.
+    - Controle de admissão: se a fila já tem `max_queue` itens esperando, a nova
+      requisição é rejeitada na hora com `QueueFullError`.
+
+    Funciona tanto para threads (`slot`) quanto para corrotinas (`aslot`).
+    """
+
+    def __init__(self, max_concurrency: int | None = None, max_queue: int | None = None,
+                 max_batch_concurrency: int | None = None, name: str = "ollama"):
+        self.name = name
+        self.max_concurrency = max_concurrency or OLLAMA_MAX_CONCURRENCY
+        self.max_queue = max_queue if max_queue is not None else OLLAMA_MAX_QUEUE
+        if max_batch_concurrency is None:
+            max_batch_concurrency = max(1, self.max_concurrency - 1)
+        self.max_batch_concurrency = max_batch_concurrency
+
+        self._lock = threading.Lock()
+        self._heap: list[tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._queued = {p: 0 for p in Priority}
+        self._in_flight = {p: 0 for p in Priority}
+
+        # Métricas
+        self._admitted = {p: 0 for p in Priority}
+        self._rejected = {p: 0 for p in Priority}
+        self._wait_total = {p: 0.0 for p in Priority}
+        self._wait_max = {p: 0.0 for p in Priority}
+        self._recent_waits = {p: deque(maxlen=500) for p in Priority}
+
+    # --- Núcleo (sempre chamado com self._lock) ---
+    def _has_capacity(self, priority: Priority) -> bool:
+        if sum(self._in_flight.values()) >= self.max_concurrency:
+            return False
+        if priority == Priority.BATCH and self._in_flight[Priority.BATCH] >= self.max_batch_concurrency:
+            return False
+        return True
+
+    def _record_admission(self, priority: Priority, waited: float) -> None:
+        self._in_flight[priority] += 1
+        self._admitted[priority] += 1
+        self._wait_total[priority] += waited
+        self._wait_max[priority] = max(self._wait_max[priority], waited)
+        self._recent_waits[priority].append(waited)
+
+    def _enqueue(self, waiter: _Waiter) -> bool:
+        """Tenta admitir direto; senão enfileira. Retorna True se já foi admitido."""
+        priority = waiter.priority
+        ahead = sum(n for p, n in self._queued.items() if p <= priority)
+        if ahead == 0 and self._has_capacity(priority):
+            self._record_admission(priority, 0.0)
+            return True
+        if sum(self._queued.values()) >= self.max_queue:
+            self._rejected[priority] += 1
+            raise QueueFullError(
+                f"Fila do backend '{self.name}' cheia ({self.max_queue} aguardando); requisição {priority.name} rejeitada."
+            )
+        heapq.heappush(self._heap, (int(priority), next(self._seq), waiter))
+        self._queued[priority] += 1
+        return False
+
+    def _dispatch(self) -> None:
+        """Concede slots livres aos próximos da fila, respeitando prioridade e reserva."""
+        skipped = []
+        while self._heap and sum(self._in_flight.values()) < self.max_concurrency:
+            entry = heapq.heappop(self._heap)
+            waiter = entry[2]
+            if waiter.cancelled:
+                continue
+            if not self._has_capacity(waiter.priority):
+                skipped.append(entry) # BATCH no limite: deixa a vez para os próximos
+                continue
+            self._queued[waiter.priority] -= 1
+            self._record_admission(waiter.priority, time.monotonic() - waiter.enqueued_at)
+            waiter.grant()
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+    def _cancel(self, waiter: _Waiter) -> bool:
+        """Remove um waiter da fila. Retorna False se o slot já tinha sido concedido."""
+        if waiter.cancelled:
+            return True
+        if waiter.granted:
+            return False
+        waiter.cancelled = True
+        self._queued[waiter.priority] -= 1
+        return True
+
+    # --- API síncrona ---
+    def acquire(self, priority: Priority = Priority.INTERACTIVE, timeout: float | None = None) -> None:
+        """Bloqueia até obter um slot. Levanta QueueFullError ou TimeoutError."""
+        waiter = _Waiter(priority)
+        with self._lock:
+            if self._enqueue(waiter):
+                return
+        if waiter.event.wait(timeout):
+            return
+        with self._lock:
+            if self._cancel(waiter):
+                raise TimeoutError(f"Tempo de espera na fila do backend '{self.name}' esgotado ({timeout}s).")
+        # Concedido no último instante: o slot é nosso
+
+    def release(self, priority: Priority = Priority.INTERACTIVE) -> None:
+        """Devolve um slot obtido com acquire/aacquire."""
+        with self._lock:
+            self._in_flight[priority] -= 1
+            self._dispatch()
+
+    def lease(self, priority: Priority = Priority.INTERACTIVE, timeout: float | None = None) -> Lease:
+        """Como `acquire`, mas retorna um `Lease` para liberar o slot depois."""
+        self.acquire(priority, timeout)
+        return Lease(self, priority)
+
+    @contextmanager
+    def slot(self, priority: Priority = Priority.INTERACTIVE, timeout: float | None = None) -> Iterator[None]:
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    # --- API assíncrona ---
+    async def aacquire(self, priority: Priority = Priority.INTERACTIVE) -> None:
+        """Espera (sem bloquear o event loop) até obter um slot. Levanta QueueFullError."""
+        waiter = _Waiter(priority, loop=asyncio.get_running_loop())
+        with self._lock:
+            if self._enqueue(waiter):
+                return
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if not self._cancel(waiter):
+                    # Já havia sido concedido: devolve o slot para o próximo
+                    self._in_flight[priority] -= 1
+                    self._dispatch()
+            raise
+
+    async def alease(self, priority: Priority = Priority.INTERACTIVE) -> Lease:
+        """Como `aacquire`, mas retorna um `Lease` para liberar o slot depois."""
+        await self.aacquire(priority)
+        return Lease(self, priority)
+
+    @asynccontextmanager
+    async def aslot(self, priority: Priority = Priority.INTERACTIVE) -> AsyncIterator[None]:
+        await self.aacquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    # --- Métricas ---
+    def metrics(self) -> Dict[str, Any]:
+        """Retorna profundidade da fila, ocupação e tempos de espera por prioridade."""
+        with self._lock:
+            per_priority = {}
+            for p in Priority:
+                recent = sorted(self._recent_waits[p])
+                admitted = self._admitted[p]
+                per_priority[p.name.lower()] = {
+                    "queued": self._queued[p],
+                    "in_flight": self._in_flight[p],
+                    "admitted": admitted,
+                    "rejected": self._rejected[p],
+                    "wait_avg_s": self._wait_total[p] / admitted if admitted else 0.0,
+                    "wait_p95_s": recent[max(0, int(len(recent) * 0.95) - 1)] if recent else 0.0,
+                    "wait_max_s": self._wait_max[p],
+                }
+            return {
+                "backend": self.name,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "queue_depth": sum(self._queued.values()),
+                "in_flight": sum(self._in_flight.values()),
+                "priorities": per_priority,
+            }
+
+
+# --- Registro: um escalonador por backend (URL base) ---
+_schedulers: Dict[str, RequestScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(backend_url: str) -> RequestScheduler:
+    """Retorna o escalonador compartilhado do backend, criando-o na primeira chamada."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(backend_url)
+        if scheduler is None:
+            scheduler = RequestScheduler(name=backend_url)
+            _schedulers[backend_url] = scheduler
+            logging.info(f"Escalonador criado para {backend_url} (concorrência={scheduler.max_concurrency}, fila={scheduler.max_queue})")
+        return scheduler
+
+def all_scheduler_metrics() -> list[Dict[str, Any]]:
+    """Métricas de todos os backends conhecidos."""
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    return [scheduler.metrics() for scheduler in schedulers]
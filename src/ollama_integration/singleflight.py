@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, Generator, Iterator, Optional
+
+from src.ollama_integration.cancellation import CancelToken
+
+
+class _Call:
+    """Chamada sem stream em andamento: quem chega depois espera o mesmo resultado."""
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+
+
+class _StreamFlight:
+    """Stream em andamento compartilhado entre vários assinantes.
+
+    Não há thread extra: o assinante que está mais adiantado puxa o próximo chunk da
+    fonte (fora do lock) e os demais leem do buffer. Quem chega atrasado recebe primeiro
+    os chunks já produzidos.
+    """
+
+    def __init__(self):
+        self.abort = CancelToken() # Passado à chamada de origem: cancelado quando todos saem
+        self.ready = threading.Event() # Fonte criada (ou falhou)
+        self.source: Optional[Iterator[str]] = None
+        self.chunks: list[str] = []
+        self.finished = False
+        self.pulling = False
+        self.subscribers = 0 # Controlado pelo SingleFlight (sob o lock dele)
+        self.cond = threading.Condition()
+
+    def iterate(self, cancel: CancelToken | None = None) -> Generator[str, Any, None]:
+        index = 0
+        stopped = lambda: cancel is not None and cancel.cancelled
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.finished and self.pulling and not stopped():
+                    self.cond.wait()
+                if stopped():
+                    return # Só este assinante sai; o chunk que ele buscava fica para os outros
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                elif self.finished:
+                    return
+                else:
+                    self.pulling = True # Este assinante busca o próximo chunk
+                    chunk = None
+            if chunk is not None:
+                yield chunk
+                continue
+            produced = None
+            try:
+                produced = next(self.source, None)
+            except Exception:
+                logging.exception("Erro no stream compartilhado")
+            finally:
+                with self.cond:
+                    self.pulling = False
+                    if produced is None:
+                        self.finished = True
+                    else:
+                        self.chunks.append(produced)
+                    self.cond.notify_all()
+
+    def wake(self) -> None:
+        with self.cond:
+            self.cond.notify_all()
+
+    def close(self) -> None:
+        """Último assinante saiu: encerra a fonte se ela ainda não terminou."""
+        with self.cond:
+            abandoned = not self.finished
+            self.finished = True
+            self.cond.notify_all()
+        if abandoned:
+            # Derruba a conexão mesmo que um assinante esteja bloqueado dentro de next() agora
+            self.abort.cancel("todos os assinantes saíram")
+        if abandoned and hasattr(self.source, "close"):
+            try:
+                self.source.close()
+            except ValueError:
+                pass # Outro assinante está dentro de next() agora; a fonte termina sozinha
+
+
+class SingleFlight:
+    """Coalescência de requisições idênticas em andamento ("single-flight").
+
+    - `do(key, fn)`: a primeira chamada com `key` executa `fn`; chamadas com a mesma
+      chave que chegam enquanto ela roda esperam e recebem o mesmo resultado.
+    - `stream(key, fn, cancel)`: `fn(abort)` retorna um iterador de chunks (ou None em caso
+      de erro) e deve obedecer ao `CancelToken` `abort`; cada assinante recebe todos os
+      chunks, na ordem, a partir do início. O `cancel` de um assinante só encerra a
+      assinatura dele; quando todos desistem (cancelados, fechados ou coletados), `abort`
+      é cancelado e a fonte é fechada (a geração é interrompida).
+
+    A chave sai de circulação assim que a chamada termina: é coalescência, não cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            logging.info("Requisição idêntica em andamento; aguardando o mesmo resultado.")
+            call.done.wait()
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stream(self, key: str, fn: Callable[[CancelToken], Optional[Iterator[str]]],
+               cancel: CancelToken | None = None) -> Optional[Generator[str, Any, None]]:
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._streams[key] = _StreamFlight()
+                self._stats["leaders"] += 1
+            else:
+                self._stats["coalesced"] += 1
+            flight.subscribers += 1
+
+        left = threading.Lock() # Garante uma única saída por assinante (cancelamento vem de outra thread)
+        def leave() -> None:
+            if left.acquire(blocking=False):
+                if unregister is not None:
+                    unregister()
+                self._leave(key, flight)
+
+        def on_cancel() -> None:
+            leave()
+            flight.wake() # Acorda o assinante se ele estiver esperando outro buscar o próximo chunk
+
+        unregister = None
+        unregister = cancel.on_cancel(on_cancel) if cancel is not None else None
+        if leader:
+            try:
+                flight.source = fn(flight.abort)
+            finally:
+                flight.ready.set()
+        else:
+            logging.info("Stream idêntico em andamento; assinando os mesmos chunks.")
+            flight.ready.wait()
+        if flight.source is None or (cancel is not None and cancel.cancelled):
+            leave()
+            return None
+
+        def subscriber() -> Generator[str, Any, None]:
+            try:
+                yield from flight.iterate(cancel)
+            finally:
+                leave()
+        generator = subscriber()
+        # Um assinante descartado sem ser iterado também precisa sair
+        weakref.finalize(generator, leave)
+        return generator
+
+    def _leave(self, key: str, flight: _StreamFlight) -> None:
+        with self._lock:
+            flight.subscribers -= 1
+            last = flight.subscribers == 0
+            if last and self._streams.get(key) is flight:
+                del self._streams[key]
+        if last:
+            flight.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls) + len(self._streams)}
+
+
+class _AsyncStreamFlight:
+    """Stream assíncrono compartilhado: uma task lê a fonte e os assinantes leem do buffer.
+
+    A leitura fica numa task própria (e não com um dos assinantes) para que cancelar a
+    task de um assinante não interrompa a geração que os outros estão lendo.
+    """
+
+    def __init__(self):
+        self.abort = CancelToken() # Passado à chamada de origem: cancelado quando todos saem
+        self.chunks: list[str] = []
+        self.finished = False
+        self.subscribers = 0
+        self.cond = asyncio.Condition()
+        self.pump: asyncio.Task | None = None
+
+    async def run(self, source: AsyncIterator[str]) -> None:
+        try:
+            async for chunk in source:
+                async with self.cond:
+                    self.chunks.append(chunk)
+                    self.cond.notify_all()
+        except asyncio.CancelledError:
+            pass # Todos os assinantes saíram
+        except Exception:
+            logging.exception("Erro no stream assíncrono compartilhado")
+        finally:
+            await source.aclose()
+            async with self.cond:
+                self.finished = True
+                self.cond.notify_all()
+
+    async def wake(self) -> None:
+        async with self.cond:
+            self.cond.notify_all()
+
+    async def iterate(self, cancel: CancelToken | None) -> AsyncGenerator[str, None]:
+        index = 0
+        stopped = lambda: cancel is not None and cancel.cancelled
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(lambda: index < len(self.chunks) or self.finished or stopped())
+                if stopped():
+                    return
+                batch = self.chunks[index:]
+                index = len(self.chunks)
+            if not batch:
+                return # Fonte terminou
+            for chunk in batch:
+                yield chunk
+
+
+class AsyncSingleFlight:
+    """Coalescência de streams idênticos em andamento dentro de um event loop.
+
+    Contraparte assíncrona de `SingleFlight.stream`: `stream(key, fn, cancel)` chama
+    `fn(abort)` só para o primeiro assinante; `fn` devolve o iterador assíncrono da
+    chamada ao Ollama, que deve obedecer ao `CancelToken` `abort`. Cada assinante recebe
+    todos os chunks desde o início. O `cancel` de um assinante só encerra a assinatura
+    dele; quando o último sai (cancelado, fechado ou coletado), `abort` é cancelado e a
+    conexão com o Ollama é derrubada.
+    """
+
+    def __init__(self):
+        self._streams: Dict[str, _AsyncStreamFlight] = {}
+        self._stats = {"leaders": 0, "coalesced": 0}
+
+    async def stream(self, key: str, fn: Callable[[CancelToken], AsyncIterator[str]],
+                     cancel: CancelToken | None = None) -> AsyncGenerator[str, None]:
+        loop = asyncio.get_running_loop()
+        flight = self._streams.get(key)
+        if flight is None or flight.finished:
+            flight = self._streams[key] = _AsyncStreamFlight()
+            flight.pump = loop.create_task(flight.run(fn(flight.abort)))
+            self._stats["leaders"] += 1
+        else:
+            logging.info("Stream idêntico em andamento; assinando os mesmos chunks.")
+            self._stats["coalesced"] += 1
+        flight.subscribers += 1
+
+        left = False
+        def leave() -> None:
+            nonlocal left
+            if left:
+                return
+            left = True
+            flight.subscribers -= 1
+            if flight.subscribers == 0:
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+                if not flight.finished:
+                    flight.abort.cancel("todos os assinantes saíram")
+                    flight.pump.cancel()
+
+        def on_cancel() -> None:
+            # Pode vir de outra thread: acorda este assinante e sai no loop dele
+            def in_loop() -> None:
+                leave()
+                loop.create_task(flight.wake())
+            loop.call_soon_threadsafe(in_loop)
+
+        unregister = cancel.on_cancel(on_cancel) if cancel is not None else None
+        try:
+            async for chunk in flight.iterate(cancel):
+                yield chunk
+        finally:
+            if unregister is not None:
+                unregister()
+            leave()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._stats, "in_flight": len(self._streams)}
@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List
+
+# O Ollama reporta as durações em nanossegundos
+_NS = 1e9
+
+
+def _ns_to_s(value: Any) -> float | None:
+    return value / _NS if isinstance(value, (int, float)) else None
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[max(0, int(len(sorted_values) * fraction) - 1)] if sorted_values else 0.0
+
+
+class ChatTiming:
+    """Registro de tempos de uma chamada /api/chat.
+
+    Medido pelo cliente (segundos, relógio monotônico):
+        queue_wait_s: espera no escalonador até obter o slot.
+        ttft_s: do início da chamada até o primeiro chunk (só em stream; None sem stream).
+        total_s: do início da chamada até o fim da resposta.
+
+    Reportado pelo Ollama na mensagem final (convertido para segundos):
+        load_duration_s: carga do modelo na memória (≈0 se já estava residente).
+        prompt_eval_count / prompt_eval_duration_s: avaliação do prompt.
+        eval_count / eval_duration_s: geração dos tokens da resposta.
+        total_duration_s: tempo total no servidor.
+
+    Em um stream cancelado (`cancelled=True`), `eval_count` é o número de chunks
+    recebidos até o cancelamento (o Ollama envia um token por chunk).
+    """
+    __slots__ = ("_t0", "model", "backend", "priority", "stream", "cached", "cancelled", "ok", "started_at",
+                 "queue_wait_s", "ttft_s", "total_s", "load_duration_s", "prompt_eval_count",
+                 "prompt_eval_duration_s", "eval_count", "eval_duration_s", "total_duration_s")
+
+    def __init__(self, model: str, backend: str = "", priority: str = "", stream: bool = False):
+        self.model = model
+        self.backend = backend
+        self.priority = priority
+        self.stream = stream
+        self.cached = False
+        self.cancelled = False
+        self.ok = False
+        self.started_at = time.time() # Horário de parede, para correlacionar com logs
+        self._t0 = time.perf_counter()
+        self.queue_wait_s: float | None = None
+        self.ttft_s: float | None = None
+        self.total_s: float | None = None
+        self.load_duration_s: float | None = None
+        self.prompt_eval_count: int | None = None
+        self.prompt_eval_duration_s: float | None = None
+        self.eval_count: int | None = None
+        self.eval_duration_s: float | None = None
+        self.total_duration_s: float | None = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def mark_admitted(self) -> None:
+        """Chamado ao obter o slot do escalonador."""
+        self.queue_wait_s = self.elapsed()
+
+    def mark_first_token(self) -> None:
+        self.ttft_s = self.elapsed()
+
+    def finish(self, ok: bool) -> None:
+        self.ok = ok
+        self.total_s = self.elapsed()
+
+    def apply_ollama_metrics(self, final: Dict[str, Any] | None) -> None:
+        """Copia as métricas da mensagem final do Ollama (`done=True`)."""
+        if not final:
+            return
+        self.load_duration_s = _ns_to_s(final.get("load_duration"))
+        self.prompt_eval_count = final.get("prompt_eval_count")
+        self.prompt_eval_duration_s = _ns_to_s(final.get("prompt_eval_duration"))
+        self.eval_count = final.get("eval_count")
+        self.eval_duration_s = _ns_to_s(final.get("eval_duration"))
+        self.total_duration_s = _ns_to_s(final.get("total_duration"))
+
+    @property
+    def tokens_per_s(self) -> float | None:
+        """Velocidade de geração (tokens da resposta por segundo de geração)."""
+        if self.eval_count and self.eval_duration_s:
+            return self.eval_count / self.eval_duration_s
+        return None
+
+    @property
+    def prompt_tokens_per_s(self) -> float | None:
+        if self.prompt_eval_count and self.prompt_eval_duration_s:
+            return self.prompt_eval_count / self.prompt_eval_duration_s
+        return None
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in self.__slots__ if not name.startswith("_")}
+        data["tokens_per_s"] = self.tokens_per_s
+        data["prompt_tokens_per_s"] = self.prompt_tokens_per_s
+        return data
+
+    def summary(self) -> str:
+        """Linha curta para exibir na UI / logs."""
+        if self.cached:
+            return f"{self.model}: cache, {self.total_s or 0:.2f}s"
+        if self.cancelled:
+            return f"{self.model}: cancelado após {self.eval_count or 0} tokens, {self.total_s or 0:.2f}s"
+        parts = [f"{self.model}: total {self.total_s or 0:.2f}s"]
+        if self.ttft_s is not None:
+            parts.append(f"1º token {self.ttft_s:.2f}s")
+        if self.load_duration_s:
+            parts.append(f"carga {self.load_duration_s:.2f}s")
+        if self.prompt_eval_duration_s is not None:
+            parts.append(f"prompt {self.prompt_eval_duration_s:.2f}s ({self.prompt_eval_count or 0} tok)")
+        if self.tokens_per_s is not None:
+            parts.append(f"{self.tokens_per_s:.1f} tok/s")
+        return " | ".join(parts)
+
+
+class MetricsSink:
+    """Agrega os `ChatTiming` por modelo (thread-safe).
+
+    Guarda os `max_records` registros mais recentes e, por modelo, separa o tempo
+    médio de carga, avaliação do prompt e geração, para mostrar de onde vem a latência.
+    Listeners registrados com `subscribe` recebem cada registro (ex.: gravar em disco).
+    """
+
+    def __init__(self, max_records: int = 1000):
+        self._lock = threading.Lock()
+        self._records: deque[ChatTiming] = deque(maxlen=max_records)
+        self._listeners: List[Callable[[ChatTiming], None]] = []
+
+    def subscribe(self, listener: Callable[[ChatTiming], None]) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def record(self, timing: ChatTiming) -> None:
+        with self._lock:
+            self._records.append(timing)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(timing)
+            except Exception:
+                logging.exception("Erro em listener de métricas do Ollama")
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            records = list(self._records)[-limit:]
+        return [timing.as_dict() for timing in records]
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Resumo por modelo: chamadas, erros, cache, TTFT e decomposição da latência (médias em segundos)."""
+        with self._lock:
+            records = list(self._records)
+        by_model: Dict[str, List[ChatTiming]] = {}
+        for timing in records:
+            by_model.setdefault(timing.model, []).append(timing)
+
+        def avg(values):
+            values = [v for v in values if v is not None]
+            return sum(values) / len(values) if values else None
+
+        result = {}
+        for model, timings in by_model.items():
+            served = [t for t in timings if t.ok and not t.cached]
+            ttfts = sorted(t.ttft_s for t in served if t.ttft_s is not None)
+            cancelled = [t for t in timings if t.cancelled]
+            result[model] = {
+                "calls": len(timings),
+                "errors": sum(1 for t in timings if not t.ok and not t.cancelled),
+                "cached": sum(1 for t in timings if t.cached),
+                "cancelled": len(cancelled),
+                "tokens_saved_est": _tokens_saved(served, cancelled),
+                "queue_wait_avg_s": avg(t.queue_wait_s for t in served),
+                "ttft_avg_s": avg(ttfts),
+                "ttft_p95_s": _percentile(ttfts, 0.95) if ttfts else None,
+                "total_avg_s": avg(t.total_s for t in served),
+                "load_avg_s": avg(t.load_duration_s for t in served),
+                "prompt_eval_avg_s": avg(t.prompt_eval_duration_s for t in served),
+                "generation_avg_s": avg(t.eval_duration_s for t in served),
+                "tokens_per_s_avg": avg(t.tokens_per_s for t in served),
+            }
+        return result
+
+    def cancellations(self) -> Dict[str, Any]:
+        """Totais de gerações canceladas e tokens que deixaram de ser gerados (estimativa)."""
+        per_model = self.summary()
+        return {
+            "cancelled": sum(m["cancelled"] for m in per_model.values()),
+            "tokens_saved_est": sum(m["tokens_saved_est"] for m in per_model.values()),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+
+def _tokens_saved(completed: List[ChatTiming], cancelled: List[ChatTiming]) -> int:
+    """Estimativa: tamanho médio das respostas completas do modelo menos o já gerado no cancelamento."""
+    lengths = [t.eval_count for t in completed if t.eval_count]
+    if not cancelled or not lengths:
+        return 0
+    expected = sum(lengths) / len(lengths)
+    return int(sum(max(0.0, expected - (t.eval_count or 0)) for t in cancelled))
+
+
+def publish_timing(sink: MetricsSink, timing: ChatTiming, ok: bool,
+                   on_timing: Callable[[ChatTiming], None] | None = None) -> None:
+    """Fecha o registro da chamada, envia ao sink e ao callback `on_timing` do chamador."""
+    timing.finish(ok)
+    sink.record(timing)
+    logging.info(f"Telemetria Ollama: {timing.summary()}")
+    if on_timing:
+        try:
+            on_timing(timing)
+        except Exception:
+            logging.exception("Erro no callback on_timing")
+
+
+# --- Destino padrão compartilhado pelos clientes sync e async ---
+_default_sink = MetricsSink()
+
+def get_metrics_sink() -> MetricsSink:
+    """Retorna o MetricsSink do processo (usado quando o cliente não recebe outro)."""
+    return _default_sink
@@ -18,27 +18,34 @@ logger = logging.getLogger(__name__)
 # NOVO: Tentar importar a função de chat (lidar com erro se não existir)
 try:
     from src.ollama_integration.client import chat_completion
+    from src.ollama_integration.cache import ResponseCache
+    from src.ollama_integration.cancellation import CancelToken
+    from src.ollama_integration.scheduler import Priority
+    from src.core.schema_descriptions import request_ai_description
     OLLAMA_AVAILABLE = True
     logger.info("Integração Ollama carregada com sucesso.")
 except ImportError:
     OLLAMA_AVAILABLE = False
     logger.warning("src.ollama_integration.client não encontrado. Funcionalidades de IA estarão desabilitadas.")
     # Define uma função dummy para evitar erros NameError
-    def chat_completion(messages, stream=False):
+    def chat_completion(messages, stream=False, **kwargs):
         st.error("Integração Ollama não configurada/encontrada.")
         return None
 except Exception as e:
     OLLAMA_AVAILABLE = False
     logger.error(f"Erro inesperado ao importar Ollama: {e}")
-    def chat_completion(messages, stream=False):
+    def chat_completion(messages, stream=False, **kwargs):
         st.error(f"Erro na integração Ollama: {e}")
         return None
 
+from src.core.schema_descriptions import build_column_prompt, build_object_prompt, find_existing_description
+
 METADATA_FILE = 'etapas-sem-gpu/schema_metadata.json'
 TECHNICAL_SCHEMA_FILE = 'data/combined_schema_details.json' # NOVO: Carregar dados técnicos combinados
 OVERVIEW_COUNTS_FILE = 'data/overview_counts.json' # NOVO: Arquivo para contagens cacheadas
 # NOVO: Definir o nome do arquivo de saída do merge para usar na mensagem
 OUTPUT_COMBINED_FILE = 'data/combined_schema_details.json'
+AI_RESPONSE_CACHE_FILE = 'data/llm_response_cache.db' # Cache persistente das sugestões de IA
 
 # --- Configurações Padrão de Conexão (Podem ser sobrescritas na interface) ---
 DEFAULT_DB_PATH = r"C:\Projetos\DADOS.FDB" # Use raw string para evitar problemas com barras invertidas
@@ -133,6 +140,11 @@ def save_metadata(data, file_path):
         logger.exception(f"Erro inesperado ao salvar o JSON em {file_path}")
         return False
 
+@st.cache_resource # Uma instância por processo (sobrevive aos reruns do Streamlit)
+def get_ai_response_cache():
+    """Cache de respostas da IA (memória + disco) compartilhado entre sessões."""
+    return ResponseCache(path=AI_RESPONSE_CACHE_FILE)
+
 # --- Função para gerar descrição via IA (Adaptada de view_schema_app.py) ---
 def generate_ai_description(prompt):
     """Chama a API Ollama para gerar uma descrição e limpa a resposta."""
@@ -140,14 +152,18 @@ def generate_ai_description(prompt):
         st.warning("Funcionalidade de IA não disponível.")
         return None
         
-    logger.debug(f"Enviando prompt para IA: {prompt}")
-    messages = [{"role": "user", "content": prompt}]
+    # Um rerun (clique em outro botão, troca de página) interrompe o script na próxima
+    # atualização da tela; o cancelamento no finally faz o Ollama parar de gerar também
+    cancel = CancelToken()
+    preview = st.empty()
     try:
         with st.spinner("🧠 Pensando..."):
-            response = chat_completion(messages=messages, stream=False)
-        if response:
-            cleaned_response = response.strip().strip('"').strip('\'').strip()
-            logger.debug(f"Resposta da IA (limpa): {cleaned_response}")
+            cache = get_ai_response_cache() if st.session_state.get('ai_cache_enabled', True) else None
+            # Prioridade BATCH: turnos de chat interativos (app.py) passam na frente no mesmo backend
+            cleaned_response = request_ai_description(prompt, cache=cache, priority=Priority.BATCH, cancel=cancel,
+                                                      on_chunk=lambda partial: preview.caption(partial))
+        cancel = None
+        if cleaned_response:
             return cleaned_response
         else:
             logger.warning("Falha ao obter descrição da IA (resposta vazia).")
@@ -157,87 +173,10 @@ def generate_ai_description(prompt):
         logger.exception("Erro ao chamar a API Ollama:")
         st.error(f"Erro ao contatar a IA: {e}")
         return None
-
-# --- Função find_existing_description (Adaptada de view_schema_app.py) ---
-def find_existing_description(metadata, schema_data, current_object_name, target_col_name):
-    """
-    Procura por uma descrição existente para uma coluna:
-    1. Busca por nome exato em outras tabelas/views.
-    2. Se for FK, busca a descrição da PK referenciada.
-    3. Se for PK, busca a descrição de uma coluna FK que a referencie.
-    """
-    if not metadata or not schema_data or not target_col_name or not current_object_name:
-        return None, None # Retorna None para descrição e para a fonte
-
-    # 1. Busca por nome exato (prioridade)
-    for obj_type_key in ['TABLES', 'VIEWS', 'DESCONHECIDOS']:
-        for obj_name, obj_meta in metadata.get(obj_type_key, {}).items():
-            if obj_name == current_object_name: continue
-            col_meta = obj_meta.get('COLUMNS', {}).get(target_col_name)
-            if col_meta and col_meta.get('description', '').strip():
-                desc = col_meta['description']
-                source = f"nome exato em `{obj_name}`"
-                logger.debug(f"Heurística: Descrição encontrada por {source} para {current_object_name}.{target_col_name}")
-                return desc, source
-
-    # Se não achou por nome exato, tenta via FKs (precisa do schema_data técnico)
-    current_object_info = schema_data.get(current_object_name)
-    if not current_object_info:
-        logger.warning(f"Schema técnico não encontrado para {current_object_name} ao buscar heurística FK.")
-        return None, None
-    
-    current_constraints = current_object_info.get('constraints', {})
-    current_pk_cols = [col for pk in current_constraints.get('primary_key', []) for col in pk.get('columns', [])]
-
-    # 2. Busca Direta (Se target_col é FK)
-    for fk in current_constraints.get('foreign_keys', []):
-        fk_columns = fk.get('columns', [])
-        ref_table = fk.get('references_table')
-        ref_columns = fk.get('references_columns', [])
-        if target_col_name in fk_columns and ref_table and ref_columns:
-            try:
-                idx = fk_columns.index(target_col_name)
-                ref_col_name = ref_columns[idx]
-                # Busca descrição da PK referenciada
-                ref_object_info = schema_data.get(ref_table) # Precisa info técnica da tabela referenciada
-                if not ref_object_info:
-                     logger.warning(f"Schema técnico não encontrado para tabela referenciada {ref_table}")
-                     continue
-                ref_obj_type = ref_object_info.get('object_type', 'TABLE')
-                ref_obj_type_key = ref_obj_type + "S"
-                
-                ref_col_meta = metadata.get(ref_obj_type_key, {}).get(ref_table, {}).get('COLUMNS', {}).get(ref_col_name)
-                if ref_col_meta and ref_col_meta.get('description', '').strip():
-                    desc = ref_col_meta['description']
-                    source = f"chave estrangeira para `{ref_table}.{ref_col_name}`"
-                    logger.debug(f"Heurística: Descrição encontrada por {source} para {current_object_name}.{target_col_name}")
-                    return desc, source
-            except (IndexError, ValueError): continue
-
-    # 3. Busca Inversa (Se target_col é PK)
-    if target_col_name in current_pk_cols:
-        for other_obj_name, other_obj_info in schema_data.items():
-            if other_obj_name == current_object_name: continue
-            other_constraints = other_obj_info.get('constraints', {})
-            for other_fk in other_constraints.get('foreign_keys', []):
-                 if other_fk.get('references_table') == current_object_name and \
-                    target_col_name in other_fk.get('references_columns', []):
-                     referencing_columns = other_fk.get('columns', [])
-                     ref_pk_columns = other_fk.get('references_columns', [])
-                     try:
-                         idx_pk = ref_pk_columns.index(target_col_name)
-                         referencing_col_name = referencing_columns[idx_pk]
-                         other_obj_type = other_obj_info.get('object_type', 'TABLE')
-                         other_obj_type_key = other_obj_type + "S"
-                         other_col_meta = metadata.get(other_obj_type_key, {}).get(other_obj_name, {}).get('COLUMNS', {}).get(referencing_col_name)
-                         if other_col_meta and other_col_meta.get('description', '').strip():
-                             desc = other_col_meta['description']
-                             source = f"coluna `{referencing_col_name}` em `{other_obj_name}` (ref. esta PK)"
-                             logger.debug(f"Heurística: Descrição encontrada por {source} para {current_object_name}.{target_col_name}")
-                             return desc, source
-                     except (IndexError, ValueError): continue
-
-    return None, None # Nenhuma descrição encontrada
+    finally:
+        if cancel is not None:
+            cancel.cancel("execução do Streamlit interrompida")
+        preview.empty()
 
 # --- Função get_column_concept (Adaptada de view_schema_app.py) ---
 def get_column_concept(schema_data, obj_name, col_name):
@@ -508,6 +447,8 @@ metadata_dict = st.session_state.metadata # Referência local
 # NOVO: Inicializar estado para Ollama
 if 'ollama_enabled' not in st.session_state:
     st.session_state.ollama_enabled = False # MUDANÇA: Padrão para desabilitado
+if 'ai_cache_enabled' not in st.session_state:
+    st.session_state.ai_cache_enabled = True
 
 # --- Barra Lateral --- 
 st.sidebar.title("Navegação e Ações")
@@ -591,6 +532,10 @@ st.sidebar.divider()
 st.sidebar.subheader("Configurações")
 if OLLAMA_AVAILABLE:
     st.sidebar.toggle("Habilitar Sugestões IA (Ollama)", key='ollama_enabled', help="Desabilitar pode melhorar a performance se não precisar das sugestões.")
+    st.sidebar.toggle("Reutilizar sugestões em cache", key='ai_cache_enabled', help="Repete a sugestão já gerada para o mesmo prompt em vez de gerar de novo. Desative para pedir uma sugestão nova.")
+    if st.session_state.get('ai_cache_enabled'):
+        cache_stats = get_ai_response_cache().stats()
+        st.sidebar.caption(f"Cache IA: {cache_stats['memory_hits'] + cache_stats['disk_hits']} acertos, {cache_stats['misses']} faltas, {cache_stats.get('disk_entries', 0)} respostas salvas.")
 else:
     st.sidebar.caption("Sugestões IA (Ollama) indisponíveis.")
 # --- FIM: Toggle --- 
@@ -768,7 +713,7 @@ elif app_mode == "Editar Metadados":
                 with btn_ai_obj_area:
                     if st.button("Sugerir IA", key=f"btn_ai_obj_{selected_object}", use_container_width=True, disabled=not OLLAMA_AVAILABLE or not st.session_state.get('ollama_enabled', True)):
                         # Adapta prompt para objeto
-                        prompt_object = f"Sugira descrição concisa pt-br para o objeto de banco de dados '{selected_object}' (tipo: {selected_object_technical_type}). Propósito? Responda só descrição."
+                        prompt_object = build_object_prompt(selected_object, selected_object_technical_type)
                         suggestion = generate_ai_description(prompt_object)
                         if suggestion:
                              st.session_state.metadata[metadata_key_type][selected_object]['description'] = suggestion
@@ -873,7 +818,7 @@ elif app_mode == "Editar Metadados":
 
                             with btns_col_area:
                                 if st.button("Sugerir IA", key=f"btn_ai_col_{col_name}", use_container_width=True, disabled=not OLLAMA_AVAILABLE or not st.session_state.get('ollama_enabled', True)):
-                                    prompt_column = (f"Sugira descrição concisa pt-br para coluna '{col_name}' ({col_type}) do objeto '{selected_object}'. Significado? Responda só descrição.")
+                                    prompt_column = build_column_prompt(selected_object, col_name, col_type)
                                     suggestion = generate_ai_description(prompt_column)
                                     if suggestion:
                                         st.session_state.metadata[metadata_key_type][selected_object]['COLUMNS'][col_name]['description'] = suggestion
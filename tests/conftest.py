@@ -0,0 +1,15 @@
+# Fixtures compartilhadas pelos testes
+
+import pytest
+
+from src.database import history
+from src.database.history import ConnectionManager
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    """Banco do histórico temporário no lugar do padrão (history.get_db_connection e afins)."""
+    manager = ConnectionManager(path=str(tmp_path / "history.db"))
+    monkeypatch.setattr(history, "_default_manager", manager)
+    history.init_db()
+    yield manager
+    manager.close_all()
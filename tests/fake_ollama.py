@@ -0,0 +1,213 @@
+# Servidor HTTP local que imita a API do Ollama (usado em testes e benchmarks)
+
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _ThreadingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512 # Aceita rajadas de conexões simultâneas sem SYN perdido
+
+    def handle_error(self, request, client_address):
+        # Cliente que desiste no meio do stream (cancelamento, timeout) não é erro do servidor
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FakeOllamaServer:
+    """Servidor "stand-in" do Ollama rodando em uma thread local.
+
+    Responde em /api/chat (com e sem stream), /api/embed, /api/tags, /api/ps e /api/generate
+    (só carga/descarga de modelo, como o Ollama faz sem `prompt`) usando HTTP/1.1 com
+    keep-alive, simula quais modelos estão carregados na memória e conta quantas conexões TCP foram abertas e quantas requisições
+    chegaram em cada rota.
+
+    Uso:
+        with FakeOllamaServer(reply="Olá mundo") as server:
+            client = OllamaClient(api_url=server.chat_url)
+    """
+
+    def __init__(self, reply: str = "Resposta simulada.", models: list | None = None, chunk_delay: float = 0.0):
+        self.reply = reply
+        self.models = models if models is not None else ["llama3"]
+        self.chunk_delay = chunk_delay
+        self.fail_next = 0 # Próximas N chamadas /api/chat respondem HTTP 503
+        self.load_delay = 0.0 # Tempo simulado para carregar um modelo que não está residente
+        self.loaded: dict[str, object] = {} # Modelos residentes -> último keep_alive recebido
+        self.expires_at: dict[str, str] = {} # expires_at informado em /api/ps (padrão: daqui a 5 minutos)
+        self.connections = 0
+        self.requests_by_path: dict[str, int] = {}
+        self.last_payload: dict | None = None
+        self.aborted_streams = 0 # Streams em que o cliente fechou a conexão antes do fim
+        self.embed_inputs = 0 # Total de textos recebidos em /api/embed
+        self.embed_delay = 0.0 # Tempo simulado por requisição /api/embed
+        self._lock = threading.Lock()
+        self._httpd = _ThreadingServer(("127.0.0.1", 0), self._make_handler())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.base_url}/api/chat"
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def final_metrics(self) -> dict:
+        """Métricas da mensagem final (durações em nanossegundos, como o Ollama real)."""
+        tokens = len(self.reply.split(" "))
+        return {
+            "total_duration": 600_000_000,
+            "load_duration": 100_000_000,
+            "prompt_eval_count": 12,
+            "prompt_eval_duration": 200_000_000,
+            "eval_count": tokens,
+            "eval_duration": 250_000_000,
+        }
+
+    def _load(self, model: str, keep_alive) -> float:
+        """Marca o modelo como residente; retorna o tempo de carga simulado (s)."""
+        with self._lock:
+            already_loaded = model in self.loaded
+            self.loaded[model] = keep_alive
+        if already_loaded:
+            return 0.0
+        if self.load_delay:
+            time.sleep(self.load_delay)
+        return self.load_delay
+
+    def _count(self, path: str) -> None:
+        with self._lock:
+            self.requests_by_path[path] = self.requests_by_path.get(path, 0) + 1
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Necessário para keep-alive
+            disable_nagle_algorithm = True # Como o servidor Go do Ollama (TCP_NODELAY)
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, format, *args):
+                pass # Silencia o log padrão do http.server
+
+            def _send_json(self, data: dict, status: int = 200) -> None:
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                server._count(self.path)
+                if self.path == "/api/tags":
+                    self._send_json({"models": [{"name": name} for name in server.models]})
+                elif self.path == "/api/ps":
+                    with server._lock:
+                        default_expiry = (datetime.now(timezone.utc) + timedelta(minutes=5)).isoformat()
+                        running = [{"name": name, "model": name, "expires_at": server.expires_at.get(name, default_expiry)}
+                                   for name in server.loaded]
+                    self._send_json({"models": running})
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                server._count(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                server.last_payload = payload
+                if self.path == "/api/generate" and not payload.get("prompt"):
+                    model = payload.get("model", "llama3")
+                    if payload.get("keep_alive") in (0, "0", "0s"):
+                        with server._lock:
+                            server.loaded.pop(model, None)
+                        self._send_json({"model": model, "response": "", "done": True, "done_reason": "unload"})
+                    else:
+                        load_seconds = server._load(model, payload.get("keep_alive"))
+                        self._send_json({"model": model, "response": "", "done": True, "done_reason": "load",
+                                         "load_duration": int(load_seconds * 1e9)})
+                    return
+                if self.path == "/api/embed":
+                    texts = payload.get("input", [])
+                    texts = [texts] if isinstance(texts, str) else texts
+                    with server._lock:
+                        server.embed_inputs += len(texts)
+                    if server.embed_delay:
+                        time.sleep(server.embed_delay)
+                    # Vetor determinístico por texto: [tamanho, soma dos códigos, 1.0]
+                    embeddings = [[float(len(t)), float(sum(map(ord, t))), 1.0] for t in texts]
+                    self._send_json({"model": payload.get("model"), "embeddings": embeddings})
+                    return
+                if self.path != "/api/chat":
+                    self._send_json({"error": "not found"}, status=404)
+                    return
+
+                with server._lock:
+                    failing = server.fail_next > 0
+                    server.fail_next -= failing
+                if failing:
+                    self._send_json({"error": "servidor sobrecarregado"}, status=503)
+                    return
+
+                model = payload.get("model", "llama3")
+                server._load(model, payload.get("keep_alive"))
+                if not payload.get("stream", True):
+                    self._send_json({
+                        "model": model,
+                        "message": {"role": "assistant", "content": server.reply},
+                        "done": True,
+                        **server.final_metrics(),
+                    })
+                    return
+
+                # Stream NDJSON com Transfer-Encoding: chunked (mantém a conexão reutilizável)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for word in server.reply.split(" "):
+                        if server.chunk_delay:
+                            time.sleep(server.chunk_delay)
+                        line = {"model": model, "message": {"role": "assistant", "content": word + " "}, "done": False}
+                        self._send_chunk(json.dumps(line).encode("utf-8") + b"\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # Como o Ollama: cliente desconectado interrompe a geração
+                    with server._lock:
+                        server.aborted_streams += 1
+                    self.close_connection = True
+                    return
+                final = {"model": model, "message": {"role": "assistant", "content": ""}, "done": True, **server.final_metrics()}
+                self._send_chunk(json.dumps(final).encode("utf-8") + b"\n")
+                self._send_chunk(b"")
+
+        return Handler
@@ -0,0 +1,99 @@
+# Testes do reaproveitamento de respostas bem avaliadas (índice vetorial de perguntas)
+
+from array import array
+
+import pytest
+
+from src.core.answer_reuse import AnswerIndex, normalize_question
+from src.database import history
+from src.database.history import ConnectionManager
+from src.ollama_integration.client import EmbeddingResult
+
+VOCABULARY = ["clientes", "pedidos", "colunas", "tabela", "chave", "itens", "datas"]
+
+
+class FakeEmbedder:
+    """Saco de palavras do vocabulário: perguntas com as mesmas palavras-chave ficam próximas."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts, model=None, priority=None):
+        self.calls.append((list(texts), priority))
+        data = array("f")
+        for text in texts:
+            words = normalize_question(text).split()
+            data.extend([float(words.count(word)) for word in VOCABULARY] + [0.1])
+        return EmbeddingResult(model or "fake", len(VOCABULARY) + 1, data, array("I", range(len(texts))), 1, 0.0)
+
+
+@pytest.fixture
+def index():
+    return AnswerIndex(threshold=0.9, min_words=3, embedder=FakeEmbedder(), enabled=True)
+
+def test_similar_question_reuses_answer(index):
+    index.record_feedback(1, 1, "Quais colunas tem a tabela clientes?", "ID, NOME, EMAIL")
+    index.record_feedback(2, 1, "Quais colunas tem a tabela pedidos?", "ID, DATA, CLIENTE_ID")
+    match = index.lookup("me diga as colunas da tabela clientes")
+    assert match["message_id"] == 1 and match["answer"] == "ID, NOME, EMAIL" and not match["exact"]
+    assert match["score"] >= 0.9
+    assert index.lookup("qual a chave da tabela itens") is None # Abaixo do limiar
+    assert index.lookup("e pedidos?") is None # Curta demais: depende do contexto
+
+def test_exact_question_skips_embedding(index):
+    index.record_feedback(1, 1, "Quais colunas tem a tabela clientes?", "ID, NOME")
+    calls = len(index._embedder.calls)
+    match = index.lookup("  quais colunas   tem a tabela CLIENTES ")
+    assert match["exact"] and match["score"] == 1.0
+    assert len(index._embedder.calls) == calls
+
+def test_thumbs_down_removes_and_blocks_pending_add(index):
+    for i, table in enumerate(["clientes", "pedidos", "itens"], start=1):
+        index.record_feedback(i, 1, f"Quais colunas tem a tabela {table}?", f"resposta {i}")
+    index.record_feedback(1, -1)
+    assert len(index) == 2
+    assert index.lookup("Quais colunas tem a tabela clientes?") is None
+    assert index.lookup("Quais colunas tem a tabela itens?")["answer"] == "resposta 3" # Linha movida continua certa
+    index.record_feedback(4, -1)
+    index.record_feedback(4, 1, "Quais colunas tem a tabela datas?", "resposta 4") # 👍 depois do 👎 volta a valer
+    assert len(index) == 3
+
+def test_status_tracks_hit_rate_and_saved_time(index):
+    index.record_feedback(1, 1, "Quais colunas tem a tabela clientes?", "ID, NOME")
+    index.record_generation(4.0)
+    index.lookup("quais colunas tem a tabela clientes")
+    index.lookup("qual a chave da tabela pedidos")
+    status = index.status()
+    assert status["lookups"] == 2 and status["hits"] == 1 and status["hit_rate"] == 0.5
+    assert status["avg_generation_s"] == 4.0 and 3.9 < status["estimated_saved_s"] <= 4.0
+
+def test_answers_are_keyed_by_model(index):
+    index.record_feedback(1, 1, "Quais colunas tem a tabela clientes?", "ID, NOME", model="llama3")
+    calls = len(index._embedder.calls)
+    assert index.lookup("Quais colunas tem a tabela clientes?", "phi3") is None
+    assert len(index._embedder.calls) == calls # Nenhuma resposta do phi3: nem vetoriza
+    index.record_feedback(2, 1, "Quais colunas tem a tabela pedidos?", "ID, DATA", model="phi3")
+    assert index.lookup("me diga as colunas da tabela clientes", "phi3") is None # Só a do llama3 é parecida
+    assert index.lookup("me diga as colunas da tabela clientes", "llama3")["message_id"] == 1
+    assert index.lookup("quais colunas tem a tabela pedidos", "phi3")["exact"]
+
+def test_load_reads_positive_feedback_from_history(tmp_path, monkeypatch, index):
+    manager = ConnectionManager(path=str(tmp_path / "history.db"))
+    monkeypatch.setattr(history, "_default_manager", manager)
+    liked = history.save_chat_message("Quais colunas tem a tabela clientes?", "ID, NOME", session_id="s",
+                                      metrics={"model": "llama3", "status": "ok"})
+    disliked = history.save_chat_message("Quais colunas tem a tabela pedidos?", "não sei", session_id="s1")
+    follow_up = history.save_chat_message("Quais colunas tem a tabela itens?", "ID", session_id="s") # 2º turno
+    history.update_feedback(follow_up, 1)
+    reused = history.save_chat_message("colunas da tabela clientes", "ID, NOME", session_id="s2",
+                                       metrics={"status": "reused"})
+    history.update_feedback(liked, 1)
+    history.update_feedback(disliked, -1)
+    history.update_feedback(reused, 1) # 👍 na cópia reaproveitada: não entra de novo
+    assert index.load(batch_size=1) == 1
+    assert index.lookup("colunas da tabela clientes", "llama3")["message_id"] == liked
+    assert index.lookup("colunas da tabela itens", "llama3") is None
+    later = history.save_chat_message("Quais itens tem a tabela pedidos?", "ID, QTD", session_id="s3")
+    history.update_feedback(later, 1)
+    assert index.load() == 1 and len(index) == 2 # Só o que entrou depois da última carga
+    manager.close_all()
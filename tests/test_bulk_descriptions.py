@@ -0,0 +1,73 @@
+# Testes do job de geração de descrições em lote
+
+import json
+
+from src.core.bulk_descriptions import BulkDescriptionJob, build_tasks, load_progress
+
+TECHNICAL_SCHEMA = {
+    "CLIENTES": {
+        "object_type": "TABLE",
+        "columns": [{"name": "CLI_CODIGO", "type": "INTEGER"}, {"name": "CLI_NOME", "type": "VARCHAR(60)"}],
+        "constraints": {"primary_key": [{"columns": ["CLI_CODIGO"]}], "foreign_keys": []},
+    },
+    "PEDIDOS": {
+        "object_type": "TABLE",
+        "columns": [{"name": "PED_CLIENTE", "type": "INTEGER"}, {"name": "PED_VALOR", "type": "NUMERIC(15,2)"}],
+        "constraints": {"primary_key": [], "foreign_keys": [
+            {"columns": ["PED_CLIENTE"], "references_table": "CLIENTES", "references_columns": ["CLI_CODIGO"]}]},
+    },
+    "PROC_X": {"object_type": "PROCEDURE", "columns": []},
+}
+METADATA = {
+    "TABLES": {
+        "CLIENTES": {"description": "Cadastro de clientes", "COLUMNS": {
+            "CLI_CODIGO": {"description": "Código do cliente"}, "CLI_NOME": {"description": ""}}},
+    }
+}
+
+def test_build_tasks_skips_curated_descriptions():
+    tasks = build_tasks(["CLIENTES", "PEDIDOS", "PROC_X", "INEXISTENTE"], TECHNICAL_SCHEMA, METADATA)
+    assert [t["id"] for t in tasks] == ["CLIENTES.CLI_NOME", "PEDIDOS", "PEDIDOS.PED_CLIENTE", "PEDIDOS.PED_VALOR"]
+
+def test_job_writes_review_queue_and_never_touches_metadata(tmp_path):
+    review, progress = tmp_path / "review.jsonl", tmp_path / "progress.jsonl"
+    prompts = []
+    def fake_ai(prompt, cache=None, model=None):
+        prompts.append(prompt)
+        return "Sugestão da IA"
+
+    job = BulkDescriptionJob(TECHNICAL_SCHEMA, METADATA, str(review), str(progress), max_workers=2, ai_describe=fake_ai)
+    counts = job.run(["CLIENTES", "PEDIDOS"])
+
+    assert counts == {"suggested": 4, "empty": 0, "failed": 0}
+    entries = {e["id"]: e for e in map(json.loads, review.read_text(encoding="utf-8").splitlines())}
+    # FK para CLIENTES.CLI_CODIGO: resolvida pela heurística, sem chamar a IA
+    assert entries["PEDIDOS.PED_CLIENTE"]["suggestion"] == "Código do cliente"
+    assert entries["PEDIDOS.PED_CLIENTE"]["source"].startswith("heuristica")
+    assert entries["PEDIDOS.PED_VALOR"]["source"] == "ia"
+    assert len(prompts) == 3
+    assert METADATA["TABLES"]["CLIENTES"]["COLUMNS"]["CLI_NOME"]["description"] == ""
+
+def test_job_resumes_after_crash_and_retries_failures(tmp_path):
+    review, progress = tmp_path / "review.jsonl", tmp_path / "progress.jsonl"
+    def flaky_ai(prompt, cache=None, model=None):
+        if "PED_VALOR" in prompt:
+            raise RuntimeError("Ollama fora do ar")
+        return "ok"
+
+    first = BulkDescriptionJob(TECHNICAL_SCHEMA, METADATA, str(review), str(progress), max_workers=1, ai_describe=flaky_ai)
+    assert first.run(["CLIENTES", "PEDIDOS"])["failed"] == 1
+    # Simula queda no meio da escrita da última linha
+    with open(progress, "a", encoding="utf-8") as f:
+        f.write('{"task": "PEDI')
+
+    calls = []
+    def healthy_ai(prompt, cache=None, model=None):
+        calls.append(prompt)
+        return "ok"
+    second = BulkDescriptionJob(TECHNICAL_SCHEMA, METADATA, str(review), str(progress), max_workers=1, ai_describe=healthy_ai)
+    counts = second.run(["CLIENTES", "PEDIDOS"])
+
+    assert counts == {"suggested": 1, "empty": 0, "failed": 0}
+    assert len(calls) == 1 and "PED_VALOR" in calls[0]
+    assert set(load_progress(str(progress)).values()) == {"suggested"}
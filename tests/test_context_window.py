@@ -0,0 +1,49 @@
+# Testes do gerenciador de janela de contexto (orçamento de tokens + resumo em cache)
+
+from src.core.context_window import ContextWindowManager, count_tokens
+
+def make_history(n):
+    return [(f"Pergunta {i} sobre a tabela T{i} " + "x" * 200, f"Resposta {i} " + "y" * 200) for i in range(n)]
+
+def test_count_tokens_is_cached():
+    count_tokens.cache_clear()
+    assert count_tokens("CLIENTES tem 12 colunas") == count_tokens("CLIENTES tem 12 colunas") > 0
+    assert count_tokens.cache_info().hits == 1
+
+def test_prompt_size_stays_flat_as_history_grows():
+    manager = ContextWindowManager(budget=600, summarizer=None)
+    sizes = [manager.count(manager.build("s", make_history(n), "E agora?")) for n in (5, 50, 500)]
+    assert max(sizes) <= 600
+    assert max(sizes) - min(sizes) < 20 # Não cresce com a conversa (só varia o número de dígitos)
+
+    messages = manager.build("s", make_history(50), "E agora?")
+    assert messages[-1] == {"role": "user", "content": "E agora?"}
+    assert messages[-2]["content"].startswith("Resposta 49") # Turnos mais recentes primeiro
+
+def test_budget_per_model_and_relevant_old_turns():
+    manager = ContextWindowManager(budget=600, budgets={"llama3": 3000}, summarizer=None)
+    assert manager.budget_for("llama3:8b") == 3000 and manager.budget_for("phi3") == 600
+
+    history = make_history(30)
+    history[2] = ("Quais colunas tem a tabela FORNECEDORES_ATIVOS?", "FORN_CODIGO e FORN_NOME.")
+    messages = manager.build("s", history, "Mostre de novo as colunas de FORNECEDORES_ATIVOS")
+    # Turno antigo, mas relacionado à pergunta: volta num trecho logo antes da mensagem atual
+    assert messages[-2]["role"] == "system" and "FORN_CODIGO e FORN_NOME." in messages[-2]["content"]
+    assert messages[-3]["content"].startswith("Resposta 29") # A janela continua em ordem cronológica
+
+def test_dropped_turns_are_summarized_in_background_and_reused():
+    calls = []
+    def fake_summarizer(previous, turns, model):
+        calls.append((previous, len(turns)))
+        return f"resumo de {len(turns)} turnos"
+
+    manager = ContextWindowManager(budget=600, summarizer=fake_summarizer, summary_every=4)
+    history = make_history(10)
+    first = manager.build("s", history, "Oi")
+    assert first[0]["role"] == "user" # Resumo ainda não existe: o turno não espera por ele
+    manager.wait_for_summary("s", timeout=5)
+
+    second = manager.build("s", history, "Oi")
+    assert second[0]["role"] == "system" and second[0]["content"].endswith("resumo de 8 turnos")
+    assert manager.count(second) <= 600
+    assert calls == [("", 8)] # A janela recomeça com 60% do orçamento: 2 turnos
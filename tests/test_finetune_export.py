@@ -0,0 +1,82 @@
+# Testes da exportação incremental do histórico para fine-tuning
+
+import json
+from datetime import datetime
+
+from src.database import history
+from src.database.finetune_export import export_finetune_data, iter_sessions
+
+NOW = datetime(2025, 6, 1, 12, 0, 0)
+
+def add(conn, session_id, n, minute, feedback=None, user=None):
+    with conn:
+        conn.execute("INSERT INTO chat_history(session_id, timestamp, user_message, assistant_message, feedback) "
+                     "VALUES(?,?,?,?,?)", (session_id, f"2025-06-01 {minute // 60:02d}:{minute % 60:02d}:00",
+                                          user if user is not None else f"p{n}", f"r{n}", feedback))
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return [[m["content"] for m in json.loads(line)["messages"]] for line in f]
+
+def test_sessions_stream_in_order_with_sql_filters(manager):
+    conn = manager.connection()
+    for n, (session, feedback) in enumerate([("a", 1), ("b", 1), ("a", None), ("b", 1), ("a", 1), ("c", 1)]):
+        add(conn, session, n, 60 + n, feedback)
+    add(conn, "b", 9, 70, 1, user="") # Sem pergunta: ignorada
+    sessions = list(iter_sessions(conn))
+    assert [(s, len(m)) for s, m, _, _ in sessions] == [("a", 3), ("b", 2)] # "c" tem 1 turno só
+    assert [m for s, m, _, _ in iter_sessions(conn, positive_only=True) if s == "a"] == [[("p0", "r0"), ("p4", "r4")]]
+
+def test_incremental_export_appends_new_and_changed_sessions(manager, tmp_path):
+    conn = manager.connection()
+    output = str(tmp_path / "finetune.jsonl")
+    add(conn, "a", 0, 60); add(conn, "a", 1, 61)
+    add(conn, "b", 2, 62); add(conn, "b", 3, 63)
+    add(conn, "ativa", 4, 700); add(conn, "ativa", 5, 701) # 11:40: ainda não assentou (30 min)
+
+    first = export_finetune_data(output, now=NOW)
+    assert first["mode"] == "rebuild" and first["sessions"] == 2
+    assert read(output) == [["p0", "r0", "p1", "r1"], ["p2", "r2", "p3", "r3"]]
+
+    assert export_finetune_data(output, now=NOW)["sessions"] == 0 # Nada novo
+
+    add(conn, "c", 6, 120); add(conn, "c", 7, 121)
+    add(conn, "a", 8, 122) # Sessão já exportada que mudou
+    later = datetime(2025, 6, 1, 13, 0, 0)
+    second = export_finetune_data(output, now=later)
+    assert second["mode"] == "incremental" and second["superseded"] == 1
+    assert read(output)[2:] == [["p0", "r0", "p1", "r1", "p8", "r8"], ["p4", "r4", "p5", "r5"], ["p6", "r6", "p7", "r7"]]
+
+    # Execução interrompida: a cauda escrita depois do último estado salvo é descartada
+    with open(output, "a", encoding="utf-8") as f:
+        f.write('{"messages": [parcial\n')
+    assert export_finetune_data(output, now=later)["sessions"] == 0
+    assert len(read(output)) == 5
+
+    rebuilt = export_finetune_data(output, rebuild=True, now=later)
+    assert rebuilt["sessions"] == 4 and len(read(output)) == 4
+
+def test_changing_filters_rebuilds(manager, tmp_path):
+    conn = manager.connection()
+    output = str(tmp_path / "finetune.jsonl")
+    add(conn, "a", 0, 60, 1); add(conn, "a", 1, 61); add(conn, "a", 2, 62, 1)
+    export_finetune_data(output, now=NOW)
+    report = export_finetune_data(output, positive_only=True, now=NOW)
+    assert report["mode"] == "rebuild"
+    assert read(output) == [["p0", "r0", "p2", "r2"]]
+
+def test_failed_rebuild_drops_stale_state(manager, tmp_path, monkeypatch):
+    conn = manager.connection()
+    output = str(tmp_path / "finetune.jsonl")
+    add(conn, "a", 0, 60); add(conn, "a", 1, 61); add(conn, "b", 2, 62); add(conn, "b", 3, 63)
+    export_finetune_data(output, now=NOW)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("banco indisponível")
+        yield
+    monkeypatch.setattr("src.database.finetune_export.iter_sessions", broken)
+    assert export_finetune_data(output, rebuild=True, now=NOW) is None # Arquivo já truncado
+    monkeypatch.undo()
+    monkeypatch.setattr(history, "_default_manager", manager)
+    report = export_finetune_data(output, now=NOW) # Sem estado velho: refaz em vez de "continuar" do tamanho antigo
+    assert report["mode"] == "rebuild" and len(read(output)) == 2
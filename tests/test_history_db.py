@@ -0,0 +1,258 @@
+# Testes do histórico de chat (src/database/history.py) em um banco temporário
+
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from src.database import history
+from src.database.history import ConnectionManager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_connection_is_persistent_per_thread_and_uses_wal(manager):
+    conn = history.get_db_connection()
+    assert history.get_db_connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1 # NORMAL
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == manager.busy_timeout_ms
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(history.get_db_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+    assert manager.status()["opened_total"] == 2
+
+def test_save_and_feedback_reuse_the_connection(manager):
+    first = history.save_chat_message("Oi", "Olá!", session_id="s1")
+    second = history.save_chat_message("Tudo bem?", "Sim.", session_id="s1")
+    history.update_feedback(second, 1)
+    assert second == first + 1
+    rows = history.get_db_connection().execute("SELECT id, feedback FROM chat_history ORDER BY id").fetchall()
+    assert [tuple(row) for row in rows] == [(first, None), (second, 1)]
+    assert manager.status()["opened_total"] == 1
+
+def test_concurrent_writers(manager):
+    def writer(n):
+        for i in range(25):
+            assert history.save_chat_message(f"pergunta {n}-{i}", "resposta", session_id=str(n)) is not None
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert history.get_db_connection().execute("SELECT COUNT(*) FROM chat_history").fetchone()[0] == 200
+
+def test_close_all_reopens_on_next_use(manager):
+    conn = history.get_db_connection()
+    manager.close_all()
+    assert history.get_db_connection() is not conn
+    assert history.save_chat_message("Oi", "Olá!") is not None
+
+def test_writer_takes_ids_from_the_db_and_batches_writes(manager):
+    first = history.save_chat_message("antes", "do writer")
+    writer = history.HistoryWriter(manager=manager, batch_size=50)
+    futures = [writer.save_chat_message(f"pergunta {i}", "resposta", session_id="s") for i in range(120)]
+    writer.update_feedback(futures[-1], -1) # Ainda na fila: o ID sai do INSERT, gravado antes
+    other = history.save_chat_message("outro processo", "grava ao mesmo tempo") # Não colide com o writer
+    ids = [future.result(timeout=5) for future in futures]
+    assert writer.flush(timeout=5)
+    assert len(set(ids + [first, other])) == 122
+    conn = history.get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM chat_history").fetchone()[0] == 122
+    assert tuple(conn.execute("SELECT user_message, feedback FROM chat_history WHERE id = ?", (ids[-1],)).fetchone()) == ("pergunta 119", -1)
+    status = writer.status()
+    assert status["written"] == 121 and status["failed"] == 0 and status["batches"] < 121
+    writer.stop()
+
+def test_writer_waits_for_room_when_queue_is_full(manager, monkeypatch):
+    writer = history.HistoryWriter(manager=manager, max_queue=5)
+    release = threading.Event()
+    original_write = writer._write
+
+    def slow_write(operations):
+        release.wait(5) # Segura a thread de gravação para a fila encher
+        original_write(operations)
+
+    monkeypatch.setattr(writer, "_write", slow_write)
+    futures = []
+    def produce():
+        for i in range(10):
+            futures.append(writer.save_chat_message(f"m{i}", "r"))
+            writer.update_feedback(futures[-1], 1 if i % 2 else -1)
+    producer = threading.Thread(target=produce)
+    producer.start()
+    deadline = time.monotonic() + 5
+    while writer.status()["overflows"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert producer.is_alive() # Esperando vaga, sem gravar por fora da fila
+    release.set()
+    producer.join(5)
+    writer.stop()
+    assert writer.status()["overflows"] > 0 and writer.status()["failed"] == 0
+    conn = history.get_db_connection()
+    rows = conn.execute("SELECT id, user_message, feedback FROM chat_history ORDER BY id").fetchall()
+    assert [row[0] for row in rows] == [future.result() for future in futures]
+    assert [(row[1], row[2]) for row in rows] == [(f"m{i}", 1 if i % 2 else -1) for i in range(10)]
+
+def test_writer_gives_up_after_put_timeout(manager, monkeypatch):
+    writer = history.HistoryWriter(manager=manager, max_queue=1, put_timeout=0.05)
+    release = threading.Event()
+    original_write = writer._write
+    monkeypatch.setattr(writer, "_write", lambda operations: (release.wait(5), original_write(operations)))
+    futures = [writer.save_chat_message(f"m{i}", "r") for i in range(4)]
+    assert futures[-1].result(timeout=1) is None # Descartada: a fila continuou cheia
+    release.set()
+    writer.stop()
+    assert writer.status()["failed"] >= 1
+
+def test_migrations_upgrade_legacy_database(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(path) as conn: # Banco antigo: sem feedback, sem índices, user_version 0
+        conn.execute("CREATE TABLE chat_history (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, "
+                     "timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, user_message TEXT NOT NULL, assistant_message TEXT NOT NULL)")
+        conn.executemany("INSERT INTO chat_history(session_id, user_message, assistant_message) VALUES(?,?,?)",
+                         [("a", "1", "r"), ("b", "2", "r"), ("a", "3", "r")])
+    manager = ConnectionManager(path=path, auto_migrate=False)
+    conn = manager.connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+    assert history.migrate(conn) == history.SCHEMA_VERSION
+    assert history.migrate(conn) == history.SCHEMA_VERSION # Segunda vez: nada a fazer
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == history.SCHEMA_VERSION
+    assert "feedback" in {row[1] for row in conn.execute("PRAGMA table_info(chat_history)")}
+    sessions = {row["session_id"]: tuple(row) for row in conn.execute("SELECT session_id, first_id, last_id, turns FROM chat_sessions")}
+    assert sessions == {"a": ("a", 1, 3, 2), "b": ("b", 2, 2, 1)}
+    manager.close_all()
+
+def test_session_listing_is_keyset_paginated(manager):
+    for i in range(7):
+        history.save_chat_message(f"pergunta {i}", "resposta", session_id=f"s{i % 5}")
+    history.save_chat_message("sem sessão", "resposta")
+    first = history.list_sessions(limit=2)
+    assert [s["session_id"] for s in first["sessions"]] == ["s1", "s0"] # Ordem: última mensagem
+    assert first["sessions"][0]["turns"] == 2
+    second = history.list_sessions(limit=2, before=first["next_cursor"])
+    third = history.list_sessions(limit=2, before=second["next_cursor"])
+    assert [s["session_id"] for s in second["sessions"] + third["sessions"]] == ["s4", "s3", "s2"]
+    assert third["next_cursor"] is None
+
+    plan = " ".join(row[3] for row in history.get_db_connection().execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM chat_sessions WHERE last_id < 10 ORDER BY last_id DESC LIMIT 2"))
+    assert "idx_chat_sessions_last_id" in plan and "TEMP B-TREE" not in plan
+
+def test_load_session_in_order_with_continuation(manager):
+    ids = [history.save_chat_message(f"pergunta {i}", f"resposta {i}", session_id="s1" if i % 2 else "s2") for i in range(10)]
+    messages = history.load_session("s1")
+    assert [m["id"] for m in messages] == ids[1::2]
+    page = history.load_session("s1", after_id=messages[1]["id"], limit=2)
+    assert [m["user_message"] for m in page] == ["pergunta 5", "pergunta 7"]
+    assert history.load_session("inexistente") == []
+
+    plan = " ".join(row[3] for row in history.get_db_connection().execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM chat_history WHERE session_id = 's1' AND id > 0 ORDER BY id"))
+    assert "idx_chat_history_session" in plan and "TEMP B-TREE" not in plan
+
+def test_failed_and_cancelled_turns_are_not_restored_or_counted(manager):
+    history.save_chat_message("pergunta 1", "resposta 1", session_id="s1", metrics={"status": "ok"})
+    history.save_chat_message("pergunta 2", "", session_id="s1", metrics={"status": "error"})
+    history.save_chat_message("pergunta 3", "", session_id="s1", metrics={"status": "cancelled"})
+    history.save_chat_message("pergunta 4", "resposta 4", session_id="s1") # Sem métricas
+    history.save_chat_message("pergunta 5", "", session_id="s2", metrics={"status": "error"})
+
+    assert [m["assistant_message"] for m in history.load_session("s1")] == ["resposta 1", "resposta 4"]
+    turns = {s["session_id"]: s["turns"] for s in history.list_sessions()["sessions"]}
+    assert turns == {"s1": 2, "s2": 0}
+
+def test_full_text_search_ranks_and_filters(manager):
+    ids = [
+        history.save_chat_message("Onde fica o valor do pedido?", "Na coluna PED_VALOR da tabela PEDIDOS.", session_id="s1"),
+        history.save_chat_message("E a data?", "A data do pedido está em PED_DATA.", session_id="s1"),
+        history.save_chat_message("Quem é o cliente?", "A tabela CLIENTES guarda os clientes; ligação por PED_CLIENTE.", session_id="s2"),
+        history.save_chat_message("Informação sobre pedidos", "Veja PEDIDOS e ITENS_PEDIDO.", session_id="s3"),
+    ]
+    history.update_feedback(ids[0], 1)
+    results = history.search_history("PED_VALOR")
+    assert [r["id"] for r in results] == [ids[0]]
+    assert "**PED_VALOR**" in results[0]["assistant_snippet"]
+    assert {r["id"] for r in history.search_history("pedido")} == {ids[0], ids[1]}
+    assert [r["id"] for r in history.search_history("informacao")] == [ids[3]] # Sem acento também encontra
+    assert [r["id"] for r in history.search_history("pedido", feedback=1)] == [ids[0]]
+    assert history.search_history("pedido", since="2999-01-01") == []
+    assert [r["id"] for r in history.search_history("pedido", order="recent")] == [ids[1], ids[0]]
+    assert history.search_history('"PEDIDOS" AND (') is not None # Sintaxe do FTS5 não vaza para o usuário
+    assert history.search_history("   ") == []
+
+def test_search_period_accepts_iso_dates_and_rejects_invalid_ones(manager):
+    message_id = history.save_chat_message("Onde fica o valor do pedido?", "Na coluna PED_VALOR.")
+    conn = history.get_db_connection()
+    conn.execute("UPDATE chat_history SET timestamp = '2025-01-31 18:00:00' WHERE id = ?", (message_id,))
+    conn.commit()
+
+    assert [r["id"] for r in history.search_history("pedido", until="2025-01-31")] == [message_id] # O dia inteiro
+    assert history.search_history("pedido", until="2025-01-30") == []
+    assert history.search_history("pedido", until="2025-01-31 17:59") == []
+    assert [r["id"] for r in history.search_history("pedido", since="2025-01-31T15:00-03:00")] == [message_id] # 18h UTC
+    with pytest.raises(ValueError):
+        history.search_history("pedido", since="31/01/2025")
+
+def test_full_text_index_created_once_fts5_is_available(tmp_path, monkeypatch):
+    path = str(tmp_path / "sem_fts.db")
+    monkeypatch.setattr(history, "fts5_available", lambda conn: False) # SQLite compilado sem FTS5
+    first = ConnectionManager(path=path)
+    monkeypatch.setattr(history, "_default_manager", first)
+    message_id = history.save_chat_message("Onde fica o valor do pedido?", "Na coluna PED_VALOR.")
+    assert first.schema_version == history.SCHEMA_VERSION
+    assert [r["id"] for r in history.search_history("PED_VALOR")] == [message_id] # LIKE
+    first.close_all()
+
+    monkeypatch.undo() # O SQLite ganhou FTS5 (ex.: Python atualizado)
+    second = ConnectionManager(path=path)
+    monkeypatch.setattr(history, "_default_manager", second)
+    conn = history.get_db_connection()
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_history_fts'").fetchone()
+    assert "**PED_VALOR**" in history.search_history("PED_VALOR")[0]["assistant_snippet"] # Mensagens antigas indexadas
+    second.close_all()
+
+def test_full_text_index_follows_updates_and_deletes(manager):
+    message_id = history.save_chat_message("pergunta antiga", "resposta antiga")
+    conn = history.get_db_connection()
+    with conn:
+        conn.execute("UPDATE chat_history SET assistant_message = 'resposta revisada' WHERE id = ?", (message_id,))
+    assert history.search_history("antiga")[0]["id"] == message_id # Ainda na pergunta
+    assert [r["id"] for r in history.search_history("revisada")] == [message_id]
+    with conn:
+        conn.execute("DELETE FROM chat_history WHERE id = ?", (message_id,))
+    assert history.search_history("revisada") == []
+
+def test_import_does_no_io_and_schema_is_created_on_first_use(tmp_path, monkeypatch):
+    script = ("import os; os.chdir(os.environ['TMP_DIR']); import src.database.history as h; "
+              "assert os.listdir('.') == [], os.listdir('.')")
+    subprocess.run([sys.executable, "-c", script], check=True, cwd=ROOT,
+                   env={**os.environ, "TMP_DIR": str(tmp_path), "PYTHONPATH": ROOT})
+
+    manager = ConnectionManager(path=str(tmp_path / "lazy.db"))
+    assert not (tmp_path / "lazy.db").exists()
+    migrations = []
+    original = history.migrate
+    def counting_migrate(conn):
+        migrations.append(threading.current_thread().name)
+        return original(conn)
+    monkeypatch.setattr(history, "migrate", counting_migrate)
+    threads = [threading.Thread(target=manager.connection) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    manager.connection()
+    assert len(migrations) == 1 # Uma vez por processo, não por conexão
+    assert manager.schema_version == history.SCHEMA_VERSION
+    assert manager.connection().execute("SELECT COUNT(*) FROM chat_history").fetchone()[0] == 0
+    manager.close_all()
@@ -0,0 +1,59 @@
+# Testes da retenção do histórico: arquivo morto, leitura do arquivo e compactação
+
+import os
+from datetime import datetime
+
+from src.database import history
+from src.database.retention import HistoryRetention, iter_archive
+
+NOW = datetime(2025, 6, 1)
+
+def add(conn, session_id, timestamp, text="x" * 2000):
+    with conn:
+        return conn.execute("INSERT INTO chat_history(session_id, timestamp, user_message, assistant_message) "
+                            "VALUES(?,?,?,?)", (session_id, timestamp, f"pergunta {session_id}", text)).lastrowid
+
+def test_archives_whole_old_conversations_and_reclaims_space(manager, tmp_path):
+    conn = manager.connection()
+    old = [add(conn, f"antiga-{n}", f"2024-{1 + n % 3:02d}-10 12:00:00") for n in range(300)]
+    add(conn, "mista", "2024-01-05 08:00:00") # Sessão com mensagem recente: fica inteira
+    add(conn, "mista", "2025-05-30 08:00:00")
+    orphan = add(conn, None, "2024-02-01 00:00:00")
+    recent = add(conn, "nova", "2025-05-31 09:00:00")
+
+    retention = HistoryRetention(manager=manager, max_age_days=90, archive_dir=str(tmp_path / "arquivo"), batch_size=64)
+    report = retention.run_once(now=NOW)
+
+    assert report["cutoff"] == "2025-03-03 00:00:00"
+    assert report["sessions"] == 300 and report["rows"] == 301
+    assert report["reclaimed_bytes"] > 0 and report["db_bytes_after"] < report["db_bytes_before"]
+    assert sorted(os.listdir(tmp_path / "arquivo")) == ["2024-01", "2024-02", "2024-03"]
+    remaining = {row[0] for row in conn.execute("SELECT id FROM chat_history")}
+    assert recent in remaining and len(remaining) == 3 and orphan not in remaining
+    assert {row[0] for row in conn.execute("SELECT session_id FROM chat_sessions")} == {"mista", "nova"}
+    assert history.search_history("antiga") == [] # Índice FTS acompanha o DELETE
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    archived = list(iter_archive(str(tmp_path / "arquivo")))
+    assert sorted(row["id"] for row in archived) == sorted(old + [orphan])
+    assert archived[0]["user_message"].startswith("pergunta antiga-")
+    assert [row["timestamp"][:7] for row in iter_archive(str(tmp_path / "arquivo"), since="2024-03")] == ["2024-03"] * 100
+
+    assert retention.run_once(now=NOW)["rows"] == 0 # Nada novo a arquivar
+
+def test_archive_reader_ignores_duplicates_and_partial_files(manager, tmp_path):
+    conn = manager.connection()
+    first = add(conn, "s", "2024-01-10 12:00:00")
+    retention = HistoryRetention(manager=manager, max_age_days=30, archive_dir=str(tmp_path / "arquivo"))
+    rows = [dict(row) for row in conn.execute("SELECT * FROM chat_history")]
+    retention._write_partitions(rows) # Simula uma execução interrompida antes do DELETE
+    retention.run_once(now=NOW)
+    (tmp_path / "arquivo" / "2024-01" / "part-9-1.jsonl.gz.tmp").write_bytes(b"incompleto")
+    assert [row["id"] for row in iter_archive(str(tmp_path / "arquivo"))] == [first]
+
+def test_disabled_retention_only_compacts(manager, tmp_path):
+    conn = manager.connection()
+    add(conn, "s", "2020-01-01 00:00:00")
+    report = HistoryRetention(manager=manager, max_age_days=0, archive_dir=str(tmp_path / "arquivo")).run_once(now=NOW)
+    assert report["cutoff"] is None and report["rows"] == 0
+    assert conn.execute("SELECT COUNT(*) FROM chat_history").fetchone()[0] == 1
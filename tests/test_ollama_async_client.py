@@ -0,0 +1,64 @@
+# Testes do cliente assíncrono (achat_completion)
+
+import asyncio
+
+from src.ollama_integration.async_client import AsyncOllamaClient, get_default_async_client
+from src.ollama_integration.scheduler import RequestScheduler
+from tests.fake_ollama import FakeOllamaServer
+
+MESSAGES_EXAMPLE = [{"role": "user", "content": "Olá"}]
+
+async def collect(client: AsyncOllamaClient, messages=MESSAGES_EXAMPLE) -> str:
+    return "".join([chunk async for chunk in client.achat_completion(messages)])
+
+def test_achat_completion_streams_chunks():
+    """O iterador assíncrono produz os chunks na ordem recebida."""
+    async def run():
+        async with AsyncOllamaClient(api_url=server.chat_url) as client:
+            return [chunk async for chunk in client.achat_completion(MESSAGES_EXAMPLE, model="phi3")]
+
+    with FakeOllamaServer(reply="Olá Mundo !") as server:
+        chunks = asyncio.run(run())
+
+    assert chunks == ["Olá ", "Mundo ", "! "]
+    assert server.last_payload["model"] == "phi3"
+    assert server.last_payload["stream"] is True
+
+def test_many_concurrent_streams_on_one_loop():
+    """Centenas de streams simultâneos rodam em um único event loop."""
+    async def run():
+        scheduler = RequestScheduler(max_concurrency=300)
+        async with AsyncOllamaClient(api_url=server.chat_url, pool_size=300, scheduler=scheduler, coalesce=False) as client:
+            return await asyncio.gather(*(collect(client) for _ in range(300)))
+
+    with FakeOllamaServer(reply="um dois três", chunk_delay=0.05) as server:
+        results = asyncio.run(asyncio.wait_for(run(), timeout=20))
+
+    assert results == ["um dois três "] * 300
+
+def test_achat_completion_connection_error(caplog):
+    """Erro de conexão é logado e a iteração termina sem chunks."""
+    async def run():
+        async with AsyncOllamaClient(api_url="http://127.0.0.1:9/api/chat") as client:
+            return await collect(client)
+
+    assert asyncio.run(run()) == ""
+    assert "Erro de conexão" in caplog.text
+
+def test_achat_completion_http_error(caplog):
+    """Status HTTP de erro é logado e a iteração termina sem chunks."""
+    async def run():
+        async with AsyncOllamaClient(api_url=server.base_url + "/api/inexistente") as client:
+            return await collect(client)
+
+    with FakeOllamaServer() as server:
+        assert asyncio.run(run()) == ""
+    assert "Erro HTTP 404" in caplog.text
+
+def test_default_async_client_is_per_loop():
+    """O cliente padrão é reutilizado dentro do mesmo event loop."""
+    async def run():
+        client = get_default_async_client()
+        return get_default_async_client() is client
+
+    assert asyncio.run(run())
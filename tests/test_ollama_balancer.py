@@ -0,0 +1,79 @@
+# Testes do balanceamento entre vários backends Ollama (servidores "stand-in" locais)
+
+import time
+from contextlib import ExitStack
+
+from src.ollama_integration.balancer import EndpointPool
+from src.ollama_integration.client import OllamaClient
+from src.ollama_integration.resilience import CircuitBreaker, RetryPolicy
+from src.ollama_integration.scheduler import RequestScheduler
+from src.ollama_integration.telemetry import MetricsSink
+from tests.fake_ollama import FakeOllamaServer
+
+MESSAGES_EXAMPLE = [{"role": "user", "content": "Olá"}]
+
+def chat_calls(server) -> int:
+    return server.requests_by_path.get("/api/chat", 0)
+
+def make_client(pool):
+    return OllamaClient(balancer=pool, scheduler=RequestScheduler(max_concurrency=10), metrics=MetricsSink(),
+                        retry=RetryPolicy(max_retries=0), breaker=CircuitBreaker(), coalesce=False)
+
+def test_routes_to_least_loaded_endpoint():
+    with ExitStack() as stack:
+        servers = [stack.enter_context(FakeOllamaServer()) for _ in range(3)]
+        # Sem folga de afinidade: o segundo stream não volta para o backend que já tem o modelo
+        pool = EndpointPool([s.chat_url for s in servers], health_interval=3600, affinity_slack=0)
+        with make_client(pool) as client:
+            # Dois streams abertos (ainda não consumidos) ocupam dois backends
+            open_streams = [client.chat_completion(MESSAGES_EXAMPLE, stream=True) for _ in range(2)]
+            assert sorted(ep["outstanding"] for ep in pool.status()) == [0, 1, 1]
+            idle = next(s for s, ep in zip(servers, pool.status()) if ep["outstanding"] == 0)
+            assert client.chat_completion(MESSAGES_EXAMPLE) == "Resposta simulada."
+            assert chat_calls(idle) == 1
+            for stream in open_streams:
+                assert "".join(stream) == "Resposta simulada. "
+        assert [ep["outstanding"] for ep in pool.status()] == [0, 0, 0]
+        assert [chat_calls(s) for s in servers] == [1, 1, 1]
+
+def test_prefers_endpoint_with_model_loaded():
+    with FakeOllamaServer() as cold, FakeOllamaServer() as warm:
+        warm.loaded["phi3"] = "30m"
+        pool = EndpointPool([cold.chat_url, warm.chat_url], health_interval=3600).start()
+        assert pool.wait_ready(timeout=2) # A primeira verificação roda na thread de saúde
+        with make_client(pool) as client:
+            for _ in range(4):
+                client.chat_completion(MESSAGES_EXAMPLE, model="phi3")
+        pool.stop()
+    assert chat_calls(cold) == 0 and chat_calls(warm) == 4
+
+def test_failed_endpoint_is_ejected_until_health_check_passes():
+    with FakeOllamaServer() as alive:
+        dead_url = "http://127.0.0.1:1/api/chat"
+        pool = EndpointPool([dead_url, alive.chat_url], health_interval=3600, health_timeout=0.5)
+        pool.endpoints[0].loaded_models.add("llama3") # A afinidade manda a primeira chamada para o backend morto
+        with make_client(pool) as client:
+            assert client.chat_completion(MESSAGES_EXAMPLE) is None # Erro de conexão
+            dead, live = pool.status()
+            assert not dead["healthy"] and live["healthy"]
+            assert all(client.chat_completion(MESSAGES_EXAMPLE) for _ in range(5))
+            assert chat_calls(alive) == 5
+
+            pool.check_all() # A verificação mantém fora quem não responde e readmite quem responde
+            assert [ep["healthy"] for ep in pool.status()] == [False, True]
+            pool.report_failure(pool.endpoints[1])
+            assert not pool.status()[1]["healthy"]
+            pool.check_all()
+            assert pool.status()[1]["healthy"]
+        pool.stop()
+
+def test_start_does_not_block_on_unreachable_backends():
+    with FakeOllamaServer() as alive:
+        pool = EndpointPool(["http://10.255.255.1:11434", alive.chat_url], health_interval=3600, health_timeout=1.0)
+        started = time.perf_counter()
+        pool.start()
+        assert time.perf_counter() - started < 0.2
+        assert [ep["healthy"] for ep in pool.status()] == [True, True] # Otimista até a primeira verificação
+        assert pool.wait_ready(timeout=3)
+        assert [ep["healthy"] for ep in pool.status()] == [False, True]
+        pool.stop()
@@ -0,0 +1,72 @@
+# Testes do cache de respostas do LLM (LRU em memória + SQLite em disco)
+
+import time
+
+from src.ollama_integration.cache import ResponseCache, make_cache_key, replay_chunks
+from src.ollama_integration.client import OllamaClient
+from tests.fake_ollama import FakeOllamaServer
+
+MESSAGES_EXAMPLE = [{"role": "user", "content": "Descreva a coluna  CODCLI"}]
+
+def test_cache_key_normalizes_messages_and_options():
+    key = make_cache_key("llama3", MESSAGES_EXAMPLE, {"temperature": 0, "top_p": 1})
+    same = make_cache_key("llama3", [{"content": " Descreva a coluna CODCLI ", "role": "user"}], {"top_p": 1, "temperature": 0})
+    assert key == same
+    assert key != make_cache_key("phi3", MESSAGES_EXAMPLE, {"temperature": 0, "top_p": 1})
+    assert key != make_cache_key("llama3", MESSAGES_EXAMPLE, {"temperature": 0.7, "top_p": 1})
+
+def test_memory_lru_eviction_and_stats():
+    cache = ResponseCache(max_memory_entries=2)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A" # "a" passa a ser o mais recente
+    cache.set("c", "C") # Remove "b"
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1 and stats["misses"] == 1 and stats["evictions"] == 1
+    assert stats["hit_rate"] == 0.5
+
+def test_ttl_expires_entries():
+    cache = ResponseCache(ttl_seconds=0.05)
+    cache.set("k", "valor")
+    assert cache.get("k") == "valor"
+    time.sleep(0.1)
+    assert cache.get("k") is None
+    assert cache.stats()["expired"] == 1
+
+def test_disk_tier_survives_restart_and_respects_size_cap(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path=path, max_disk_bytes=10)
+    cache.set("old", "12345")
+    cache.set("new", "678901")  # Total 11 bytes > 10: remove a menos acessada ("old")
+    cache.close()
+
+    reopened = ResponseCache(path=path, max_disk_bytes=10)
+    assert reopened.get("old") is None
+    assert reopened.get("new") == "678901"
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+def test_replay_chunks_rebuilds_text():
+    text = "Código do cliente.\nReferencia CLIENTES."
+    assert "".join(replay_chunks(text)) == text
+
+def test_client_serves_hits_without_calling_ollama(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.db"))
+    with FakeOllamaServer(reply="Código do cliente") as server:
+        with OllamaClient(api_url=server.chat_url) as client:
+            first = client.chat_completion(MESSAGES_EXAMPLE, stream=False, cache=cache)
+            second = client.chat_completion(MESSAGES_EXAMPLE, stream=False, cache=cache)
+            streamed = list(client.chat_completion(MESSAGES_EXAMPLE, stream=True, cache=cache))
+
+    assert first == second == "Código do cliente"
+    assert streamed == ["Código ", "do ", "cliente"]
+    assert server.requests_by_path["/api/chat"] == 1
+
+def test_client_caches_completed_streams():
+    cache = ResponseCache()
+    with FakeOllamaServer(reply="um dois") as server:
+        with OllamaClient(api_url=server.chat_url) as client:
+            assert "".join(client.chat_completion(MESSAGES_EXAMPLE, stream=True, cache=cache)) == "um dois "
+            assert client.chat_completion(MESSAGES_EXAMPLE, stream=False, cache=cache) == "um dois "
+    assert server.requests_by_path["/api/chat"] == 1
@@ -0,0 +1,87 @@
+# Testes do cancelamento de gerações abandonadas (sync e async)
+
+import asyncio
+import threading
+import time
+
+from src.ollama_integration.async_client import AsyncOllamaClient
+from src.ollama_integration.cancellation import CancelToken
+from src.ollama_integration.client import OllamaClient
+from src.ollama_integration.scheduler import RequestScheduler
+from src.ollama_integration.telemetry import MetricsSink
+from tests.fake_ollama import FakeOllamaServer
+
+MESSAGES_EXAMPLE = [{"role": "user", "content": "Olá"}]
+LONG_REPLY = " ".join(f"palavra{i}" for i in range(200))
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+def test_cancel_from_another_thread_closes_stream_and_frees_slot():
+    sink, scheduler = MetricsSink(), RequestScheduler(max_concurrency=1)
+    with FakeOllamaServer(reply="uma resposta completa de seis tokens") as server:
+        client = OllamaClient(api_url=server.chat_url, scheduler=scheduler, metrics=sink)
+        client.chat_completion(MESSAGES_EXAMPLE, stream=False) # Resposta completa: base da estimativa
+        server.reply, server.chunk_delay = LONG_REPLY, 0.01
+        token = CancelToken()
+        stream = client.chat_completion(MESSAGES_EXAMPLE, stream=True, cancel=token)
+        received = [next(stream), next(stream)]
+        threading.Timer(0.05, token.cancel).start()
+        started = time.perf_counter()
+        received.extend(stream) # Bloqueado na leitura até o cancelamento derrubar o socket
+        assert time.perf_counter() - started < 1.0
+        assert len(received) < 50
+        assert wait_for(lambda: server.aborted_streams == 1)
+        assert scheduler.metrics()["in_flight"] == 0
+        # O slot livre atende a próxima chamada normalmente
+        server.chunk_delay = 0
+        assert client.chat_completion(MESSAGES_EXAMPLE, stream=False) == LONG_REPLY
+
+    cancelled = [t for t in sink.recent() if t["cancelled"]]
+    assert len(cancelled) == 1 and cancelled[0]["eval_count"] == len(received)
+    totals = sink.cancellations()
+    assert totals["cancelled"] == 1 and totals["tokens_saved_est"] > 0
+    assert sink.summary()["llama3"]["errors"] == 0 # Cancelamento não conta como erro
+
+def test_closing_the_generator_counts_as_cancellation():
+    sink = MetricsSink()
+    with FakeOllamaServer(reply=LONG_REPLY, chunk_delay=0.005) as server:
+        client = OllamaClient(api_url=server.chat_url, scheduler=RequestScheduler(), metrics=sink)
+        stream = client.chat_completion(MESSAGES_EXAMPLE, stream=True)
+        next(stream)
+        stream.close()
+        assert wait_for(lambda: server.aborted_streams == 1)
+    assert sink.recent()[-1]["cancelled"]
+
+def test_non_stream_call_can_be_cancelled():
+    with FakeOllamaServer(reply=LONG_REPLY, chunk_delay=0.01) as server:
+        client = OllamaClient(api_url=server.chat_url, scheduler=RequestScheduler(), metrics=MetricsSink())
+        token = CancelToken()
+        threading.Timer(0.1, token.cancel).start()
+        started = time.perf_counter()
+        assert client.chat_completion(MESSAGES_EXAMPLE, stream=False, cancel=token) is None
+        assert time.perf_counter() - started < 1.0
+        assert client.chat_completion(MESSAGES_EXAMPLE, cancel=token) is None # Já cancelado: nem envia
+        assert server.requests_by_path["/api/chat"] == 1
+
+def test_async_stream_cancelled_by_token():
+    sink, scheduler = MetricsSink(), RequestScheduler()
+    async def run():
+        token = CancelToken()
+        chunks = []
+        async with AsyncOllamaClient(api_url=server.chat_url, scheduler=scheduler, metrics=sink) as client:
+            async for chunk in client.achat_completion(MESSAGES_EXAMPLE, cancel=token):
+                chunks.append(chunk)
+                if len(chunks) == 3:
+                    threading.Thread(target=token.cancel).start() # Ex.: nova mensagem na mesma sessão
+        return chunks
+
+    with FakeOllamaServer(reply=LONG_REPLY, chunk_delay=0.01) as server:
+        chunks = asyncio.run(run())
+        assert len(chunks) < 50
+        assert wait_for(lambda: server.aborted_streams == 1)
+    assert scheduler.metrics()["in_flight"] == 0
+    assert sink.recent()[-1]["cancelled"]
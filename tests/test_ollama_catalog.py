@@ -0,0 +1,51 @@
+# Testes do catálogo de modelos em cache (/api/tags com TTL e atualização em segundo plano)
+
+import time
+
+from src.ollama_integration.catalog import ModelCatalog
+from src.ollama_integration.client import OllamaClient, resolve_model
+from tests.fake_ollama import FakeOllamaServer
+
+def test_models_never_blocks_and_falls_back_to_default_model():
+    # Porta sem servidor: a leitura não pode esperar pela rede
+    catalog = ModelCatalog(client=OllamaClient(api_url="http://127.0.0.1:9/api/chat"), ttl=3600, timeout=0.2)
+    started = time.perf_counter()
+    assert catalog.models() == [resolve_model(None)]
+    assert time.perf_counter() - started < 0.1
+    assert catalog.refresh().result(timeout=5) is False
+    assert catalog.status()["failures"] == 1
+    catalog.stop()
+
+def test_serves_stale_list_while_refreshing_and_notifies_on_change():
+    with FakeOllamaServer(models=["llama3"]) as server:
+        catalog = ModelCatalog(client=OllamaClient(api_url=server.chat_url), ttl=3600)
+        changes = []
+        catalog.subscribe(changes.append)
+        assert catalog.refresh().result(timeout=5) is True
+        assert catalog.models() == ["llama3"] and catalog.version == 1
+
+        # Lista vencida: a leitura devolve a antiga e agenda uma única atualização
+        server.models = ["llama3", "phi3"]
+        catalog.ttl = 0
+        time.sleep(0.01)
+        assert catalog.models() == ["llama3"]
+        assert catalog.refresh().result(timeout=5) is True
+        catalog.ttl = 3600
+        assert catalog.models() == ["llama3", "phi3"]
+
+        # Mesma lista de novo: sem notificação nem nova versão
+        catalog.refresh().result(timeout=5)
+        catalog.stop()
+
+    assert changes == [["llama3"], ["llama3", "phi3"]]
+    assert catalog.version == 2
+
+def test_failed_refresh_keeps_previous_list():
+    server = FakeOllamaServer(models=["mistral"]).start()
+    catalog = ModelCatalog(client=OllamaClient(api_url=server.chat_url), ttl=3600, timeout=0.5)
+    catalog.refresh().result(timeout=5)
+    server.stop()
+    catalog.client.close() # Descarta a conexão keep-alive com o servidor parado
+    assert catalog.refresh().result(timeout=5) is False
+    assert catalog.models() == ["mistral"]
+    catalog.stop()
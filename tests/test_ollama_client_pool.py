@@ -0,0 +1,56 @@
+# Testes do pool de conexões keep-alive do OllamaClient
+
+import gc
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from src.ollama_integration.client import OllamaClient, get_default_client
+from tests.fake_ollama import FakeOllamaServer
+
+MESSAGES_EXAMPLE = [{"role": "user", "content": "Olá"}]
+
+@pytest.fixture
+def server():
+    with FakeOllamaServer(reply="Olá do servidor local") as srv:
+        yield srv
+
+def test_sequential_calls_reuse_one_connection(server):
+    """Chamadas sequenciais (com e sem stream) devem reaproveitar a mesma conexão TCP."""
+    with OllamaClient(api_url=server.chat_url, pool_size=2) as client:
+        for _ in range(5):
+            assert client.chat_completion(MESSAGES_EXAMPLE, stream=False) == "Olá do servidor local"
+        chunks = list(client.chat_completion(MESSAGES_EXAMPLE, stream=True))
+        assert "".join(chunks).strip() == "Olá do servidor local"
+        assert client.get_available_models() == ["llama3"]
+
+    assert server.connections == 1
+    assert server.requests_by_path == {"/api/chat": 6, "/api/tags": 1}
+
+def test_concurrent_calls_are_bounded_by_pool_size(server):
+    """Threads concorrentes compartilham o cliente sem abrir mais conexões que o pool."""
+    with OllamaClient(api_url=server.chat_url, pool_size=3) as client:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: client.chat_completion(MESSAGES_EXAMPLE), range(40)))
+
+    assert results == ["Olá do servidor local"] * 40
+    assert server.connections <= 3
+
+def test_default_client_is_shared():
+    """O cliente padrão do processo é criado uma única vez."""
+    assert get_default_client() is get_default_client()
+
+def test_unstarted_stream_returns_its_connection_to_the_pool(server):
+    """Um stream descartado sem ser iterado não pode prender a única conexão do pool."""
+    with OllamaClient(api_url=server.chat_url, pool_size=1, coalesce=False) as client:
+        stream = client.chat_completion(MESSAGES_EXAMPLE, stream=True)
+        assert stream is not None
+        del stream
+        gc.collect()
+        result = []
+        # Thread daemon: sem a correção, a chamada fica presa esperando uma conexão livre
+        caller = threading.Thread(target=lambda: result.append(client.chat_completion(MESSAGES_EXAMPLE)), daemon=True)
+        caller.start()
+        caller.join(5)
+        assert result == ["Olá do servidor local"]
+        assert client.scheduler.metrics()["in_flight"] == 0
@@ -0,0 +1,43 @@
+# Testes do cliente de embeddings em lote (/api/embed)
+
+import time
+
+from src.ollama_integration.client import OllamaClient
+from src.ollama_integration.scheduler import RequestScheduler
+from tests.fake_ollama import FakeOllamaServer
+
+def expected(text):
+    return [float(len(text)), float(sum(map(ord, text))), 1.0]
+
+def test_embed_dedupes_and_preserves_input_order():
+    texts = ["CLIENTES", "PEDIDOS", "CLIENTES", "ITENS", "PEDIDOS"]
+    with FakeOllamaServer() as server:
+        client = OllamaClient(api_url=server.chat_url, scheduler=RequestScheduler())
+        result = client.embed(texts, model="nomic-embed-text", batch_size=2)
+
+    assert server.embed_inputs == 3 # Repetidos enviados uma só vez
+    assert server.requests_by_path["/api/embed"] == 2
+    assert len(result) == 5 and result.unique_count == 3 and result.dim == 3
+    assert result.tolist() == [expected(t) for t in texts]
+    assert result.data.itemsize == 4 # float32
+    assert result.inputs_per_s > 0
+
+def test_embed_runs_batches_concurrently_with_a_bound():
+    texts = [f"COLUNA_{i}" for i in range(8)]
+    with FakeOllamaServer() as server:
+        server.embed_delay = 0.1
+        client = OllamaClient(api_url=server.chat_url, scheduler=RequestScheduler(max_concurrency=8))
+        started = time.perf_counter()
+        result = client.embed(texts, batch_size=2, concurrency=2)
+        elapsed = time.perf_counter() - started
+
+    # 4 lotes, 2 por vez: ~2 rodadas de 0,1s (serial seriam 0,4s)
+    assert result.batches == 4
+    assert 0.2 <= elapsed < 0.35
+    assert list(result[7]) == expected("COLUNA_7")
+
+def test_embed_returns_none_on_http_error():
+    with FakeOllamaServer() as server:
+        client = OllamaClient(api_url=server.chat_url, scheduler=RequestScheduler())
+        client.embed_url = f"{server.base_url}/api/nao-existe"
+        assert client.embed(["A"]) is None
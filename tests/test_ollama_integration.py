@@ -3,6 +3,7 @@ import requests # Necessário para simular exceções
 import json
 from unittest.mock import MagicMock # Usado para criar mocks mais flexíveis
 from src.ollama_integration.client import chat_completion
+from src.ollama_integration.resilience import OLLAMA_MAX_RETRIES
 
 # Marca para pular este teste por padrão, pois ele faria uma chamada real à API
 # Para executar, use: pytest -m "not slow"
@@ -41,7 +42,7 @@ def test_chat_completion_integration():
 
 # @pytest.fixture
 # def mock_requests_post(mocker):
-#     return mocker.patch('src.ollama_integration.client.requests.post')
+#     return mocker.patch('src.ollama_integration.client.requests.Session.post')
 
 # Exemplo de mensagens para os testes
 MESSAGES_EXAMPLE = [{"role": "user", "content": "Olá"}]
@@ -60,7 +61,7 @@ def create_mock_stream_response(lines):
 def test_chat_completion_success_no_stream(mocker):
     """Testa o sucesso da chamada sem streaming."""
     # Aplica o mock dentro do teste
-    mock_post = mocker.patch('src.ollama_integration.client.requests.post')
+    mock_post = mocker.patch('src.ollama_integration.client.requests.Session.post')
     
     # Configura o mock para retornar uma resposta JSON válida
     mock_response = MagicMock(spec=requests.Response)
@@ -82,7 +83,7 @@ def test_chat_completion_success_no_stream(mocker):
 
 def test_chat_completion_success_with_stream(mocker):
     """Testa o sucesso da chamada com streaming."""
-    mock_post = mocker.patch('src.ollama_integration.client.requests.post')
+    mock_post = mocker.patch('src.ollama_integration.client.requests.Session.post')
     
     # Cria linhas de stream simuladas
     stream_lines = [
@@ -102,7 +103,7 @@ def test_chat_completion_success_with_stream(mocker):
 
 def test_chat_completion_http_error(mocker, caplog):
     """Testa o tratamento de erro HTTP (ex: 404 Not Found)."""
-    mock_post = mocker.patch('src.ollama_integration.client.requests.post')
+    mock_post = mocker.patch('src.ollama_integration.client.requests.Session.post')
     
     mock_response = MagicMock(spec=requests.Response)
     mock_response.status_code = 404
@@ -121,7 +122,9 @@ def test_chat_completion_http_error(mocker, caplog):
 
 def test_chat_completion_connection_error(mocker, caplog):
     """Testa o tratamento de erro de conexão."""
-    mock_post = mocker.patch('src.ollama_integration.client.requests.post')
+    mock_post = mocker.patch('src.ollama_integration.client.requests.Session.post')
+    
+    mock_sleep = mocker.patch('src.ollama_integration.resilience.time.sleep')
     
     # Configura o mock para levantar ConnectionError diretamente
     mock_post.side_effect = requests.exceptions.ConnectionError("Falha ao conectar")
@@ -131,11 +134,13 @@ def test_chat_completion_connection_error(mocker, caplog):
     assert result is None
     assert "Erro de conexão" in caplog.text
     assert "Falha ao conectar" in caplog.text
-    mock_post.assert_called_once()
+    # Sem stream a chamada é idempotente: é repetida OLLAMA_MAX_RETRIES vezes, com backoff
+    assert mock_post.call_count == 1 + OLLAMA_MAX_RETRIES
+    assert mock_sleep.call_count == OLLAMA_MAX_RETRIES
 
 def test_chat_completion_stream_json_error(mocker, caplog):
     """Testa o erro de JSON inválido durante o streaming."""
-    mock_post = mocker.patch('src.ollama_integration.client.requests.post')
+    mock_post = mocker.patch('src.ollama_integration.client.requests.Session.post')
     
     stream_lines = [
         json.dumps({"message": {"content": "Parte 1"}, "done": False}).encode('utf-8'),
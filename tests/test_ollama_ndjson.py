@@ -0,0 +1,38 @@
+# Testes do decodificador NDJSON do stream do /api/chat
+
+import asyncio
+import json
+
+from src.ollama_integration.ndjson import StreamState, aiter_chat_chunks, iter_chat_chunks
+
+def _line(content, done=False, **extra):
+    return json.dumps({"message": {"role": "assistant", "content": content}, "done": done, **extra}, ensure_ascii=False).encode("utf-8")
+
+def test_decodes_raw_bytes_and_stops_at_done():
+    lines = [_line("Olá"), b"", _line(", João"), _line("", done=True, eval_count=2), _line("ignorado")]
+    state = StreamState()
+    chunks = list(iter_chat_chunks(lines, state))
+    assert chunks == ["Olá", ", João"]
+    assert state.done and state.text == "Olá, João"
+    assert state.final["eval_count"] == 2
+    assert state.line_count == 3 and state.chunk_count == 2
+
+def test_stops_on_invalid_line(caplog):
+    state = StreamState()
+    chunks = list(iter_chat_chunks([_line("Parte 1"), b"{invalido", _line("Parte 2")], state))
+    assert chunks == ["Parte 1"]
+    assert not state.done and state.error_line == b"{invalido"
+    assert "Erro ao decodificar linha do stream JSON" in caplog.text
+
+def test_async_decoder_shares_state_rules(caplog):
+    async def lines():
+        for line in (_line("Parte 1") + b"\r\n", b"\n", b"{invalido\n", _line("Parte 2")):
+            yield line
+
+    async def run(state):
+        return [chunk async for chunk in aiter_chat_chunks(lines(), state)]
+
+    state = StreamState()
+    assert asyncio.run(run(state)) == ["Parte 1"]
+    assert not state.done and state.error_line == b"{invalido" and state.line_count == 2
+    assert "Erro ao decodificar linha do stream JSON" in caplog.text
@@ -0,0 +1,73 @@
+# Testes do gerenciador de residência de modelos (pré-carga, aquecimento e descarga)
+
+import time
+
+from src.ollama_integration.client import OllamaClient
+from src.ollama_integration.residency import ModelResidencyManager
+from src.ollama_integration.scheduler import RequestScheduler
+from src.ollama_integration.telemetry import MetricsSink
+from tests.fake_ollama import FakeOllamaServer
+
+def make_manager(server, **kwargs):
+    sink = MetricsSink()
+    client = OllamaClient(api_url=server.chat_url, scheduler=RequestScheduler(), metrics=sink)
+    return ModelResidencyManager(client=client, metrics=sink, check_interval=3600, **kwargs), client
+
+def test_start_preloads_pinned_model_with_keep_alive():
+    with FakeOllamaServer() as server:
+        server.load_delay = 0.05
+        manager, _ = make_manager(server, pinned=["llama3"], keep_alive="1h")
+        manager.start()
+        assert manager.warm("llama3").result(timeout=5) is True
+        status = manager.status()
+        manager.stop()
+
+    assert server.loaded == {"llama3": "1h"}
+    assert status["resident"] == ["llama3"]
+    assert status["models"]["llama3"]["loads"] == 1
+    assert status["models"]["llama3"]["last_load_s"] >= 0.05
+
+def test_warm_runs_in_background_and_is_deduplicated():
+    with FakeOllamaServer() as server:
+        server.load_delay = 0.2
+        manager, _ = make_manager(server, pinned=[])
+        started = time.perf_counter()
+        first, second = manager.warm("phi3"), manager.warm("phi3")
+        assert time.perf_counter() - started < 0.1 # Não bloqueia quem chamou (ex.: callback do dropdown)
+        assert first is second and first.result(timeout=5) is True
+        manager.stop()
+        assert server.requests_by_path["/api/generate"] == 1
+        assert "phi3" in server.loaded
+
+def test_enforce_limits_unloads_least_recently_used_and_idle_models():
+    with FakeOllamaServer() as server:
+        manager, client = make_manager(server, pinned=["llama3"], max_resident=2, idle_unload_after=3600)
+        for model in ("llama3", "phi3", "mistral"):
+            manager.warm(model).result(timeout=5)
+        # Manter no máximo 2 residentes: "phi3" foi o menos usado recentemente
+        assert set(server.loaded) == {"llama3", "mistral"}
+
+        client.chat_completion([{"role": "user", "content": "Olá"}], model="mistral")
+        assert manager.status()["models"]["mistral"]["uses"] == 1
+
+        manager.idle_unload_after = 0
+        time.sleep(0.01)
+        assert manager.enforce_limits() == ["mistral"] # O modelo fixo nunca é descarregado
+        assert set(server.loaded) == {"llama3"}
+        manager.stop()
+
+def test_enforce_limits_leaves_models_loaded_by_other_processes():
+    with FakeOllamaServer() as server:
+        # Modelos carregados por outro processo (ex.: Streamlit ou o job de geração em massa)
+        server.loaded.update({"phi3": "30m", "mistral": "30m"})
+        server.expires_at["mistral"] = "2000-01-01T00:00:00.123456789-03:00" # Já expirado segundo o /api/ps
+        manager, _ = make_manager(server, pinned=["llama3"], max_resident=1, idle_unload_after=0)
+        manager.warm("llama3").result(timeout=5)
+        manager.warm("gemma").result(timeout=5)
+        # "mistral" expirou; "phi3" não é deste processo e continua residente mesmo acima de max_resident
+        assert set(server.loaded) == {"llama3", "gemma", "phi3"}
+
+        time.sleep(0.01)
+        assert manager.enforce_limits() == ["gemma"] # Carregado aqui e ocioso
+        assert set(server.loaded) == {"llama3", "phi3"}
+        manager.stop()
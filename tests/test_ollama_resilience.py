@@ -0,0 +1,83 @@
+# Testes de timeouts, novas tentativas e disjuntor do cliente Ollama
+
+import asyncio
+import time
+
+from src.ollama_integration.async_client import AsyncOllamaClient
+from src.ollama_integration.client import OllamaClient
+from src.ollama_integration.resilience import CircuitBreaker, RetryPolicy, Timeouts
+from src.ollama_integration.scheduler import RequestScheduler
+from src.ollama_integration.telemetry import MetricsSink
+from tests.fake_ollama import FakeOllamaServer
+
+MESSAGES_EXAMPLE = [{"role": "user", "content": "Olá"}]
+
+def make_client(url, **kwargs):
+    kwargs.setdefault("retry", RetryPolicy(max_retries=2, backoff=0.01))
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=3, reset_timeout=0.2))
+    return OllamaClient(api_url=url, scheduler=RequestScheduler(), metrics=MetricsSink(), **kwargs)
+
+def test_circuit_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow() # Uma única chamada de teste no estado meio-aberto
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.metrics()["opened"] == 2 and breaker.metrics()["rejected"] == 2
+
+def test_non_stream_call_retries_on_5xx():
+    with FakeOllamaServer() as server:
+        server.fail_next = 2
+        with make_client(server.chat_url) as client:
+            assert client.chat_completion(MESSAGES_EXAMPLE) == "Resposta simulada."
+            metrics = client.resilience_metrics()
+    assert server.requests_by_path["/api/chat"] == 3
+    assert metrics["retry"]["retries"] == 2
+    assert metrics["breaker"]["state"] == "closed"
+
+def test_stream_is_not_retried_and_first_token_timeout_fails():
+    with FakeOllamaServer(chunk_delay=0.5) as server:
+        with make_client(server.chat_url, timeouts=Timeouts(first_token=0.1)) as client:
+            started = time.perf_counter()
+            assert list(client.chat_completion(MESSAGES_EXAMPLE, stream=True)) == []
+            assert time.perf_counter() - started < 0.45
+            assert client.resilience_metrics()["breaker"]["failures"] == 1
+        server.fail_next = 1
+        with make_client(server.chat_url) as client:
+            assert client.chat_completion(MESSAGES_EXAMPLE, stream=True) is None
+        assert server.requests_by_path["/api/chat"] == 2 # Nenhuma repetição em stream
+
+def test_open_circuit_fails_fast_without_contacting_backend():
+    with FakeOllamaServer() as server:
+        server.fail_next = 3
+        with make_client(server.chat_url, retry=RetryPolicy(max_retries=0)) as client:
+            for _ in range(3):
+                assert client.chat_completion(MESSAGES_EXAMPLE) is None
+            assert client.breaker.state == CircuitBreaker.OPEN
+            assert client.chat_completion(MESSAGES_EXAMPLE) is None
+            assert server.requests_by_path["/api/chat"] == 3 # A quarta chamada nem saiu
+
+            time.sleep(0.25) # Meio-aberto: a chamada de teste passa e fecha o circuito
+            assert client.chat_completion(MESSAGES_EXAMPLE) == "Resposta simulada."
+            assert client.breaker.state == CircuitBreaker.CLOSED
+
+def test_async_first_token_timeout_records_breaker_failure():
+    breaker = CircuitBreaker(failure_threshold=3)
+
+    async def run():
+        async with AsyncOllamaClient(api_url=server.chat_url, scheduler=RequestScheduler(), metrics=MetricsSink(),
+                                     timeouts=Timeouts(first_token=0.1), breaker=breaker) as client:
+            return [chunk async for chunk in client.achat_completion(MESSAGES_EXAMPLE)]
+
+    with FakeOllamaServer(chunk_delay=0.5) as server:
+        assert asyncio.run(run()) == []
+    assert breaker.metrics()["failures"] == 1
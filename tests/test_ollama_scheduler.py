@@ -0,0 +1,104 @@
+# Testes do escalonador de requisições (prioridades, admissão e métricas)
+
+import asyncio
+import threading
+import time
+
+import pytest
+from src.ollama_integration.client import OllamaClient
+from src.ollama_integration.scheduler import Priority, QueueFullError, RequestScheduler
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condição não satisfeita a tempo"
+        time.sleep(0.005)
+
+def test_interactive_is_served_before_batch():
+    """Com o backend ocupado, o INTERACTIVE que chega depois passa na frente do BATCH."""
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=10)
+    scheduler.acquire(Priority.INTERACTIVE)
+    order = []
+
+    def worker(priority, label):
+        with scheduler.slot(priority):
+            order.append(label)
+
+    threads = [threading.Thread(target=worker, args=(Priority.BATCH, "batch"))]
+    threads[0].start()
+    wait_until(lambda: scheduler.metrics()["queue_depth"] == 1)
+    threads.append(threading.Thread(target=worker, args=(Priority.INTERACTIVE, "interactive")))
+    threads[1].start()
+    wait_until(lambda: scheduler.metrics()["queue_depth"] == 2)
+
+    scheduler.release(Priority.INTERACTIVE)
+    for t in threads:
+        t.join(timeout=2)
+    assert order == ["interactive", "batch"]
+
+def test_batch_cannot_take_every_slot():
+    """BATCH fica limitado a max_batch_concurrency; o slot restante atende o interativo."""
+    scheduler = RequestScheduler(max_concurrency=2, max_queue=10)
+    assert scheduler.max_batch_concurrency == 1
+    scheduler.acquire(Priority.BATCH)
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(Priority.BATCH, timeout=0.05)
+    scheduler.acquire(Priority.INTERACTIVE, timeout=0.05) # Não espera
+    assert scheduler.metrics()["in_flight"] == 2
+
+def test_queue_full_is_rejected_immediately():
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=0)
+    scheduler.acquire()
+    start = time.monotonic()
+    with pytest.raises(QueueFullError):
+        scheduler.acquire(Priority.BATCH)
+    assert time.monotonic() - start < 0.1
+    assert scheduler.metrics()["priorities"]["batch"]["rejected"] == 1
+
+def test_metrics_report_wait_time():
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=5)
+    scheduler.acquire()
+    threading.Timer(0.1, scheduler.release).start()
+    with scheduler.slot(Priority.INTERACTIVE):
+        metrics = scheduler.metrics()
+    interactive = metrics["priorities"]["interactive"]
+    assert interactive["admitted"] == 2
+    assert interactive["wait_max_s"] >= 0.05
+    assert metrics["queue_depth"] == 0
+
+def test_async_acquire_and_cancellation():
+    """Corrotinas esperam sem bloquear o loop; cancelar um waiter não vaza slot."""
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=5)
+
+    async def run():
+        await scheduler.aacquire()
+        waiting = asyncio.create_task(scheduler.aacquire(Priority.BATCH))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        scheduler.release()
+        async with scheduler.aslot(Priority.BATCH):
+            return scheduler.metrics()
+
+    metrics = asyncio.run(run())
+    assert metrics["in_flight"] == 1 and metrics["queue_depth"] == 0
+
+def test_chat_completion_returns_none_when_rejected(caplog):
+    scheduler = RequestScheduler(max_concurrency=1, max_queue=0)
+    scheduler.acquire()
+    client = OllamaClient(api_url="http://127.0.0.1:9/api/chat", scheduler=scheduler)
+    assert client.chat_completion([{"role": "user", "content": "Olá"}], priority=Priority.BATCH) is None
+    assert "rejeitada" in caplog.text
+
+def test_stream_holds_slot_until_generator_finishes():
+    from tests.fake_ollama import FakeOllamaServer
+
+    scheduler = RequestScheduler(max_concurrency=2, max_queue=5)
+    with FakeOllamaServer(reply="a b c") as server:
+        client = OllamaClient(api_url=server.chat_url, scheduler=scheduler)
+        generator = client.chat_completion([{"role": "user", "content": "Olá"}], stream=True)
+        assert scheduler.metrics()["in_flight"] == 1
+        assert "".join(generator) == "a b c "
+        assert scheduler.metrics()["in_flight"] == 0
+        client.close()
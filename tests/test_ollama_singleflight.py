@@ -0,0 +1,150 @@
+# Testes da coalescência de requisições idênticas em andamento (single-flight)
+
+import asyncio
+import threading
+import time
+
+from src.ollama_integration.async_client import AsyncOllamaClient
+from src.ollama_integration.cancellation import CancelToken
+from src.ollama_integration.client import OllamaClient
+from src.ollama_integration.scheduler import RequestScheduler
+from src.ollama_integration.singleflight import SingleFlight
+from src.ollama_integration.telemetry import MetricsSink
+from tests.fake_ollama import FakeOllamaServer
+
+MESSAGES_EXAMPLE = [{"role": "user", "content": "Descreva a coluna CODCLI"}]
+
+def run_in_threads(n, target):
+    results = [None] * n
+    def worker(i):
+        results[i] = target()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=10)
+    return results
+
+def test_do_runs_function_once_for_concurrent_callers():
+    group = SingleFlight()
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "sugestão"
+
+    results = run_in_threads(5, lambda: group.do("chave", slow))
+    assert results == ["sugestão"] * 5
+    assert len(calls) == 1
+    assert group.stats() == {"leaders": 1, "coalesced": 4, "in_flight": 0}
+    assert group.do("chave", lambda: "nova") == "nova" # Terminada, a chave sai de circulação
+
+def test_identical_streams_share_one_generation():
+    with FakeOllamaServer(reply="um dois três quatro", chunk_delay=0.05) as server:
+        scheduler = RequestScheduler()
+        with OllamaClient(api_url=server.chat_url, scheduler=scheduler, metrics=MetricsSink()) as client:
+            def consume():
+                return "".join(client.chat_completion(MESSAGES_EXAMPLE, stream=True))
+
+            first = client.chat_completion(MESSAGES_EXAMPLE, stream=True)
+            assert next(first) == "um " # Já em andamento quando os outros chegam
+            others = run_in_threads(3, consume)
+            assert "um " + "".join(first) == "um dois três quatro "
+            assert others == ["um dois três quatro "] * 3
+            assert client.singleflight.stats()["coalesced"] == 3
+            assert client.chat_completion(MESSAGES_EXAMPLE) == "um dois três quatro" # Sem stream: chave própria
+        assert server.requests_by_path["/api/chat"] == 2
+        assert scheduler.metrics()["in_flight"] == 0
+
+def test_stream_is_closed_when_every_subscriber_leaves():
+    with FakeOllamaServer(reply="a b c d e f g h", chunk_delay=0.02) as server:
+        scheduler = RequestScheduler()
+        with OllamaClient(api_url=server.chat_url, scheduler=scheduler, metrics=MetricsSink()) as client:
+            first = client.chat_completion(MESSAGES_EXAMPLE, stream=True)
+            second = client.chat_completion(MESSAGES_EXAMPLE, stream=True)
+            assert next(first) == "a " and next(second) == "a "
+            first.close()
+            assert scheduler.metrics()["in_flight"] == 1 # Ainda há um assinante
+            second.close()
+            assert scheduler.metrics()["in_flight"] == 0
+            assert client.singleflight.stats()["in_flight"] == 0
+
+def test_cancellable_streams_are_coalesced_and_cancel_only_their_subscriber():
+    with FakeOllamaServer(reply="um dois três quatro cinco", chunk_delay=0.05) as server:
+        scheduler = RequestScheduler()
+        with OllamaClient(api_url=server.chat_url, scheduler=scheduler, metrics=MetricsSink()) as client:
+            first_token, second_token = CancelToken(), CancelToken()
+            first = client.chat_completion(MESSAGES_EXAMPLE, stream=True, cancel=first_token)
+            second = client.chat_completion(MESSAGES_EXAMPLE, stream=True, cancel=second_token)
+            assert next(first) == "um " and next(second) == "um "
+            first_token.cancel() # Ex.: rerun do Streamlit numa das abas
+            assert list(first) == []
+            assert "um " + "".join(second) == "um dois três quatro cinco "
+            assert client.singleflight.stats() == {"leaders": 1, "coalesced": 1, "in_flight": 0}
+        assert server.requests_by_path["/api/chat"] == 1
+        assert server.aborted_streams == 0
+        assert scheduler.metrics()["in_flight"] == 0
+
+def test_last_cancelled_subscriber_aborts_the_generation():
+    with FakeOllamaServer(reply=" ".join(["palavra"] * 200), chunk_delay=0.01) as server:
+        scheduler = RequestScheduler()
+        with OllamaClient(api_url=server.chat_url, scheduler=scheduler, metrics=MetricsSink()) as client:
+            tokens = [CancelToken(), CancelToken()]
+            streams = [client.chat_completion(MESSAGES_EXAMPLE, stream=True, cancel=token) for token in tokens]
+            assert [next(stream) for stream in streams] == ["palavra "] * 2
+            waiting = []
+            reader = threading.Thread(target=lambda: waiting.extend(streams[1])) # Bloqueado esperando chunks
+            reader.start()
+            tokens[0].cancel()
+            tokens[1].cancel()
+            reader.join(2)
+            assert not reader.is_alive() and len(waiting) < 150
+            deadline = time.monotonic() + 2
+            while server.aborted_streams == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert server.aborted_streams == 1
+        assert server.requests_by_path["/api/chat"] == 1
+
+def test_async_identical_streams_share_one_generation():
+    scheduler = RequestScheduler()
+    async def run():
+        async with AsyncOllamaClient(api_url=server.chat_url, scheduler=scheduler, metrics=MetricsSink()) as client:
+            async def consume(cancel=None, stop_after=None):
+                chunks = []
+                async for chunk in client.achat_completion(MESSAGES_EXAMPLE, cancel=cancel):
+                    chunks.append(chunk)
+                    if len(chunks) == stop_after:
+                        cancel.cancel() # Só este assinante sai
+                return "".join(chunks)
+            results = await asyncio.gather(consume(), consume(), consume(CancelToken(), stop_after=1))
+            return results, client.singleflight.stats()
+
+    with FakeOllamaServer(reply="um dois três quatro", chunk_delay=0.05) as server:
+        (full, other, cancelled), stats = asyncio.run(run())
+        assert full == other == "um dois três quatro "
+        assert cancelled == "um "
+        assert stats == {"leaders": 1, "coalesced": 2, "in_flight": 0}
+        assert server.requests_by_path["/api/chat"] == 1
+    assert scheduler.metrics()["in_flight"] == 0
+
+def test_async_stream_is_closed_when_every_subscriber_leaves():
+    scheduler = RequestScheduler()
+    async def run():
+        async with AsyncOllamaClient(api_url=server.chat_url, scheduler=scheduler, metrics=MetricsSink()) as client:
+            first = client.achat_completion(MESSAGES_EXAMPLE)
+            second = client.achat_completion(MESSAGES_EXAMPLE)
+            assert await first.__anext__() == "a " and await second.__anext__() == "a "
+            await first.aclose()
+            await asyncio.sleep(0.05)
+            assert scheduler.metrics()["in_flight"] == 1 # Ainda há um assinante
+            await second.aclose()
+            for _ in range(50):
+                if scheduler.metrics()["in_flight"] == 0:
+                    break
+                await asyncio.sleep(0.02)
+            return client.singleflight.stats()
+
+    with FakeOllamaServer(reply="a b c d e f g h i j k l", chunk_delay=0.05) as server:
+        assert asyncio.run(run())["in_flight"] == 0
+        assert server.requests_by_path["/api/chat"] == 1
+    assert scheduler.metrics()["in_flight"] == 0
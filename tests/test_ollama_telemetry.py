@@ -0,0 +1,64 @@
+# Testes da telemetria de chamadas ao Ollama (TTFT, carga, prompt, geração)
+
+import asyncio
+
+import pytest
+
+from src.ollama_integration.async_client import AsyncOllamaClient
+from src.ollama_integration.client import OllamaClient
+from src.ollama_integration.resilience import RetryPolicy
+from src.ollama_integration.scheduler import RequestScheduler
+from src.ollama_integration.telemetry import MetricsSink
+from tests.fake_ollama import FakeOllamaServer
+
+MESSAGES_EXAMPLE = [{"role": "user", "content": "Olá"}]
+
+def test_stream_timing_includes_ttft_and_ollama_metrics():
+    sink = MetricsSink()
+    received = []
+    with FakeOllamaServer(reply="um dois três quatro") as server:
+        with OllamaClient(api_url=server.chat_url, scheduler=RequestScheduler(), metrics=sink) as client:
+            text = "".join(client.chat_completion(MESSAGES_EXAMPLE, stream=True, on_timing=received.append))
+
+    assert text == "um dois três quatro "
+    assert len(received) == 1
+    timing = received[0]
+    assert timing.ok and timing.stream and not timing.cached
+    assert 0 <= timing.queue_wait_s <= timing.ttft_s <= timing.total_s
+    assert timing.load_duration_s == pytest.approx(0.1)
+    assert timing.prompt_eval_count == 12 and timing.prompt_eval_duration_s == pytest.approx(0.2)
+    assert timing.eval_count == 4 and timing.tokens_per_s == pytest.approx(16.0)
+
+    summary = sink.summary()["llama3"]
+    assert summary["calls"] == 1 and summary["errors"] == 0
+    assert summary["load_avg_s"] == pytest.approx(0.1)
+    assert summary["generation_avg_s"] == pytest.approx(0.25)
+
+def test_non_stream_and_error_timings_are_recorded():
+    sink = MetricsSink()
+    with FakeOllamaServer() as server:
+        with OllamaClient(api_url=server.chat_url, scheduler=RequestScheduler(), metrics=sink) as client:
+            assert client.chat_completion(MESSAGES_EXAMPLE, model="phi3") == "Resposta simulada."
+    with OllamaClient(api_url="http://127.0.0.1:1/api/chat", scheduler=RequestScheduler(), metrics=sink,
+                      retry=RetryPolicy(max_retries=0)) as client:
+        assert client.chat_completion(MESSAGES_EXAMPLE, model="phi3") is None
+
+    ok, failed = sink.recent()
+    assert ok["ok"] and ok["ttft_s"] is None and ok["eval_duration_s"] == pytest.approx(0.25)
+    assert not failed["ok"] and failed["eval_count"] is None
+    assert sink.summary()["phi3"]["errors"] == 1
+
+def test_async_stream_timing():
+    sink = MetricsSink()
+    received = []
+
+    async def run():
+        async with AsyncOllamaClient(api_url=server.chat_url, scheduler=RequestScheduler(), metrics=sink) as client:
+            return [chunk async for chunk in client.achat_completion(MESSAGES_EXAMPLE, on_timing=received.append)]
+
+    with FakeOllamaServer(reply="Olá Mundo") as server:
+        asyncio.run(run())
+
+    assert len(received) == 1 and received[0].ok
+    assert received[0].ttft_s is not None and received[0].eval_count == 2
+    assert sink.summary()["llama3"]["calls"] == 1
@@ -0,0 +1,91 @@
+# Testes das métricas de desempenho por mensagem e dos agregados por hora
+
+from datetime import datetime, timezone
+
+import pytest
+
+from src.database import history
+from src.database.history import HistoryWriter
+from src.database.perf_rollup import PerfRollup, _as_hour, compare_periods, latency_report, message_metrics
+
+def add(conn, timestamp, model, latency_ms, status="ok", ttft_ms=None, tokens=(10, 20)):
+    with conn:
+        conn.execute("INSERT INTO chat_history(timestamp, user_message, assistant_message, model, ttft_ms, latency_ms, "
+                     "prompt_tokens, completion_tokens, status) VALUES(?,?,?,?,?,?,?,?,?)",
+                     (timestamp, "p", "r" if status == "ok" else "", model, ttft_ms, latency_ms, *tokens, status))
+
+def test_writer_stores_message_metrics(manager):
+    class Timing:
+        model, prompt_eval_count, eval_count = "llama3", 120, 45
+    writer = HistoryWriter(manager=manager).start()
+    message_id = writer.save_chat_message("p", "r", session_id="s",
+                                          metrics=message_metrics("padrão", "ok", 1.2345, ttft_s=0.2, timing=Timing())).result(timeout=5)
+    writer.stop()
+    row = dict(manager.connection().execute("SELECT * FROM chat_history WHERE id = ?", (message_id,)).fetchone())
+    assert (row["model"], row["ttft_ms"], row["latency_ms"], row["prompt_tokens"], row["completion_tokens"],
+            row["status"]) == ("llama3", 200, 1234, 120, 45, "ok")
+    with pytest.raises(ValueError):
+        writer.save_chat_message("p", "r", metrics={"latencia": 1})
+
+def test_rollup_only_recomputes_dirty_hours(manager):
+    conn = manager.connection()
+    for i in range(1, 101):
+        add(conn, f"2025-06-01 10:{i % 60:02d}:00", "llama3", i * 10, ttft_ms=i)
+    add(conn, "2025-06-01 10:30:00", "llama3", None, status="error")
+    add(conn, "2025-06-01 11:05:00", "phi3", 500)
+    add(conn, "2025-06-01 09:00:00", "phi3", 50, status="cancelled")
+    history.save_chat_message("sem métricas", "r") # Mensagens sem status não marcam a hora
+
+    rollup = PerfRollup(manager=manager)
+    assert rollup.run_once()["hours"] == 3
+    row = dict(conn.execute("SELECT * FROM chat_perf_hourly WHERE hour = '2025-06-01 10:00:00'").fetchone())
+    assert (row["requests"], row["errors"], row["ok"]) == (101, 1, 100)
+    assert (row["latency_p50_ms"], row["latency_p95_ms"], row["latency_p99_ms"]) == (500, 950, 990)
+    assert row["ttft_p95_ms"] == 95 and row["prompt_tokens"] == 1010
+    assert rollup.run_once()["hours"] == 0 # Nada novo
+
+    add(conn, "2025-06-01 11:59:00", "phi3", 700) # Chegou atrasada: só a hora dela é refeita
+    assert rollup.run_once() == {"hours": 1, "rows": 2, "duration_s": rollup.last_report["duration_s"]}
+    assert tuple(conn.execute("SELECT ok, latency_max_ms FROM chat_perf_hourly "
+                              "WHERE hour = '2025-06-01 11:00:00'").fetchone()) == (2, 700)
+
+def test_report_merges_hours_without_raw_rows(manager):
+    conn = manager.connection()
+    for hour in range(3):
+        for i in range(1, 21):
+            add(conn, f"2025-06-01 {10 + hour:02d}:{i:02d}:00", "llama3", 100 * i)
+    PerfRollup(manager=manager).run_once()
+    with conn:
+        conn.execute("DELETE FROM chat_history") # Ex.: arquivadas pela retenção; os agregados ficam
+    report = latency_report(since="2025-06-01 10:30", until="2025-06-01 12:00")
+    assert len(report) == 1 and report[0]["hours"] == 2 and report[0]["requests"] == 40
+    assert abs(report[0]["latency_p95_ms"] - 1900) <= 190 # Resolução do histograma
+    assert report[0]["avg_latency_ms"] == 1050
+
+def test_compare_periods_flags_p95_regression_after_model_switch(manager):
+    conn = manager.connection()
+    for i in range(1, 41):
+        add(conn, f"2025-06-01 10:{i:02d}:00", "llama3", 1000 + i)
+        add(conn, f"2025-06-01 14:{i:02d}:00", "mistral", 1000 + 30 * i)
+    PerfRollup(manager=manager).run_once()
+    result = compare_periods("2025-06-01 12:00:00", window_hours=6)
+    assert [m["model"] for m in result["before"]["models"]] == ["llama3"]
+    assert [m["model"] for m in result["after"]["models"]] == ["mistral"]
+    assert result["regressed"] and result["p95_change"] > 0.5
+    assert not compare_periods("2025-06-01 12:00:00", window_hours=1)["regressed"] # Sem dados dos dois lados
+
+def test_as_hour_parses_partial_timestamps():
+    assert _as_hour("2025-06-01") == "2025-06-01 00:00:00"
+    assert _as_hour("2025-06-01 14:35") == "2025-06-01 14:00:00"
+    assert _as_hour("2025-06-01T14:35:12") == "2025-06-01 14:00:00"
+    assert _as_hour(datetime(2025, 6, 1, 14, 35, tzinfo=timezone.utc)) == "2025-06-01 14:00:00"
+    with pytest.raises(ValueError):
+        _as_hour("ontem")
+
+def test_report_accepts_date_only_bounds(manager):
+    conn = manager.connection()
+    add(conn, "2025-06-01 23:10:00", "llama3", 100)
+    add(conn, "2025-06-02 00:10:00", "llama3", 200)
+    PerfRollup(manager=manager).run_once()
+    report = latency_report(since="2025-06-01", until="2025-06-02")
+    assert len(report) == 1 and report[0]["requests"] == 1 and report[0]["latency_max_ms"] == 100
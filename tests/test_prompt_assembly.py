@@ -0,0 +1,49 @@
+# Testes da montagem de prompts com prefixo estável (reaproveitamento do cache KV)
+
+from src.core.context_window import ContextWindowManager
+from src.core.prompt_assembly import PrefixReuseTracker, assemble_prompt, fingerprint_chain
+
+SCHEMA = {"PEDIDOS": ["PED_CODIGO", "PED_VALOR"], "CLIENTES": ["CLI_CODIGO", "CLI_NOME"]}
+
+def test_stable_parts_come_first_in_deterministic_order():
+    history = [{"role": "user", "content": "Oi  "}, {"role": "assistant", "content": "Olá!"}]
+    first = assemble_prompt("Quais tabelas?", history, system_prompt="Você é um DBA.", schema_context=SCHEMA,
+                            summary="Falamos de pedidos.", recalled=[{"role": "user", "content": "CLIENTES?"}])
+    assert [m["role"] for m in first] == ["system", "system", "system", "user", "assistant", "system", "user"]
+    assert first[1]["content"].index("CLIENTES") < first[1]["content"].index("PEDIDOS") # Chaves ordenadas
+    assert first[3]["content"] == "Oi" # Espaços no fim não mudam o prefixo
+
+    reordered = assemble_prompt("Outra pergunta", history, system_prompt="Você é um DBA.",
+                                schema_context=dict(reversed(list(SCHEMA.items()))), summary="Falamos de pedidos.")
+    assert fingerprint_chain(first)[:5] == fingerprint_chain(reordered)[:5]
+
+def test_tracker_reports_prefix_reuse_and_stable_hits():
+    tracker = PrefixReuseTracker()
+    turn1 = assemble_prompt("A?", system_prompt="Sistema", schema_context=SCHEMA)
+    turn2 = assemble_prompt("B?", turn1[2:] + [{"role": "assistant", "content": "a"}], system_prompt="Sistema", schema_context=SCHEMA)
+    assert tracker.observe("s1", turn1)["reused_messages"] == 0
+    reuse = tracker.observe("s1", turn2)
+    assert reuse["reused_messages"] == 3 and reuse["stable_hit"]
+    assert tracker.observe("s2", turn1)["stable_hit"] # Outra sessão, mesma parte fixa
+
+    stats = tracker.stats()
+    assert stats["prompts"] == 3 and abs(stats["stable_prefix_hit_rate"] - 2 / 3) < 1e-9
+    assert 0 < stats["prefix_reuse_rate"] < 1
+
+def run_session(manager, turns=40):
+    history, starts = [], []
+    for i in range(turns):
+        message = f"Pergunta {i}: " + "detalhes " * 20
+        messages = manager.build("s", history, message, model="llama3", system_prompt="Você é um DBA.", schema_context=SCHEMA)
+        assert manager.count(messages) <= 800
+        starts.append(messages[2]["content"] if len(messages) > 3 else None)
+        history.append((message, f"Resposta {i}: " + "texto " * 20))
+    return sum(1 for a, b in zip(starts, starts[1:]) if a != b), manager.prefix_stats()["prefix_reuse_rate"]
+
+def test_window_keeps_prefix_stable_across_turns():
+    changes, reuse = run_session(ContextWindowManager(budget=800, summarizer=None))
+    # refill_ratio=1 equivale à janela deslizante antiga: o início anda a cada turno
+    sliding_changes, sliding_reuse = run_session(ContextWindowManager(budget=800, summarizer=None, refill_ratio=1.0))
+
+    assert changes <= 40 // 3 < sliding_changes
+    assert reuse > sliding_reuse + 0.2